@@ -1,3 +1,33 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from .models import CampaignPost, PromptLog, ScheduledPost
+from .retries import redrive
+from . import scheduler
 
-# Register your models here.
+@admin.action(description="Re-drive selected dead-lettered posts")
+def redrive_dead_letters(modeladmin, request, queryset):
+    count = redrive(queryset)
+    # update() sends no post_save, so wake the scheduler explicitly.
+    scheduler.notify()
+    modeladmin.message_user(request, f"{count} post(s) returned to the scheduler.", messages.SUCCESS)
+
+@admin.register(CampaignPost)
+class CampaignPostAdmin(admin.ModelAdmin):
+    list_display = ('id', 'campaign', 'platform', 'scheduled_at', 'posted', 'attempt_count', 'next_attempt_at', 'dead_lettered', 'last_error')
+    list_filter = ('dead_lettered', 'posted', 'platform')
+    search_fields = ('campaign__name', 'last_error')
+    readonly_fields = ('scheduled_at', 'published_at', 'claimed_by', 'claim_expires_at', 'redriven_at')
+    actions = [redrive_dead_letters]
+
+@admin.register(ScheduledPost)
+class ScheduledPostAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'platform', 'scheduled_time', 'posted', 'attempt_count', 'next_attempt_at', 'dead_lettered', 'last_error')
+    list_filter = ('dead_lettered', 'posted', 'platform')
+    search_fields = ('user__username', 'last_error')
+    readonly_fields = ('published_at', 'claimed_by', 'claim_expires_at', 'redriven_at')
+    actions = [redrive_dead_letters]
+
+@admin.register(PromptLog)
+class PromptLogAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'model_used', 'created_on', 'last_used_on', 'hit_count', 'latency')
+    search_fields = ('cache_key', 'prompt_input')
+    readonly_fields = ('cache_key', 'hit_count', 'last_used_on', 'latency')
@@ -1,9 +1,14 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 class ClientManagementConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'clientManagement'
 
     def ready(self):
-        from . import scheduler
-        scheduler.start()
\ No newline at end of file
+        from . import signals
+        # The scheduler normally runs in its own process via
+        # `manage.py run_scheduler`; web processes only start it on opt-in.
+        if getattr(settings, 'SCHEDULER_AUTOSTART', False):
+            from . import scheduler
+            scheduler.start()
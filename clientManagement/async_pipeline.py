@@ -0,0 +1,384 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import urlparse
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from .dispatcher import TickDispatcher, clear_in_flight, mark_in_flight, stage_overrides
+from .models import CampaignPost
+from .providers import get_provider
+from . import cloudinary_cache, downloads, http_client, openai_cache, openai_governor, ratelimit, tasks, utils
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+DEFAULT_ASYNC_STAGE_LIMITS = {
+    'publish': 64,
+    'prompt': 16,
+    'content': 128,
+    'scheduled': 64,
+    'catchup': 16,
+}
+DEFAULT_ASYNC_MAX_CONNECTIONS = 200
+DEFAULT_ASYNC_BLOCKING_WORKERS = 16
+
+_lock = threading.Lock()
+_loop = None
+_loop_thread = None
+_client = None
+_blocking_pool = None
+_stage_semaphores = {}
+
+def get_loop():
+    """The background event loop every async job of this process runs on."""
+    global _loop, _loop_thread
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=_loop.run_forever, name='scheduler-asyncio', daemon=True)
+            _loop_thread.start()
+        return _loop
+
+def _get_blocking_pool():
+    global _blocking_pool
+    with _lock:
+        if _blocking_pool is None:
+            workers = getattr(settings, 'ASYNC_BLOCKING_WORKERS', DEFAULT_ASYNC_BLOCKING_WORKERS)
+            _blocking_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scheduler-blocking')
+        return _blocking_pool
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Await sync code that has no async client (OAuth1 signing, Cloudinary,
+    image downloads) on a small bounded thread pool.
+    """
+    def call():
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return await asyncio.get_running_loop().run_in_executor(_get_blocking_pool(), call)
+
+def _get_client():
+    global _client
+    if _client is None and httpx is not None:
+        connect, read = http_client.default_timeout()
+        max_connections = getattr(settings, 'ASYNC_MAX_CONNECTIONS', DEFAULT_ASYNC_MAX_CONNECTIONS)
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read, connect=connect),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+    return _client
+
+async def request(method, url, **kwargs):
+    """
+    Async counterpart of http_client.request. Uses a pooled httpx client
+    when httpx is installed; otherwise the call is made by the sync client
+    on the blocking pool.
+    """
+    client = _get_client()
+    if client is None:
+        return await run_blocking(http_client.request, method, url, **kwargs)
+
+    timeout = kwargs.pop('timeout', None)
+    if isinstance(timeout, tuple):
+        timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+    if timeout is not None:
+        kwargs['timeout'] = timeout
+    host = urlparse(url).netloc
+    started = time.monotonic()
+    try:
+        response = await client.request(method, url, **kwargs)
+    except httpx.HTTPError:
+        http_client.record(host, time.monotonic() - started, True)
+        raise
+    http_client.record(host, time.monotonic() - started, response.status_code >= 500)
+    return response
+
+async def agenerate_text(text_prompt, max_tokens=256):
+    try:
+        async with openai_governor.aadmit("chat"):
+            return await get_provider().agenerate_text(text_prompt, max_tokens)
+    except Exception as e:
+        print(f"Exception occurred generating text: {e}")
+        return ""
+
+async def agenerate_image(image_prompt):
+    try:
+        async with openai_governor.aadmit("image"):
+            return await get_provider().agenerate_image(image_prompt)
+    except Exception as e:
+        print(f"Exception occurred generating image: {e}")
+        return None
+
+async def agenerate_with_openai(text_prompt, image_prompt=None, max_tokens=256, cache=True, user=None, validate=None):
+    """Coroutine version of utils.generate_with_openai, sharing its cache."""
+    key = None
+    if cache and openai_cache.enabled():
+        key = utils.openai_cache_key(text_prompt, image_prompt, max_tokens)
+        cached = await sync_to_async(openai_cache.lookup)(key, with_image=image_prompt is not None)
+        if cached is not None:
+            return cached
+    else:
+        openai_cache.record_bypass()
+
+    started = time.monotonic()
+    if image_prompt is None:
+        text_generated, image_url = await agenerate_text(text_prompt, max_tokens), None
+    else:
+        text_generated, image_url = await asyncio.gather(
+            agenerate_text(text_prompt, max_tokens),
+            agenerate_image(image_prompt),
+        )
+
+    if key:
+        await sync_to_async(utils.cache_openai_response)(
+            key, text_prompt, image_prompt, text_generated, image_url, time.monotonic() - started, user, validate,
+        )
+    return text_generated, image_url
+
+async def _agenerate_prompt_batch(posts, errors):
+    if len(posts) == 1:
+        post = posts[0]
+        try:
+            text, _ = await agenerate_with_openai(utils.build_prompt(post), validate=json.loads)
+            await sync_to_async(utils.apply_prompts)(post, json.loads(text))
+        except Exception as e:
+            errors[post.id] = str(e)
+        return
+
+    text, _ = await agenerate_with_openai(
+        utils.build_batch_prompt(posts), max_tokens=utils.batch_max_tokens(posts), validate=utils.parse_batch_prompts,
+    )
+    if not (text or "").strip():
+        utils.record_batch_error(posts, errors)
+        return
+    parsed = utils.parse_batch_prompts(text)
+    if not utils.batch_has_results(posts, parsed):
+        middle = len(posts) // 2
+        await asyncio.gather(
+            _agenerate_prompt_batch(posts[:middle], errors),
+            _agenerate_prompt_batch(posts[middle:], errors),
+        )
+        return
+
+    missing = await sync_to_async(utils.apply_batch_prompts)(posts, parsed)
+    if missing:
+        await _agenerate_prompt_batch(missing, errors)
+
+async def agenerate_prompts_batch(campaign_post_ids):
+    """Coroutine version of utils.generate_prompts_batch."""
+    batches = await sync_to_async(utils.load_prompt_batches)(campaign_post_ids)
+    errors = {}
+    await asyncio.gather(*(_agenerate_prompt_batch(batch, errors) for batch in batches))
+    return errors
+
+async def agenerate_content(campaign_post_id):
+    """Coroutine version of utils.generate_content_task."""
+    post = await sync_to_async(CampaignPost.objects.select_related('campaign__user').get)(id=campaign_post_id)
+    if not post.is_prompt_generated or post.is_content_generated:
+        return
+
+    text, image_url = await agenerate_with_openai(post.text_prompt, post.image_prompt, cache=False)
+    # Streamed to a temporary file on the blocking pool, so memory stays flat.
+    image = await run_blocking(downloads.download_or_none, image_url)
+    try:
+        saved = await sync_to_async(utils.save_generated_content)(post, text, image_url, image)
+    finally:
+        if image is not None:
+            image.close()
+    if saved:
+        cloudinary_cache.schedule(post.image_file, post.platform)
+
+async def arequest_platform(media, platform, method, url, **kwargs):
+    """Coroutine version of PostSocialMedia._request."""
+    key = media._credential_key(platform)
+    try:
+        await ratelimit.aacquire(platform, key)
+        response = await request(method, url, **kwargs)
+        await sync_to_async(ratelimit.observe)(platform, key, response)
+    except ratelimit.RateLimited as e:
+        media.rate_limited = e
+        raise
+    return response
+
+async def arun_steps(media, steps):
+    """
+    Coroutine version of utils.run_steps: platform requests go through the
+    async client, other calls (Cloudinary uploads) run on the blocking pool.
+    """
+    value, error = None, None
+    while True:
+        try:
+            func, args, kwargs = steps.throw(error) if error else steps.send(value)
+        except StopIteration as stop:
+            return stop.value
+        value, error = None, None
+        try:
+            if func == media._request:
+                value = await arequest_platform(media, *args, **kwargs)
+            else:
+                value = await run_blocking(func, *args, **kwargs)
+        except Exception as e:
+            error = e
+
+async def apublish(media, platform):
+    """
+    Coroutine version of PostSocialMedia.publish. Facebook, Instagram and
+    Reddit are plain form POSTs made on the async client; Twitter's OAuth1
+    client is sync-only and runs on the blocking pool.
+    """
+    steps = media.publish_steps(platform)
+    if steps is None:
+        return await run_blocking(media.publish, platform)
+    return media.publish_result(await arun_steps(media, steps))
+
+async def apublish_campaign_post(campaign_post_id, credentials=None):
+    post, media, result = await sync_to_async(tasks.prepare_campaign_post)(campaign_post_id, credentials)
+    if media is None:
+        return result
+    result = await apublish(media, post.platform.lower())
+    return await sync_to_async(tasks.finish_campaign_post)(post, result)
+
+async def apublish_scheduled_post(scheduled_post_id, credentials=None):
+    scheduled, media, result = await sync_to_async(tasks.prepare_scheduled_post)(scheduled_post_id, credentials)
+    if media is None:
+        return result
+    result = await apublish(media, scheduled.platform)
+    return await sync_to_async(tasks.finish_scheduled_post)(scheduled, result)
+
+async def acatch_up_campaign_post(campaign_post_id, credentials=None):
+    errors = await agenerate_prompts_batch([campaign_post_id])
+    if errors:
+        raise RuntimeError(next(iter(errors.values())))
+    await agenerate_content(campaign_post_id)
+    return await apublish_campaign_post(campaign_post_id, credentials=credentials)
+
+async def aattempt(model, func, row_id, **kwargs):
+    """Coroutine version of tasks.attempt."""
+    try:
+        result = await func(row_id, **kwargs)
+    except Exception as e:
+        await sync_to_async(tasks.record_attempt_error)(model, row_id, e)
+        raise
+    await sync_to_async(tasks.record_attempt_result)(model, row_id, result)
+    return result
+
+async def aattempt_prompt_batch(post_ids):
+    try:
+        errors = await agenerate_prompts_batch(post_ids)
+    except Exception as e:
+        errors = {post_id: str(e) for post_id in post_ids}
+    await sync_to_async(tasks.record_prompt_batch)(post_ids, errors)
+    return errors
+
+def as_coroutine(func, args, kwargs):
+    """
+    Map a job submitted with the sync pipeline's functions to its coroutine
+    version. Steps without one run on the blocking pool.
+    """
+    if func is tasks.attempt:
+        model, step, row_id = args
+        async_step = {
+            tasks.publish_campaign_post: apublish_campaign_post,
+            tasks.publish_scheduled_post: apublish_scheduled_post,
+            tasks.catch_up_campaign_post: acatch_up_campaign_post,
+            utils.generate_content_task: agenerate_content,
+        }.get(step) or partial(run_blocking, step)
+        return partial(aattempt, model, async_step, row_id, **kwargs)
+    if func is tasks.attempt_prompt_batch:
+        return partial(aattempt_prompt_batch, *args, **kwargs)
+    if asyncio.iscoroutinefunction(func):
+        return partial(func, *args, **kwargs)
+    return partial(run_blocking, func, *args, **kwargs)
+
+def get_stage_semaphore(stage):
+    # Only touched from the event loop thread.
+    if stage not in _stage_semaphores:
+        limits = dict(getattr(settings, 'ASYNC_STAGE_LIMITS', DEFAULT_ASYNC_STAGE_LIMITS))
+        # run_scheduler's --publish-concurrency/--generation-concurrency.
+        limits.update(stage_overrides())
+        _stage_semaphores[stage] = asyncio.Semaphore(limits.get(stage, DEFAULT_ASYNC_STAGE_LIMITS.get(stage, 1)))
+    return _stage_semaphores[stage]
+
+class AsyncTickDispatcher(TickDispatcher):
+    """
+    TickDispatcher that runs each job as a coroutine on the shared event
+    loop, so hundreds of posts can wait on OpenAI and platform APIs at once
+    without a thread (and DB connection) each. ORM work goes through
+    sync_to_async, which runs it on a single thread. Stage limits come from
+    ASYNC_STAGE_LIMITS, overridden by dispatcher.configure(); deadline,
+    carry-over and in-flight handling are the same as in the thread pool.
+    """
+    def submit(self, stage, key, func, *args, **kwargs):
+        make_coro = as_coroutine(func, args, kwargs)
+        if not mark_in_flight(stage, key):
+            return False
+        job = {'stage': stage, 'key': key, 'status': 'queued', 'error': None}
+        try:
+            job['future'] = asyncio.run_coroutine_threadsafe(self._run_async_job(job, make_coro), get_loop())
+        except Exception:
+            clear_in_flight(stage, key)
+            raise
+        self.jobs.append(job)
+        return True
+
+    async def _run_async_job(self, job, make_coro):
+        semaphore = get_stage_semaphore(job['stage'])
+        try:
+            try:
+                await asyncio.wait_for(semaphore.acquire(), self.remaining())
+            except asyncio.TimeoutError:
+                job['status'] = 'carried_over'
+                return
+            try:
+                job['status'] = 'running'
+                job['result'] = await make_coro()
+                job['status'] = 'done'
+            except Exception as e:
+                job['status'] = 'failed'
+                job['error'] = str(e)
+            finally:
+                semaphore.release()
+        finally:
+            if self.on_job_finished:
+                try:
+                    await sync_to_async(self.on_job_finished)(job['stage'], job['key'])
+                except Exception as e:
+                    print(f"Error finishing {job['stage']} job {job['key']}: {e}")
+            clear_in_flight(job['stage'], job['key'])
+
+    def run(self):
+        report = super().run()
+        asyncio.run_coroutine_threadsafe(sync_to_async(close_old_connections)(), get_loop())
+        return report
+
+async def _drain(timeout):
+    pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    if pending:
+        await asyncio.wait(pending, timeout=timeout)
+    if _client is not None:
+        await _client.aclose()
+
+def shutdown(timeout=None):
+    """Let running jobs finish (up to ``timeout``), then stop the loop."""
+    global _loop, _loop_thread, _client, _blocking_pool
+    with _lock:
+        loop, thread, pool = _loop, _loop_thread, _blocking_pool
+        _loop = _loop_thread = _blocking_pool = None
+    if loop is not None:
+        try:
+            asyncio.run_coroutine_threadsafe(_drain(timeout), loop).result()
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(timeout)
+            _client = None
+            _stage_semaphores.clear()
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,100 @@
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cloudinary.uploader
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, close_old_connections
+from .models import CloudinaryUpload, MediaBlob
+
+# Platforms that take the image as a public URL rather than an upload.
+CLOUDINARY_PLATFORMS = ('instagram', 'reddit')
+DEFAULT_PUBLIC_ID_PREFIX = "generated"
+DEFAULT_PREUPLOAD_WORKERS = 2
+CHUNK_SIZE = 64 * 1024
+
+_lock = threading.Lock()
+_executor = None
+# Serializes uploads of the same image within this process (striped by hash).
+_upload_locks = [threading.Lock() for _ in range(64)]
+_stats = {'reused': 0, 'uploaded': 0, 'preuploads': 0, 'preupload_errors': 0}
+
+def _count(key):
+    with _lock:
+        _stats[key] += 1
+
+def image_sha256(name):
+    """sha256 of a stored image: read from its MediaBlob, else hashed in chunks."""
+    sha256 = MediaBlob.objects.filter(name=name).values_list('sha256', flat=True).first()
+    if sha256:
+        return sha256
+    hasher = hashlib.sha256()
+    with default_storage.open(name, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def upload_url(name):
+    """
+    Cloudinary ``secure_url`` for the stored image ``name``, uploading it
+    only the first time these bytes are seen. The public id is derived from
+    the hash, so even concurrent uploads from several processes land on one
+    asset.
+    """
+    sha256 = image_sha256(name)
+    with _upload_locks[int(sha256[:8], 16) % len(_upload_locks)]:
+        known = CloudinaryUpload.objects.filter(sha256=sha256).values_list('secure_url', flat=True).first()
+        if known:
+            _count('reused')
+            return known
+
+        prefix = getattr(settings, 'CLOUDINARY_PUBLIC_ID_PREFIX', DEFAULT_PUBLIC_ID_PREFIX)
+        with default_storage.open(name, 'rb') as f:
+            response = cloudinary.uploader.upload(
+                f, resource_type="image", public_id=f"{prefix}/{sha256}", overwrite=False,
+            )
+        secure_url = response.get('secure_url')
+        if not secure_url:
+            return None
+        _count('uploaded')
+        try:
+            CloudinaryUpload.objects.create(
+                sha256=sha256,
+                public_id=response.get('public_id', f"{prefix}/{sha256}"),
+                secure_url=secure_url,
+                size=response.get('bytes') or 0,
+            )
+        except IntegrityError:
+            # Recorded by another process in the meantime.
+            pass
+        return secure_url
+
+def _preupload(name):
+    try:
+        upload_url(name)
+        _count('preuploads')
+    except Exception as e:
+        _count('preupload_errors')
+        print(f"Error pre-uploading image to Cloudinary: {e}")
+    finally:
+        close_old_connections()
+
+def schedule(image_file, platform):
+    """
+    Upload the image for a post that will be published to ``platform`` in
+    the background, so publishing only has to look the URL up.
+    """
+    if platform not in CLOUDINARY_PLATFORMS or not image_file:
+        return
+    if not getattr(settings, 'CLOUDINARY_PREUPLOAD', True):
+        return
+    global _executor
+    with _lock:
+        if _executor is None:
+            workers = getattr(settings, 'CLOUDINARY_PREUPLOAD_WORKERS', DEFAULT_PREUPLOAD_WORKERS)
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cloudinary')
+    _executor.submit(_preupload, image_file.name)
+
+def stats():
+    with _lock:
+        return dict(_stats)
@@ -0,0 +1,136 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.urls import reverse
+from PIL import Image, features
+from .models import MediaBlob
+
+DEFAULT_RENDITION_DIR = "generated_images/renditions"
+DEFAULT_WIDTHS = (320, 640)
+DEFAULT_FORMATS = ('avif', 'webp')
+DEFAULT_QUALITY = 75
+DEFAULT_WORKERS = 2
+
+CONTENT_TYPES = {'avif': 'image/avif', 'webp': 'image/webp'}
+
+_lock = threading.Lock()
+_executor = None
+
+def widths():
+    return sorted(getattr(settings, 'IMAGE_RENDITION_WIDTHS', DEFAULT_WIDTHS))
+
+def formats():
+    """Configured formats this Pillow build can encode, best first."""
+    return [fmt for fmt in getattr(settings, 'IMAGE_RENDITION_FORMATS', DEFAULT_FORMATS) if fmt in CONTENT_TYPES and features.check(fmt)]
+
+def rendition_name(blob, width, fmt):
+    rendition_dir = getattr(settings, 'IMAGE_RENDITION_DIR', DEFAULT_RENDITION_DIR).strip('/')
+    return f"{rendition_dir}/{blob.sha256[:2]}/{blob.sha256}-{width}.{fmt}"
+
+def target_widths(blob):
+    # Never upscale: widths at or above the source size are served by the original.
+    return [width for width in widths() if not blob.width or width < blob.width]
+
+def generate(blob):
+    """
+    Write the missing resized WebP/AVIF copies of ``blob`` and record them
+    on it. Returns the renditions mapping.
+    """
+    renditions = {fmt: dict(sizes) for fmt, sizes in (blob.renditions or {}).items()}
+    quality = getattr(settings, 'IMAGE_RENDITION_QUALITY', DEFAULT_QUALITY)
+    with default_storage.open(blob.name, 'rb') as source_file:
+        source = Image.open(source_file)
+        source.load()
+    blob.width, blob.height = source.size
+    if source.mode not in ('RGB', 'RGBA'):
+        source = source.convert('RGBA' if 'transparency' in source.info or source.mode in ('LA', 'PA') else 'RGB')
+
+    for width in target_widths(blob):
+        height = max(1, round(blob.height * width / blob.width))
+        resized = None
+        for fmt in formats():
+            sizes = renditions.setdefault(fmt, {})
+            name = rendition_name(blob, width, fmt)
+            if not default_storage.exists(name):
+                resized = resized or source.resize((width, height), Image.LANCZOS)
+                buffer = BytesIO()
+                resized.save(buffer, format=fmt.upper(), quality=quality)
+                saved_name = default_storage.save(name, ContentFile(buffer.getvalue()))
+                if saved_name != name:
+                    # Made concurrently by the background pool or a lazy request.
+                    default_storage.delete(saved_name)
+            sizes[str(width)] = {'name': name, 'width': width, 'height': height}
+
+    MediaBlob.objects.filter(id=blob.id).update(width=blob.width, height=blob.height, renditions=renditions)
+    blob.renditions = renditions
+    return renditions
+
+def _generate_in_background(blob_id):
+    try:
+        generate(MediaBlob.objects.get(id=blob_id))
+    except MediaBlob.DoesNotExist:
+        pass
+    except Exception as e:
+        print(f"Error generating image renditions: {e}")
+    finally:
+        close_old_connections()
+
+def schedule(blob):
+    """Generate ``blob``'s renditions on a small background pool."""
+    global _executor
+    with _lock:
+        if _executor is None:
+            workers = getattr(settings, 'IMAGE_RENDITION_WORKERS', DEFAULT_WORKERS)
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='renditions')
+    _executor.submit(_generate_in_background, blob.id)
+
+def delete(blob):
+    for sizes in (blob.renditions or {}).values():
+        for rendition in sizes.values():
+            default_storage.delete(rendition['name'])
+
+def rendition_url(blob, width, fmt):
+    rendition = (blob.renditions or {}).get(fmt, {}).get(str(width))
+    if rendition:
+        return default_storage.url(rendition['name'])
+    # Not made yet: the lazy view generates it on first request.
+    return reverse('clientManagement:image_rendition', args=[blob.sha256, width, fmt])
+
+def picture(image_file, image_url, blob=None):
+    """
+    What a template needs to render an image responsively: ``src`` (the
+    original), ``sources`` (one ``srcset`` per rendition format) and the
+    intrinsic ``width``/``height``. None when there is no image.
+    """
+    src = image_file.url if image_file else image_url
+    if not src:
+        return None
+    if blob is None:
+        return {'src': src, 'sources': [], 'width': None, 'height': None}
+    sources = [
+        {
+            'type': CONTENT_TYPES[fmt],
+            'srcset': ", ".join(f"{rendition_url(blob, width, fmt)} {width}w" for width in target_widths(blob)),
+        }
+        for fmt in formats()
+    ]
+    return {
+        'src': src,
+        'sources': [source for source in sources if source['srcset']],
+        'width': blob.width,
+        'height': blob.height,
+    }
+
+def annotate(items):
+    """Set ``item.picture`` on Posts (or anything with image_file/image_url) with one query."""
+    items = list(items)
+    names = [item.image_file.name for item in items if item.image_file]
+    blobs = {blob.name: blob for blob in MediaBlob.objects.filter(name__in=names)}
+    for item in items:
+        blob = blobs.get(item.image_file.name) if item.image_file else None
+        item.picture = picture(item.image_file, item.image_url, blob)
+    return items
@@ -0,0 +1,248 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from functools import partial
+from django.conf import settings
+from django.db import close_old_connections
+
+DEFAULT_MAX_WORKERS = 16
+DEFAULT_STAGE_LIMITS = {
+    'publish': 8,
+    'prompt': 4,
+    'content': 4,
+    'scheduled': 4,
+    'catchup': 2,
+}
+DEFAULT_TICK_DEADLINE = 15
+DEFAULT_EXECUTION_MODE = 'threads'
+EXECUTION_MODES = ('threads', 'asyncio')
+
+_executor = None
+_executor_lock = threading.Lock()
+_max_workers = None
+_stage_limits = None
+_execution_mode = None
+# Jobs waiting for a slot in their stage, and the number running per stage.
+_stage_queues = {}
+_stage_running = {}
+_stage_lock = threading.Lock()
+# Set by shutdown(); queued jobs are then carried over instead of being
+# handed to a pool that would have to be re-created.
+_shutting_down = False
+_in_flight = set()
+_in_flight_lock = threading.Lock()
+
+def configure(max_workers=None, stage_limits=None, mode=None):
+    """Override the pool settings; must be called before the first tick."""
+    global _max_workers, _stage_limits, _execution_mode, _shutting_down
+    if mode is not None and mode not in EXECUTION_MODES:
+        raise ValueError(f"Unknown execution mode: {mode}")
+    with _executor_lock:
+        if _executor is not None:
+            raise RuntimeError("The scheduler worker pool is already running.")
+        _max_workers = max_workers
+        _stage_limits = stage_limits
+        _execution_mode = mode
+    with _stage_lock:
+        _shutting_down = False
+
+def execution_mode():
+    """'threads' (the worker pool) or 'asyncio' (see async_pipeline)."""
+    return _execution_mode or getattr(settings, 'SCHEDULER_EXECUTION_MODE', DEFAULT_EXECUTION_MODE)
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            max_workers = _max_workers or getattr(settings, 'SCHEDULER_MAX_WORKERS', DEFAULT_MAX_WORKERS)
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='scheduler')
+        return _executor
+
+def shutdown(wait_for_jobs=True):
+    """
+    Stop the pool; queued jobs are carried over, running ones finish.
+
+    Jobs finishing during shutdown no longer admit the next queued job, so
+    the pool is not re-created behind our back; configure() re-arms it.
+    """
+    global _executor, _shutting_down
+    with _stage_lock:
+        _shutting_down = True
+        queued = [job for queue in _stage_queues.values() for job in queue]
+        for queue in _stage_queues.values():
+            queue.clear()
+    for job in queued:
+        job['dispatcher']._finish(job, 'carried_over')
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait_for_jobs, cancel_futures=True)
+
+def in_flight_count():
+    with _in_flight_lock:
+        return len(_in_flight)
+
+def mark_in_flight(stage, key):
+    """Register a job; False if the same job is already running somewhere."""
+    with _in_flight_lock:
+        if (stage, key) in _in_flight:
+            return False
+        _in_flight.add((stage, key))
+        return True
+
+def clear_in_flight(stage, key):
+    with _in_flight_lock:
+        _in_flight.discard((stage, key))
+
+def stage_overrides():
+    """Stage limits passed to configure(), e.g. from run_scheduler's options."""
+    return dict(_stage_limits or {})
+
+def stage_limit(stage):
+    limits = dict(getattr(settings, 'SCHEDULER_STAGE_LIMITS', DEFAULT_STAGE_LIMITS))
+    limits.update(stage_overrides())
+    return limits.get(stage, DEFAULT_STAGE_LIMITS.get(stage, 1))
+
+def queued_count():
+    with _stage_lock:
+        return sum(len(queue) for queue in _stage_queues.values())
+
+def _admit(stage):
+    """Hand queued jobs of ``stage`` to the pool while the stage has a free slot."""
+    while True:
+        with _stage_lock:
+            queue = _stage_queues.get(stage)
+            if not queue:
+                return
+            if _shutting_down:
+                expired = list(queue)
+                queue.clear()
+            elif _stage_running.get(stage, 0) >= stage_limit(stage):
+                return
+            else:
+                expired = None
+                job = queue.popleft()
+                _stage_running[stage] = _stage_running.get(stage, 0) + 1
+        if expired is not None:
+            for job in expired:
+                job['dispatcher']._finish(job, 'carried_over')
+            return
+        try:
+            future = get_executor().submit(job['dispatcher']._run_job, job)
+        except Exception as e:
+            # The pool was shut down between ticks.
+            print(f"Error dispatching {stage} job {job['key']}: {e}")
+            job['dispatcher']._finish(job, 'carried_over')
+            _release_slot(stage)
+            continue
+        future.add_done_callback(partial(_job_done, job))
+
+def _release_slot(stage):
+    with _stage_lock:
+        _stage_running[stage] -= 1
+
+def _job_done(job, future):
+    if future.cancelled():
+        job['dispatcher']._finish(job, 'carried_over')
+    _release_slot(job['stage'])
+    _admit(job['stage'])
+
+class TickDispatcher:
+    """
+    Runs the jobs of one scheduler tick on the shared worker pool.
+
+    Every job belongs to a stage ('prompt', 'content', 'publish',
+    'scheduled', 'catchup') whose
+    concurrency is capped by SCHEDULER_STAGE_LIMITS. Jobs over a stage's
+    limit wait in that stage's queue and only reach the pool when a slot
+    frees up, so a busy stage never parks pool threads that another stage
+    could use. Jobs that have not
+    started or finished by the tick deadline are reported as carried over;
+    a job that is still running stays registered as in flight so the next
+    tick does not dispatch it a second time. ``on_job_finished(stage, key)``
+    is called once per dispatched job, whether it ran or was carried over.
+    """
+    def __init__(self, deadline=None, on_job_finished=None):
+        if deadline is None:
+            deadline = getattr(settings, 'SCHEDULER_TICK_DEADLINE', DEFAULT_TICK_DEADLINE)
+        self.started_at = time.monotonic()
+        self.deadline_at = self.started_at + deadline
+        self.on_job_finished = on_job_finished
+        self.jobs = []
+
+    def remaining(self):
+        return max(0.0, self.deadline_at - time.monotonic())
+
+    def submit(self, stage, key, func, *args, **kwargs):
+        if not mark_in_flight(stage, key):
+            return False
+        job = {
+            'stage': stage, 'key': key, 'status': 'queued', 'error': None,
+            'future': Future(), 'dispatcher': self, 'call': (func, args, kwargs),
+        }
+        self.jobs.append(job)
+        with _stage_lock:
+            _stage_queues.setdefault(stage, deque()).append(job)
+        _admit(stage)
+        return True
+
+    def _run_job(self, job):
+        if self.remaining() <= 0:
+            self._finish(job, 'carried_over')
+            return
+        func, args, kwargs = job['call']
+        try:
+            job['status'] = 'running'
+            job['result'] = func(*args, **kwargs)
+            status = 'done'
+        except Exception as e:
+            status = 'failed'
+            job['error'] = str(e)
+        self._finish(job, status)
+
+    def _finish(self, job, status):
+        job['status'] = status
+        try:
+            if self.on_job_finished:
+                try:
+                    self.on_job_finished(job['stage'], job['key'])
+                except Exception as e:
+                    print(f"Error finishing {job['stage']} job {job['key']}: {e}")
+            close_old_connections()
+        finally:
+            clear_in_flight(job['stage'], job['key'])
+            job['future'].set_result(None)
+
+    def expire_queued(self):
+        """Carry over this tick's jobs that are still waiting for a stage slot."""
+        with _stage_lock:
+            expired = []
+            for queue in _stage_queues.values():
+                mine = [job for job in queue if job['dispatcher'] is self]
+                for job in mine:
+                    queue.remove(job)
+                expired.extend(mine)
+        for job in expired:
+            self._finish(job, 'carried_over')
+
+    def run(self):
+        futures = [job['future'] for job in self.jobs]
+        if futures:
+            wait(futures, timeout=self.remaining())
+        self.expire_queued()
+        return self.report()
+
+    def report(self):
+        report = {'done': [], 'failed': [], 'carried_over': [], 'elapsed': 0.0}
+        for job in self.jobs:
+            status = job['status']
+            entry = (job['stage'], job['key'])
+            if status == 'done':
+                report['done'].append(entry)
+            elif status == 'failed':
+                report['failed'].append(entry + (job['error'],))
+            else:
+                report['carried_over'].append(entry)
+        report['elapsed'] = time.monotonic() - self.started_at
+        return report
@@ -0,0 +1,108 @@
+import hashlib
+import os
+import tempfile
+import time
+from urllib.parse import urlparse
+from django.conf import settings
+from . import http_client, media_store
+from .providers import get_provider
+
+DEFAULT_MAX_BYTES = 20 * 1024 * 1024
+DEFAULT_DEADLINE = 60
+CHUNK_SIZE = 64 * 1024
+
+class DownloadError(Exception):
+    pass
+
+class DownloadedImage:
+    """
+    An image fetched into an anonymous temporary file, with the sha256 and
+    size computed while it was written. Close it (or use it as a context
+    manager) once it has been saved.
+    """
+    def __init__(self, url, file, sha256, size):
+        self.url = url
+        self.file = file
+        self.sha256 = sha256
+        self.size = size
+
+    @property
+    def filename(self):
+        return os.path.basename(urlparse(self.url).path) or "generated_image.png"
+
+    def save_to(self, field_file, filename=None):
+        """
+        Point an ImageField at this image in the content-addressed media
+        store; the bytes are only written if they are not stored already.
+        """
+        return media_store.store(field_file, self.file, self.sha256, self.size, filename or self.filename)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def max_bytes():
+    return getattr(settings, 'IMAGE_DOWNLOAD_MAX_BYTES', DEFAULT_MAX_BYTES)
+
+def deadline():
+    return getattr(settings, 'IMAGE_DOWNLOAD_DEADLINE', DEFAULT_DEADLINE)
+
+def _spool(url, chunks, limit, started, seconds):
+    spool = tempfile.TemporaryFile()
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+            if size > limit:
+                raise DownloadError(f"Image larger than {limit} bytes: {url}")
+            if time.monotonic() - started > seconds:
+                raise DownloadError(f"Image download exceeded {seconds}s: {url}")
+            hasher.update(chunk)
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return DownloadedImage(url, spool, hasher.hexdigest(), size)
+
+def download(url):
+    """
+    Stream ``url`` into a temporary file in CHUNK_SIZE pieces, so memory use
+    does not grow with the image. Raises DownloadError on a non-200 answer,
+    past IMAGE_DOWNLOAD_MAX_BYTES or after IMAGE_DOWNLOAD_DEADLINE seconds.
+    """
+    limit, seconds = max_bytes(), deadline()
+    started = time.monotonic()
+
+    content = get_provider().fetch_image(url)
+    if content is not None:
+        return _spool(url, [content], limit, started, seconds)
+
+    connect_timeout, read_timeout = http_client.default_timeout()
+    # The read timeout bounds each wait for a chunk; the deadline bounds the total.
+    response = http_client.get(url, stream=True, timeout=(connect_timeout, min(read_timeout, seconds)))
+    try:
+        if response.status_code != 200:
+            raise DownloadError(f"Failed to download image: {response.status_code}")
+        length = response.headers.get('Content-Length')
+        if length and length.isdigit() and int(length) > limit:
+            raise DownloadError(f"Image larger than {limit} bytes: {url}")
+        return _spool(url, response.iter_content(CHUNK_SIZE), limit, started, seconds)
+    finally:
+        response.close()
+
+def download_or_none(url):
+    """download(), logging failures instead of raising; None for non-HTTP URLs."""
+    if not url or not url.startswith(('http://', 'https://')):
+        return None
+    try:
+        return download(url)
+    except Exception as e:
+        print(f"Error downloading image: {e}")
+        return None
@@ -0,0 +1,93 @@
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+DEFAULT_MAX_WORKERS = 16
+
+_lock = threading.Lock()
+_sessions = {}
+_stats = {}
+
+def pool_size():
+    """Connections kept per host: enough for every scheduler worker at once."""
+    return getattr(settings, 'HTTP_POOL_SIZE', None) or getattr(settings, 'SCHEDULER_MAX_WORKERS', DEFAULT_MAX_WORKERS)
+
+def default_timeout():
+    return (
+        getattr(settings, 'HTTP_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT),
+        getattr(settings, 'HTTP_READ_TIMEOUT', DEFAULT_READ_TIMEOUT),
+    )
+
+def _new_session():
+    session = requests.Session()
+    # Sessions are shared by every user's calls, so never keep cookies.
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size())
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def get_session(host):
+    with _lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = _sessions[host] = _new_session()
+        return session
+
+def record(host, elapsed, error):
+    with _lock:
+        stats = _stats.setdefault(host, {'requests': 0, 'errors': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+        stats['requests'] += 1
+        stats['errors'] += 1 if error else 0
+        stats['total_seconds'] += elapsed
+        stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+
+def request(method, url, **kwargs):
+    """
+    Drop-in for ``requests.request`` that reuses a keep-alive connection
+    pool per upstream host and applies HTTP_CONNECT_TIMEOUT/HTTP_READ_TIMEOUT
+    unless the caller passes its own ``timeout``. Connection errors and 5xx
+    responses count as errors in ``stats()``.
+    """
+    host = urlparse(url).netloc
+    session = get_session(host)
+    kwargs.setdefault('timeout', default_timeout())
+    started = time.monotonic()
+    try:
+        response = session.request(method, url, **kwargs)
+    except requests.RequestException:
+        record(host, time.monotonic() - started, True)
+        raise
+    record(host, time.monotonic() - started, response.status_code >= 500)
+    return response
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+def stats():
+    with _lock:
+        return {
+            host: {
+                'requests': s['requests'],
+                'errors': s['errors'],
+                'avg_seconds': round(s['total_seconds'] / s['requests'], 3) if s['requests'] else None,
+                'max_seconds': round(s['max_seconds'], 3),
+            }
+            for host, s in _stats.items()
+        }
+
+def close_all():
+    with _lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
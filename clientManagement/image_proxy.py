@@ -0,0 +1,250 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import requests
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from . import downloads, http_client
+
+DEFAULT_CACHE_MAX_BYTES = 200 * 1024 * 1024
+DEFAULT_FRESH_SECONDS = 3600
+DEFAULT_BROWSER_MAX_AGE = 86400
+
+_lock = threading.Lock()
+_stats = {'hits': 0, 'revalidated': 0, 'misses': 0, 'not_modified': 0, 'evicted': 0}
+
+def cache_dir():
+    return str(getattr(settings, 'IMAGE_PROXY_CACHE_DIR', os.path.join(settings.BASE_DIR, 'cache', 'image_proxy')))
+
+def max_bytes():
+    return getattr(settings, 'IMAGE_PROXY_CACHE_MAX_BYTES', DEFAULT_CACHE_MAX_BYTES)
+
+def fresh_seconds():
+    return getattr(settings, 'IMAGE_PROXY_FRESH_SECONDS', DEFAULT_FRESH_SECONDS)
+
+def cache_control():
+    return f"private, max-age={getattr(settings, 'IMAGE_PROXY_BROWSER_MAX_AGE', DEFAULT_BROWSER_MAX_AGE)}"
+
+def _count(key):
+    with _lock:
+        _stats[key] += 1
+
+def _paths(url):
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir(), f"{key}.body"), os.path.join(cache_dir(), f"{key}.json")
+
+class Entry:
+    """A cached upstream response: body file plus the headers needed to revalidate it."""
+    def __init__(self, url, body_path, meta):
+        self.url = url
+        self.body_path = body_path
+        self.meta = meta
+
+    @property
+    def etag(self):
+        # Browser-facing validator: the upstream one if it sent any.
+        return self.meta.get('etag') or f'"{self.meta["sha256"]}"'
+
+    @property
+    def last_modified(self):
+        return self.meta.get('last_modified')
+
+    @property
+    def content_type(self):
+        return self.meta.get('content_type') or 'image/png'
+
+    @property
+    def size(self):
+        return self.meta.get('size')
+
+    def is_fresh(self):
+        return time.time() - self.meta.get('fetched_at', 0) < fresh_seconds()
+
+    def touch(self, revalidated=False):
+        now = time.time()
+        if revalidated:
+            self.meta['fetched_at'] = now
+            _write_meta(self.body_path, self.meta)
+        try:
+            # The body's mtime is the LRU clock.
+            os.utime(self.body_path, (now, now))
+        except OSError:
+            pass
+
+    def open(self):
+        return open(self.body_path, 'rb')
+
+def _write_meta(body_path, meta):
+    meta_path = body_path[:-len(".body")] + ".json"
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(meta_path), suffix=".tmp")
+    with os.fdopen(fd, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+def lookup(url):
+    body_path, meta_path = _paths(url)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('url') != url or not os.path.exists(body_path):
+        return None
+    return Entry(url, body_path, meta)
+
+def revalidate(entry):
+    """
+    Ask upstream whether ``entry`` changed. Returns the entry (refreshed) on
+    a 304, or the upstream response when the image changed.
+    """
+    headers = {}
+    if entry.meta.get('etag'):
+        headers['If-None-Match'] = entry.meta['etag']
+    if entry.meta.get('last_modified'):
+        headers['If-Modified-Since'] = entry.meta['last_modified']
+    response = http_client.get(entry.url, stream=True, headers=headers)
+    if response.status_code == 304:
+        response.close()
+        entry.touch(revalidated=True)
+        _count('revalidated')
+        return entry
+    return response
+
+def stream_and_store(url, response, chunk_size=downloads.CHUNK_SIZE):
+    """
+    Yield the upstream body chunk by chunk while writing it to the cache.
+    The entry only becomes visible once the whole body has arrived; a body
+    over the per-image size cap is still streamed but not cached.
+    """
+    os.makedirs(cache_dir(), exist_ok=True)
+    body_path, _ = _paths(url)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir(), suffix=".tmp")
+    hasher = hashlib.sha256()
+    size = 0
+    limit = downloads.max_bytes()
+    complete = False
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            for chunk in response.iter_content(chunk_size):
+                size += len(chunk)
+                if size <= limit:
+                    hasher.update(chunk)
+                    tmp.write(chunk)
+                yield chunk
+        complete = size <= limit
+    finally:
+        response.close()
+        if complete:
+            os.replace(tmp_path, body_path)
+            _write_meta(body_path, {
+                'url': url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'content_type': response.headers.get('Content-Type'),
+                'size': size,
+                'sha256': hasher.hexdigest(),
+                'fetched_at': time.time(),
+            })
+            evict()
+        else:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+def evict():
+    """Drop the least recently served entries until the cache fits IMAGE_PROXY_CACHE_MAX_BYTES."""
+    try:
+        bodies = [entry for entry in os.scandir(cache_dir()) if entry.name.endswith(".body")]
+    except OSError:
+        return
+    stats = []
+    for body in bodies:
+        try:
+            stats.append((body.stat().st_mtime, body.stat().st_size, body.path))
+        except OSError:
+            continue
+    total = sum(size for _, size, _ in stats)
+    limit = max_bytes()
+    for _, size, path in sorted(stats):
+        if total <= limit:
+            break
+        for stale in (path, path[:-len(".body")] + ".json"):
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+        total -= size
+        _count('evicted')
+
+def not_modified(request, etag, last_modified):
+    """Whether the browser's copy (If-None-Match / If-Modified-Since) is current."""
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        return etag is not None and etag in [tag.strip() for tag in if_none_match.split(',')]
+    if_modified_since = request.META.get('HTTP_IF_MODIFIED_SINCE')
+    return bool(last_modified and if_modified_since == last_modified)
+
+def _headers(response, etag, last_modified):
+    if etag:
+        response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = last_modified
+    response['Cache-Control'] = cache_control()
+    return response
+
+def _stream(request, url, upstream):
+    _count('misses')
+    if upstream.status_code != 200:
+        upstream.close()
+        return HttpResponse(f"Failed to fetch image: {upstream.status_code}", status=502)
+    length = upstream.headers.get('Content-Length')
+    if length and length.isdigit() and int(length) > downloads.max_bytes():
+        upstream.close()
+        return HttpResponse("Image too large", status=502)
+    etag, last_modified = upstream.headers.get('ETag'), upstream.headers.get('Last-Modified')
+    if not_modified(request, etag, last_modified):
+        upstream.close()
+        _count('not_modified')
+        return _headers(HttpResponseNotModified(), etag, last_modified)
+    response = StreamingHttpResponse(
+        stream_and_store(url, upstream),
+        content_type=upstream.headers.get('Content-Type', 'image/png'),
+    )
+    if length and length.isdigit() and not upstream.headers.get('Content-Encoding'):
+        response['Content-Length'] = length
+    return _headers(response, etag, last_modified)
+
+def respond(request, url):
+    """
+    Serve ``url`` from the on-disk cache when it is fresh, revalidate it
+    with upstream (If-None-Match / If-Modified-Since) when it is stale, and
+    otherwise stream it from upstream while caching it. Browsers get
+    ETag/Last-Modified/Cache-Control, so repeat loads end in a 304.
+    """
+    entry = lookup(url)
+    if entry is None:
+        return _stream(request, url, http_client.get(url, stream=True))
+    if entry.is_fresh():
+        _count('hits')
+    else:
+        try:
+            result = revalidate(entry)
+        except requests.RequestException as e:
+            # Upstream is unreachable: a stale copy beats an error.
+            print(f"Error revalidating proxied image: {e}")
+            result = entry
+        if result is not entry:
+            return _stream(request, url, result)
+    entry.touch()
+    if not_modified(request, entry.etag, entry.last_modified):
+        _count('not_modified')
+        return _headers(HttpResponseNotModified(), entry.etag, entry.last_modified)
+    return _headers(FileResponse(entry.open(), content_type=entry.content_type), entry.etag, entry.last_modified)
+
+def stats():
+    with _lock:
+        return dict(_stats)
@@ -0,0 +1,153 @@
+import os
+import socket
+import threading
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_CLAIM_BATCH = 50
+
+# Unique per process, so two workers on the same host never share a lease.
+OWNER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# (model, str(id)) of every row this process holds, renewed by LeaseRenewer.
+# Ids are kept as strings because jobs pass them around as str while
+# values_list() yields UUIDs.
+_held = set()
+_held_lock = threading.Lock()
+
+def lease_is_free(now):
+    return Q(claim_expires_at__isnull=True) | Q(claim_expires_at__lte=now)
+
+def writable(now=None):
+    """
+    Rows this process may still write results to: leased to it, or not
+    leased by any live process. A job whose lease lapsed and was taken over
+    drops its result instead of overwriting the new owner's.
+    """
+    return Q(claimed_by=OWNER_ID) | lease_is_free(now or timezone.now())
+
+def lease_seconds():
+    return getattr(settings, 'SCHEDULER_LEASE_SECONDS', DEFAULT_LEASE_SECONDS)
+
+def _hold(model, ids):
+    with _held_lock:
+        _held.update((model, str(row_id)) for row_id in ids)
+
+def claim_rows(queryset, order_by, now=None, limit=None):
+    """
+    Claim up to ``limit`` rows of ``queryset`` (CampaignPost or ScheduledPost)
+    for this process and return their ids. Rows leased by another live
+    process are skipped, so any number of scheduler processes can split the
+    due work without overlap.
+
+    Backends with SKIP LOCKED (PostgreSQL, MySQL 8, Oracle) lock the candidate
+    rows while the lease is written; elsewhere each row is claimed with a
+    conditional UPDATE, which only one process can win.
+    """
+    now = now or timezone.now()
+    if limit is None:
+        limit = getattr(settings, 'SCHEDULER_CLAIM_BATCH', DEFAULT_CLAIM_BATCH)
+    expires_at = now + timedelta(seconds=lease_seconds())
+    model = queryset.model
+    candidates = queryset.filter(lease_is_free(now)).order_by(order_by)
+
+    if connection.features.has_select_for_update_skip_locked:
+        lock_kwargs = {'skip_locked': True}
+        if connection.features.has_select_for_update_of:
+            lock_kwargs['of'] = ('self',)
+        with transaction.atomic():
+            ids = list(
+                candidates.select_for_update(**lock_kwargs).values_list('id', flat=True)[:limit]
+            )
+            model.objects.filter(id__in=ids).update(
+                claimed_by=OWNER_ID,
+                claim_expires_at=expires_at,
+            )
+        _hold(model, ids)
+        return ids
+
+    claimed = []
+    for row_id in candidates.values_list('id', flat=True)[:limit]:
+        won = model.objects.filter(lease_is_free(now), id=row_id).update(
+            claimed_by=OWNER_ID,
+            claim_expires_at=expires_at,
+        )
+        if won:
+            claimed.append(row_id)
+    _hold(model, claimed)
+    return claimed
+
+def release_row(model, row_id):
+    with _held_lock:
+        _held.discard((model, str(row_id)))
+    model.objects.filter(id=row_id, claimed_by=OWNER_ID).update(
+        claimed_by='',
+        claim_expires_at=None,
+    )
+
+def held_count():
+    with _held_lock:
+        return len(_held)
+
+def release_all(models):
+    """Drop every lease this process holds, e.g. on shutdown."""
+    with _held_lock:
+        _held.clear()
+    for model in models:
+        model.objects.filter(claimed_by=OWNER_ID).update(
+            claimed_by='',
+            claim_expires_at=None,
+        )
+
+def renew(now=None):
+    """
+    Push back the expiry of every lease this process still holds, so a job
+    that outlives SCHEDULER_LEASE_SECONDS (slow OpenAI admission, image
+    timeouts) is not reclaimed by another scheduler while it runs. Leases
+    that were already taken over are left alone. Returns the rows renewed.
+    """
+    now = now or timezone.now()
+    with _held_lock:
+        held = list(_held)
+    by_model = {}
+    for model, row_id in held:
+        by_model.setdefault(model, []).append(row_id)
+    renewed = 0
+    for model, ids in by_model.items():
+        renewed += model.objects.filter(id__in=ids, claimed_by=OWNER_ID).update(
+            claim_expires_at=now + timedelta(seconds=lease_seconds()),
+        )
+    return renewed
+
+class LeaseRenewer:
+    """Runs renew() every third of SCHEDULER_LEASE_SECONDS in a daemon thread."""
+    def __init__(self, interval=None):
+        self.interval = interval or lease_seconds() / 3
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run_forever, name='lease-renewer', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        self.stopping.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def run_forever(self):
+        while not self.stopping.wait(self.interval):
+            try:
+                renew()
+            except Exception as e:
+                print(f"Lease renewal failed: {e}")
+            finally:
+                close_old_connections()
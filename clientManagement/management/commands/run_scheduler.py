@@ -0,0 +1,60 @@
+import json
+import os
+import signal
+import threading
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from clientManagement import dispatcher, scheduler
+
+class Command(BaseCommand):
+    help = "Run the campaign scheduler and precompute generator as a long-running worker."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=dispatcher.EXECUTION_MODES, help="Run jobs on the thread pool or as asyncio coroutines (default: SCHEDULER_EXECUTION_MODE).")
+        parser.add_argument('--max-workers', type=int, help="Size of the job pool in threads mode (default: SCHEDULER_MAX_WORKERS).")
+        parser.add_argument('--publish-concurrency', type=int, help="Concurrent publish jobs (both execution modes).")
+        parser.add_argument('--generation-concurrency', type=int, help="Concurrent prompt and content jobs (both execution modes).")
+        parser.add_argument('--generation-rate', type=float, help="Precomputed posts per minute (default: GENERATION_RATE_PER_MINUTE).")
+        parser.add_argument('--no-precompute', action='store_true', help="Do not run the ahead-of-time generator in this worker.")
+        parser.add_argument('--health-file', default=getattr(settings, 'SCHEDULER_HEALTH_FILE', None), help="Write a JSON health report to this path.")
+        parser.add_argument('--health-interval', type=float, default=30, help="Seconds between health reports.")
+        parser.add_argument('--shutdown-timeout', type=float, default=60, help="Seconds to wait for running jobs on shutdown.")
+
+    def handle(self, *args, **options):
+        stage_limits = {}
+        if options['publish_concurrency']:
+            stage_limits.update(publish=options['publish_concurrency'], scheduled=options['publish_concurrency'])
+        if options['generation_concurrency']:
+            stage_limits.update(prompt=options['generation_concurrency'], content=options['generation_concurrency'])
+        dispatcher.configure(max_workers=options['max_workers'], stage_limits=stage_limits, mode=options['mode'])
+
+        stopping = threading.Event()
+
+        def request_stop(signum, frame):
+            self.stdout.write(f"Received signal {signum}, shutting down...")
+            stopping.set()
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+
+        scheduler.start(precompute=not options['no_precompute'], generation_rate=options['generation_rate'])
+        self.stdout.write(self.style.SUCCESS(f"Scheduler started (pid {os.getpid()})."))
+
+        while not stopping.wait(options['health_interval']):
+            self.report_health(options['health_file'])
+
+        scheduler.stop(timeout=options['shutdown_timeout'])
+        self.report_health(options['health_file'])
+        self.stdout.write(self.style.SUCCESS("Scheduler stopped."))
+
+    def report_health(self, health_file):
+        health = scheduler.health()
+        if health_file:
+            tmp_path = f"{health_file}.tmp"
+            with open(tmp_path, 'w') as fp:
+                json.dump(health, fp, indent=2)
+            os.replace(tmp_path, health_file)
+        self.stdout.write(
+            f"scheduler mode={health['execution_mode']} alive={health['scheduler_alive']} last_tick={health['last_tick']} "
+            f"in_flight={health['in_flight']} next_deadline={health['next_deadline']}"
+        )
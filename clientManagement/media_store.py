@@ -0,0 +1,190 @@
+import hashlib
+import os
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import CampaignPost, MediaBlob, Post, PostVariant
+from . import derivatives
+
+DEFAULT_BLOB_DIR = "generated_images/blobs"
+DEFAULT_SWEEP_INTERVAL = 3600
+DEFAULT_SWEEP_GRACE = 3600
+SWEEP_BATCH = 500
+
+# image_file fields whose values are reference-counted.
+TRACKED_FIELDS = (
+    (Post, 'image_file'),
+    (PostVariant, 'image_file'),
+    (CampaignPost, 'image_file'),
+)
+
+_lock = threading.Lock()
+_stats = {
+    'stored': 0,
+    'deduplicated': 0,
+    'bytes_written': 0,
+    'bytes_deduplicated': 0,
+    'swept': 0,
+    'bytes_reclaimed': 0,
+    'last_sweep': None,
+}
+
+def blob_dir():
+    return getattr(settings, 'MEDIA_BLOB_DIR', DEFAULT_BLOB_DIR).strip('/')
+
+def blob_name(sha256, ext):
+    return f"{blob_dir()}/{sha256[:2]}/{sha256}{ext}"
+
+def is_blob(name):
+    return bool(name) and name.startswith(blob_dir() + '/')
+
+def _count(key, amount=1):
+    with _lock:
+        _stats[key] += amount
+
+def store(field_file, file, sha256, size, filename):
+    """
+    Point ``field_file`` at the blob holding these bytes, writing it only if
+    no identical image is stored yet. The reference is counted when the
+    instance is saved.
+    """
+    ext = os.path.splitext(filename)[1].lower() or ".png"
+    blob, created = MediaBlob.objects.get_or_create(
+        sha256=sha256,
+        defaults={'name': blob_name(sha256, ext), 'size': size, 'released_on': timezone.now()},
+    )
+    if not created and blob.ref_count <= 0:
+        # Keep the sweeper off a blob that is about to be referenced again.
+        MediaBlob.objects.filter(id=blob.id).update(released_on=timezone.now())
+
+    if default_storage.exists(blob.name):
+        _count('deduplicated')
+        _count('bytes_deduplicated', size)
+    else:
+        file.seek(0)
+        saved_name = default_storage.save(blob.name, File(file, name=blob.name))
+        if saved_name != blob.name:
+            # Another process wrote the same blob first.
+            default_storage.delete(saved_name)
+        else:
+            transaction.on_commit(lambda: derivatives.schedule(blob))
+        _count('stored')
+        _count('bytes_written', size)
+
+    setattr(field_file.instance, field_file.field.attname, blob.name)
+    return blob.name
+
+def store_upload(field_file, uploaded):
+    """store() for an uploaded file, hashing it chunk by chunk."""
+    hasher = hashlib.sha256()
+    size = 0
+    for chunk in uploaded.chunks():
+        hasher.update(chunk)
+        size += len(chunk)
+    return store(field_file, uploaded, hasher.hexdigest(), size, uploaded.name or "edited_image.png")
+
+def incref(name):
+    if is_blob(name):
+        MediaBlob.objects.filter(name=name).update(ref_count=F('ref_count') + 1, released_on=None)
+
+def decref(name):
+    if is_blob(name):
+        MediaBlob.objects.filter(name=name).update(ref_count=F('ref_count') - 1, released_on=timezone.now())
+
+def field_name(instance, field):
+    """The stored file name without touching the DB; None when the field is deferred."""
+    value = instance.__dict__.get(field)
+    return getattr(value, 'name', value) or None
+
+def remember(instance):
+    instance._media_names = {
+        field: field_name(instance, field)
+        for model, field in TRACKED_FIELDS
+        if isinstance(instance, model) and field in instance.__dict__
+    }
+
+def track_save(instance, created, update_fields=None):
+    previous = {} if created else getattr(instance, '_media_names', {})
+    for model, field in TRACKED_FIELDS:
+        if not isinstance(instance, model) or field not in instance.__dict__:
+            continue
+        if update_fields is not None and field not in update_fields:
+            continue
+        if not created and field not in previous:
+            continue
+        old, new = previous.get(field), field_name(instance, field)
+        if old != new:
+            incref(new)
+            decref(old)
+    remember(instance)
+
+def track_delete(instance):
+    for model, field in TRACKED_FIELDS:
+        if isinstance(instance, model):
+            decref(getattr(instance, '_media_names', {}).get(field) or field_name(instance, field))
+
+def references(name):
+    return sum(model.objects.filter(**{field: name}).count() for model, field in TRACKED_FIELDS)
+
+def sweep(grace=None):
+    """
+    Delete blobs that have had no references for ``grace`` seconds
+    (MEDIA_SWEEP_GRACE). References are recounted first, so a count that
+    drifted (e.g. after a bulk update) is repaired instead of losing a file.
+    """
+    grace = grace if grace is not None else getattr(settings, 'MEDIA_SWEEP_GRACE', DEFAULT_SWEEP_GRACE)
+    cutoff = timezone.now() - timedelta(seconds=grace)
+    swept = 0
+    candidates = MediaBlob.objects.filter(ref_count__lte=0, released_on__lt=cutoff)[:SWEEP_BATCH]
+    for blob in candidates:
+        count = references(blob.name)
+        if count:
+            MediaBlob.objects.filter(id=blob.id).update(ref_count=count, released_on=None)
+            continue
+        deleted, _ = MediaBlob.objects.filter(id=blob.id, ref_count__lte=0, released_on__lt=cutoff).delete()
+        if deleted:
+            default_storage.delete(blob.name)
+            derivatives.delete(blob)
+            swept += 1
+            _count('swept')
+            _count('bytes_reclaimed', blob.size)
+    with _lock:
+        _stats['last_sweep'] = timezone.now().isoformat()
+    return swept
+
+class MediaSweeper:
+    """Runs sweep() every MEDIA_SWEEP_INTERVAL seconds in a daemon thread."""
+    def __init__(self, interval=None):
+        self.interval = interval or getattr(settings, 'MEDIA_SWEEP_INTERVAL', DEFAULT_SWEEP_INTERVAL)
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run_forever, name='media-sweeper', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        self.stopping.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def run_forever(self):
+        while not self.stopping.wait(self.interval):
+            try:
+                sweep()
+            except Exception as e:
+                print(f"Media sweep failed: {e}")
+            finally:
+                close_old_connections()
+
+def stats():
+    with _lock:
+        return dict(_stats)
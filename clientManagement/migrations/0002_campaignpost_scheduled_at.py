@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:11
+
+from datetime import datetime
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_scheduled_at(apps, schema_editor):
+    CampaignPost = apps.get_model("clientManagement", "CampaignPost")
+    for post in CampaignPost.objects.only("id", "date", "time").iterator():
+        post.scheduled_at = timezone.make_aware(datetime.combine(post.date, post.time), timezone.get_default_timezone())
+        post.save(update_fields=["scheduled_at"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clientManagement", "0001_initial"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="campaignpost",
+            name="scheduled_at",
+            field=models.DateTimeField(
+                blank=True, db_index=True, editable=False, null=True
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="campaignpost",
+            index=models.Index(
+                fields=[
+                    "is_active",
+                    "posted",
+                    "is_content_generated",
+                    "is_prompt_generated",
+                    "scheduled_at",
+                ],
+                name="campaignpost_pipeline_idx",
+            ),
+        ),
+        migrations.RunPython(backfill_scheduled_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clientManagement", "0002_campaignpost_scheduled_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="campaignpost",
+            name="claim_expires_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="campaignpost",
+            name="claimed_by",
+            field=models.CharField(
+                blank=True, default="", editable=False, max_length=255
+            ),
+        ),
+    ]
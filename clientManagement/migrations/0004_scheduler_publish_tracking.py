@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:14
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clientManagement", "0003_campaignpost_claim"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="campaignpost",
+            name="published_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="scheduledpost",
+            name="claim_expires_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="scheduledpost",
+            name="claimed_by",
+            field=models.CharField(
+                blank=True, default="", editable=False, max_length=255
+            ),
+        ),
+        migrations.AddField(
+            model_name="scheduledpost",
+            name="published_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="scheduledpost",
+            index=models.Index(
+                fields=["is_active", "posted", "scheduled_time"],
+                name="scheduledpost_due_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:17
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clientManagement", "0004_scheduler_publish_tracking"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="campaignpost",
+            name="campaignpost_pipeline_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="scheduledpost",
+            name="scheduledpost_due_idx",
+        ),
+        migrations.AddField(
+            model_name="campaignpost",
+            name="attempt_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="campaignpost",
+            name="dead_lettered",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="campaignpost",
+            name="last_error",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="campaignpost",
+            name="next_attempt_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="scheduledpost",
+            name="attempt_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="scheduledpost",
+            name="dead_lettered",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="scheduledpost",
+            name="last_error",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="scheduledpost",
+            name="next_attempt_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="campaignpost",
+            index=models.Index(
+                fields=[
+                    "is_active",
+                    "dead_lettered",
+                    "posted",
+                    "is_content_generated",
+                    "is_prompt_generated",
+                    "scheduled_at",
+                ],
+                name="campaignpost_pipeline_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="scheduledpost",
+            index=models.Index(
+                fields=["is_active", "dead_lettered", "posted", "scheduled_time"],
+                name="scheduledpost_due_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clientManagement", "0005_retry_schedule"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="campaign",
+            name="generation_horizon",
+            field=models.DurationField(
+                blank=True,
+                help_text="How far ahead of each slot prompts and media may be generated; defaults to GENERATION_HORIZON",
+                null=True,
+            ),
+        ),
+    ]
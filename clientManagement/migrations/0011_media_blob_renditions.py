@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clientManagement", "0010_media_blob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mediablob",
+            name="height",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="mediablob",
+            name="renditions",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name="mediablob",
+            name="width",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
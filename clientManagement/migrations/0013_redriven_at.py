@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clientManagement", "0012_cloudinary_upload"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="campaignpost",
+            name="redriven_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="scheduledpost",
+            name="redriven_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
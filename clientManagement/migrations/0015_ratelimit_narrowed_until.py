@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clientManagement", "0014_shared_ratelimit_and_change_marker"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ratelimitbucket",
+            name="narrowed_until",
+            field=models.FloatField(default=0),
+        ),
+    ]
@@ -1,6 +1,8 @@
 from django.db import models
 import uuid
+from datetime import datetime
 from django.conf import settings
+from django.utils import timezone
 from django.contrib.auth.models import User
 
 class BaseModel(models.Model):
@@ -46,9 +48,20 @@ class Campaign(BaseModel):
     start_date = models.DateField()
     end_date = models.DateField()
     max_posts_per_day = models.IntegerField(default=5)
+    generation_horizon = models.DurationField(
+        blank=True,
+        null=True,
+        help_text="How far ahead of each slot prompts and media may be generated; defaults to GENERATION_HORIZON"
+    )
 
     def __str__(self):
         return f"{self.name} ({self.start_date} to {self.end_date})"
+
+    @property
+    def generation_horizon_hours(self):
+        if self.generation_horizon is None:
+            return None
+        return int(self.generation_horizon.total_seconds() // 3600)
     
 class CampaignPost(BaseModel):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -78,10 +91,44 @@ class CampaignPost(BaseModel):
     is_content_generated = models.BooleanField(default=False)
     posted = models.BooleanField(default=False)
 
+    # UTC copy of date + time so the scheduler can range-scan instead of
+    # combining every row in Python.
+    scheduled_at = models.DateTimeField(null=True, blank=True, db_index=True, editable=False)
+
+    # Lease held by the scheduler process currently working on this post.
+    claimed_by = models.CharField(max_length=255, blank=True, default='', editable=False)
+    claim_expires_at = models.DateTimeField(null=True, blank=True, editable=False)
+    published_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    # Retry schedule for failed generation/publish attempts. Rows that run
+    # out of attempts are parked in the dead-letter state until re-driven.
+    attempt_count = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    dead_lettered = models.BooleanField(default=False)
+    # Set when re-driven by hand; the catch-up grace period then runs from here.
+    redriven_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['is_active', 'dead_lettered', 'posted', 'is_content_generated', 'is_prompt_generated', 'scheduled_at'],
+                name='campaignpost_pipeline_idx',
+            ),
+        ]
+
     def scheduled_datetime(self):
-        from datetime import datetime
         return datetime.combine(self.date, self.time)
 
+    def save(self, *args, **kwargs):
+        if self.date and self.time:
+            # date/time are wall-clock values in the configured TIME_ZONE.
+            self.scheduled_at = timezone.make_aware(datetime.combine(self.date, self.time), timezone.get_default_timezone())
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and ('date' in update_fields or 'time' in update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'scheduled_at'}
+        super().save(*args, **kwargs)
+
 class Post(BaseModel):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     image_url = models.URLField(
@@ -103,6 +150,32 @@ class Post(BaseModel):
     def __str__(self):
         return f"Post by {self.user.username} on {self.created_on:%Y-%m-%d}"
 
+    def select_variant(self, variant):
+        """Make ``variant`` the post's content; its image file is shared, not copied."""
+        self.text = variant.text
+        self.image_url = variant.image_url
+        self.image_file = variant.image_file.name or None
+        self.save(update_fields=['text', 'image_url', 'image_file', 'updated_on'])
+
+class PostVariant(BaseModel):
+    """
+    One of several alternative captions/images generated together for a
+    Post. The prompts live on the Post; the chosen variant's content is
+    copied onto it with Post.select_variant().
+    """
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='variants')
+    position = models.PositiveSmallIntegerField(default=0)
+    text = models.TextField(blank=True, default='')
+    image_url = models.URLField(max_length=1000, blank=True, null=True)
+    image_file = models.ImageField(upload_to="generated_images/", blank=True, null=True)
+
+    class Meta:
+        ordering = ['position']
+        unique_together = ('post', 'position')
+
+    def __str__(self):
+        return f"Variant {self.position + 1} of {self.post_id}"
+
 class ScheduledPost(BaseModel):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='posts')
@@ -119,18 +192,147 @@ class ScheduledPost(BaseModel):
     media_file = models.FileField(upload_to="media/", blank=True, null=True)
     posted = models.BooleanField(default=False)
 
+    claimed_by = models.CharField(max_length=255, blank=True, default='', editable=False)
+    claim_expires_at = models.DateTimeField(null=True, blank=True, editable=False)
+    published_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    # Retry schedule for failed publish attempts. Rows that run
+    # out of attempts are parked in the dead-letter state until re-driven.
+    attempt_count = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    dead_lettered = models.BooleanField(default=False)
+    # Set when re-driven by hand; the catch-up grace period then runs from here.
+    redriven_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['is_active', 'dead_lettered', 'posted', 'scheduled_time'],
+                name='scheduledpost_due_idx',
+            ),
+        ]
+
     def __str__(self):
         return f"Scheduled for {self.scheduled_time.strftime('%Y-%m-%d %H:%M')} on {self.platform}"
 
 class PromptLog(BaseModel):
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
     prompt_input = models.TextField()
     response_text = models.TextField(blank=True, null=True)
     response_image_prompt = models.TextField(blank=True, null=True)
     model_used = models.CharField(max_length=100, default='gpt-4o')
 
+    # Response cache (see openai_cache): rows with a cache_key can be served
+    # again for identical calls until they expire or are evicted.
+    cache_key = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    response_image_url = models.TextField(blank=True, null=True)
+    latency = models.FloatField(null=True, blank=True)
+    hit_count = models.PositiveIntegerField(default=0)
+    last_used_on = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        owner = self.user.username if self.user else 'scheduler'
+        return f"Prompt by {owner} on {self.created_on:%Y-%m-%d}"
+
+class OpenAISlot(BaseModel):
+    """
+    One of the OPENAI_CONCURRENCY slots for an endpoint kind, leased by a
+    process while it has a request in flight (see openai_governor). Only
+    used when OPENAI_GOVERNOR_SHARED is on.
+    """
+    kind = models.CharField(max_length=20)
+    slot = models.PositiveIntegerField()
+    claimed_by = models.CharField(max_length=255, blank=True, default='', editable=False)
+    claim_expires_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        unique_together = ('kind', 'slot')
+
+    def __str__(self):
+        return f"{self.kind} slot {self.slot}"
+
+class RateLimitBucket(BaseModel):
+    """
+    Token bucket state for one (platform, credential), shared by the web
+    and scheduler processes (see ratelimit). Times are epoch seconds;
+    ``version`` makes every update a compare-and-swap.
+    """
+    platform = models.CharField(max_length=20)
+    credential_key = models.CharField(max_length=255)
+    tokens = models.FloatField()
+    rate = models.FloatField()
+    updated = models.FloatField()
+    blocked_until = models.FloatField(default=0)
+    # When the platform's reported window resets; ``rate`` is only narrowed
+    # until then.
+    narrowed_until = models.FloatField(default=0)
+    version = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('platform', 'credential_key')
+
+    def __str__(self):
+        return f"{self.platform} bucket {self.credential_key}"
+
+class ChangeMarker(BaseModel):
+    """
+    A counter bumped whenever campaigns or schedules change, so a scheduler
+    in another process notices the edit without waiting out its idle period.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+class PromptSuggestion(BaseModel):
+    """
+    A pre-generated random prompt pair waiting to be served by the
+    "Generate AI Content" button (see suggestions). ``choice`` is the
+    platform/audience/keywords/tone/length/CTA combination it was made for.
+    """
+    choice = models.CharField(max_length=500)
+    text_prompt = models.TextField()
+    image_prompt = models.TextField(blank=True, default='')
+
+    def __str__(self):
+        return self.choice
+
+class MediaBlob(BaseModel):
+    """
+    A generated or edited image stored once under a name derived from its
+    sha256 (see media_store). ``ref_count`` counts the image_file fields
+    pointing at it; blobs left at zero are deleted by the media sweeper.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField(default=0)
+    ref_count = models.IntegerField(default=0)
+    released_on = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    # Source dimensions and the resized copies made by derivatives.generate():
+    # {format: {width: {'name', 'width', 'height'}}}.
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    renditions = models.JSONField(default=dict, blank=True)
+
+    def __str__(self):
+        return self.name
+
+class CloudinaryUpload(BaseModel):
+    """
+    An image already uploaded to Cloudinary, keyed by the sha256 of its
+    bytes, so publishing reuses ``secure_url`` instead of uploading again
+    (see cloudinary_cache).
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    public_id = models.CharField(max_length=255)
+    secure_url = models.URLField(max_length=1000)
+    size = models.PositiveBigIntegerField(default=0)
+
     def __str__(self):
-        return f"Prompt by {self.user.username} on {self.created_on:%Y-%m-%d}"
+        return self.public_id
 
 class UserCredential(BaseModel):
     PLATFORM_CHOICES = [
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import re
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from .models import PromptLog
+
+DEFAULT_CACHE_TTL = 7 * 24 * 3600
+# OpenAI image URLs expire after about an hour, so entries carrying one are
+# only reused for a shorter window.
+DEFAULT_IMAGE_CACHE_TTL = 45 * 60
+DEFAULT_CACHE_MAX_ENTRIES = 5000
+
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'bypassed': 0, 'saved_seconds': 0.0}
+
+def enabled():
+    return getattr(settings, 'OPENAI_CACHE_ENABLED', True)
+
+def normalize(prompt):
+    """Collapse whitespace so re-indented templates share an entry."""
+    return re.sub(r'\s+', ' ', prompt or '').strip()
+
+def cache_key(model, prompt, **params):
+    """
+    Content address of an OpenAI call: sha256 of the model, the normalized
+    prompt and every parameter that changes the response.
+    """
+    payload = {'model': model, 'prompt': normalize(prompt)}
+    for name, value in params.items():
+        payload[name] = normalize(value) if isinstance(value, str) else value
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+def _count(name, amount=1):
+    with _lock:
+        _stats[name] += amount
+
+def record_bypass():
+    _count('bypassed')
+
+def lookup(key, with_image=False):
+    """Return the cached ``(text, image_url)`` for ``key``, or None on a miss."""
+    now = timezone.now()
+    ttl = getattr(settings, 'OPENAI_CACHE_TTL', DEFAULT_CACHE_TTL)
+    if with_image:
+        ttl = min(ttl, getattr(settings, 'OPENAI_IMAGE_CACHE_TTL', DEFAULT_IMAGE_CACHE_TTL))
+    entry = (
+        PromptLog.objects.filter(cache_key=key, created_on__gte=now - timedelta(seconds=ttl))
+        .order_by('-created_on')
+        .values('id', 'response_text', 'response_image_url', 'latency')
+        .first()
+    )
+    if entry is None:
+        _count('misses')
+        return None
+
+    PromptLog.objects.filter(id=entry['id']).update(hit_count=F('hit_count') + 1, last_used_on=now)
+    _count('hits')
+    _count('saved_seconds', entry['latency'] or 0.0)
+    return entry['response_text'], entry['response_image_url']
+
+def store(key, prompt, text, image_url, model, latency, user=None):
+    PromptLog.objects.create(
+        user=user,
+        cache_key=key,
+        prompt_input=prompt,
+        response_text=text,
+        response_image_url=image_url,
+        model_used=model,
+        latency=latency,
+        last_used_on=timezone.now(),
+    )
+    evict()
+
+def evict():
+    """
+    Drop expired entries, then the least recently used ones beyond
+    OPENAI_CACHE_MAX_ENTRIES. Rows without a cache key are plain logs and
+    are left alone.
+    """
+    ttl = getattr(settings, 'OPENAI_CACHE_TTL', DEFAULT_CACHE_TTL)
+    max_entries = getattr(settings, 'OPENAI_CACHE_MAX_ENTRIES', DEFAULT_CACHE_MAX_ENTRIES)
+    entries = PromptLog.objects.exclude(cache_key='')
+    entries.filter(created_on__lt=timezone.now() - timedelta(seconds=ttl)).delete()
+    overflow = entries.count() - max_entries
+    if overflow > 0:
+        stale_ids = list(entries.order_by('last_used_on').values_list('id', flat=True)[:overflow])
+        PromptLog.objects.filter(id__in=stale_ids).delete()
+
+def stats():
+    with _lock:
+        report = dict(_stats)
+    lookups = report['hits'] + report['misses']
+    report['hit_rate'] = round(report['hits'] / lookups, 3) if lookups else None
+    report['saved_seconds'] = round(report['saved_seconds'], 3)
+    return report
@@ -0,0 +1,221 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from .leases import OWNER_ID, lease_is_free
+from .models import OpenAISlot
+
+# Priority classes, served in this order when requests queue up.
+INTERACTIVE = 'interactive'
+DUE_SOON = 'due_soon'
+PRECOMPUTE = 'precompute'
+PRIORITIES = (INTERACTIVE, DUE_SOON, PRECOMPUTE)
+
+DEFAULT_CONCURRENCY = {'chat': 8, 'image': 4}
+DEFAULT_SLOT_LEASE = 300
+SHARED_POLL_INTERVAL = 0.1
+
+# Scheduler work is due-soon unless marked otherwise.
+_priority = contextvars.ContextVar('openai_priority', default=DUE_SOON)
+
+@contextmanager
+def priority(name):
+    """Run the enclosed OpenAI calls in priority class ``name``."""
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+def current_priority():
+    return _priority.get()
+
+class _Waiter:
+    def __init__(self, loop=None):
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+        self.cancelled = False
+
+class Governor:
+    """
+    Admission control for one OpenAI endpoint kind ('chat' or 'image'): at
+    most ``limit`` requests run at once in this process, and queued
+    requests are admitted by priority class, then arrival order. Threads
+    use acquire()/release(); coroutines await aacquire().
+    """
+    def __init__(self, kind, limit):
+        self.kind = kind
+        self.limit = limit
+        self.in_use = 0
+        self.queue = []
+        self.seq = itertools.count()
+        self.lock = threading.Lock()
+        self.max_queue_depth = 0
+        self.waits = {}
+        for name in PRIORITIES:
+            self._waits_for(name)
+
+    def _waits_for(self, priority_name):
+        return self.waits.setdefault(priority_name, {'admitted': 0, 'queued': 0, 'total_wait': 0.0, 'max_wait': 0.0})
+
+    def _admit_or_enqueue(self, priority_name, waiter):
+        with self.lock:
+            if self.in_use < self.limit and not self.queue:
+                self.in_use += 1
+                return True
+            rank = PRIORITIES.index(priority_name) if priority_name in PRIORITIES else len(PRIORITIES)
+            heapq.heappush(self.queue, (rank, next(self.seq), waiter))
+            self.max_queue_depth = max(self.max_queue_depth, len(self.queue))
+            self._waits_for(priority_name)['queued'] += 1
+            return False
+
+    def _record(self, priority_name, waited):
+        with self.lock:
+            stats = self._waits_for(priority_name)
+            stats['admitted'] += 1
+            stats['total_wait'] += waited
+            stats['max_wait'] = max(stats['max_wait'], waited)
+
+    def acquire(self, priority_name):
+        started = time.monotonic()
+        waiter = _Waiter()
+        if not self._admit_or_enqueue(priority_name, waiter):
+            waiter.event.wait()
+        self._record(priority_name, time.monotonic() - started)
+
+    async def aacquire(self, priority_name):
+        started = time.monotonic()
+        waiter = _Waiter(asyncio.get_running_loop())
+        if not self._admit_or_enqueue(priority_name, waiter):
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                with self.lock:
+                    waiter.cancelled = True
+                raise
+        self._record(priority_name, time.monotonic() - started)
+
+    def release(self):
+        # Hand the slot straight to the best queued waiter, if any.
+        with self.lock:
+            while self.queue:
+                _, _, waiter = heapq.heappop(self.queue)
+                if waiter.cancelled:
+                    continue
+                if waiter.loop is None:
+                    waiter.event.set()
+                else:
+                    waiter.loop.call_soon_threadsafe(self._deliver, waiter)
+                return
+            self.in_use -= 1
+
+    def _deliver(self, waiter):
+        if waiter.future.cancelled():
+            self.release()
+        else:
+            waiter.future.set_result(None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'limit': self.limit,
+                'in_use': self.in_use,
+                'queue_depth': len(self.queue),
+                'max_queue_depth': self.max_queue_depth,
+                'priorities': {
+                    name: {
+                        'admitted': s['admitted'],
+                        'queued': s['queued'],
+                        'avg_wait': round(s['total_wait'] / s['admitted'], 3) if s['admitted'] else None,
+                        'max_wait': round(s['max_wait'], 3),
+                    }
+                    for name, s in self.waits.items()
+                },
+            }
+
+_governors = {}
+_governors_lock = threading.Lock()
+_slots_created = set()
+
+def get_governor(kind):
+    with _governors_lock:
+        if kind not in _governors:
+            limits = getattr(settings, 'OPENAI_CONCURRENCY', DEFAULT_CONCURRENCY)
+            _governors[kind] = Governor(kind, limits.get(kind, DEFAULT_CONCURRENCY.get(kind, 4)))
+        return _governors[kind]
+
+def shared():
+    return getattr(settings, 'OPENAI_GOVERNOR_SHARED', False)
+
+def claim_shared_slot(kind, limit):
+    """Lease one of the ``limit`` database slots for ``kind``; None if all are taken."""
+    if kind not in _slots_created:
+        OpenAISlot.objects.bulk_create([OpenAISlot(kind=kind, slot=i) for i in range(limit)], ignore_conflicts=True)
+        _slots_created.add(kind)
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=getattr(settings, 'OPENAI_SLOT_LEASE', DEFAULT_SLOT_LEASE))
+    free = OpenAISlot.objects.filter(lease_is_free(now), kind=kind, slot__lt=limit)
+    for slot_id in free.values_list('id', flat=True):
+        won = OpenAISlot.objects.filter(lease_is_free(now), id=slot_id).update(
+            claimed_by=OWNER_ID,
+            claim_expires_at=expires_at,
+        )
+        if won:
+            return slot_id
+    return None
+
+def release_shared_slot(slot_id):
+    OpenAISlot.objects.filter(id=slot_id, claimed_by=OWNER_ID).update(claimed_by='', claim_expires_at=None)
+
+@contextmanager
+def admit(kind):
+    """
+    Hold an admission slot for one ``kind`` request ('chat' or 'image') in
+    the current priority class. With OPENAI_GOVERNOR_SHARED the slot is
+    also leased in the database, so the limit holds across processes.
+    """
+    governor = get_governor(kind)
+    governor.acquire(current_priority())
+    slot_id = None
+    try:
+        if shared():
+            while slot_id is None:
+                slot_id = claim_shared_slot(kind, governor.limit)
+                if slot_id is None:
+                    time.sleep(SHARED_POLL_INTERVAL)
+        yield
+    finally:
+        if slot_id is not None:
+            release_shared_slot(slot_id)
+        governor.release()
+
+@asynccontextmanager
+async def aadmit(kind):
+    """Coroutine version of admit()."""
+    governor = get_governor(kind)
+    await governor.aacquire(current_priority())
+    slot_id = None
+    try:
+        if shared():
+            while slot_id is None:
+                slot_id = await sync_to_async(claim_shared_slot)(kind, governor.limit)
+                if slot_id is None:
+                    await asyncio.sleep(SHARED_POLL_INTERVAL)
+        yield
+    finally:
+        if slot_id is not None:
+            await sync_to_async(release_shared_slot)(slot_id)
+        governor.release()
+
+def stats():
+    with _governors_lock:
+        governors = list(_governors.values())
+    return {governor.kind: governor.stats() for governor in governors}
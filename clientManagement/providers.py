@@ -0,0 +1,343 @@
+import abc
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+from django.conf import settings
+from . import http_client
+
+OPENAI_API_URL = "https://api.openai.com/v1"
+DEFAULT_OPENAI_TEXT_TIMEOUT = 30
+DEFAULT_OPENAI_IMAGE_TIMEOUT = 120
+
+class ProviderError(Exception):
+    pass
+
+class Provider(abc.ABC):
+    """
+    Text and image generation backend behind generate_with_openai. Select
+    one with AI_PROVIDER. ``text_model``/``image_model``/``image_size`` are
+    part of the response cache key, so backends never share entries.
+    """
+    name = None
+    text_model = None
+    text_temperature = None
+    image_model = None
+    image_size = None
+
+    @abc.abstractmethod
+    def generate_text(self, text_prompt, max_tokens=256):
+        """Return the completion of ``text_prompt``."""
+
+    def generate_texts(self, text_prompt, n, max_tokens=256):
+        """``n`` completions of ``text_prompt``; backends may answer them in one call."""
+        return [self.generate_text(text_prompt, max_tokens) for _ in range(n)]
+
+    @abc.abstractmethod
+    def generate_image(self, image_prompt):
+        """Return the URL of a generated image, or None."""
+
+    def stream_text(self, text_prompt, max_tokens=256):
+        yield self.generate_text(text_prompt, max_tokens)
+
+    async def agenerate_text(self, text_prompt, max_tokens=256):
+        return await asyncio.to_thread(self.generate_text, text_prompt, max_tokens)
+
+    async def agenerate_image(self, image_prompt):
+        return await asyncio.to_thread(self.generate_image, image_prompt)
+
+    def fetch_image(self, url):
+        """Image bytes for a URL this provider serves itself, else None."""
+        return None
+
+class OpenAIProvider(Provider):
+    name = 'openai'
+    text_model = "gpt-3.5-turbo"
+    text_temperature = 0.7
+    image_model = "dall-e-3"
+    image_size = "1024x1024"
+
+    def headers(self):
+        api_key = os.getenv('CHATGPT_API')
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}"
+        }
+
+    def text_payload(self, text_prompt, max_tokens=256, n=1):
+        payload = {
+            "model": self.text_model,
+            "messages": [
+                {"role": "user", "content": text_prompt}
+            ],
+            "max_tokens": max_tokens,
+            "temperature": self.text_temperature
+        }
+        if n > 1:
+            payload["n"] = n
+        return payload
+
+    def image_payload(self, image_prompt):
+        return {
+            "model": self.image_model,
+            "prompt": image_prompt,
+            "n": 1,
+            "size": self.image_size
+        }
+
+    def parse_text_response(self, response_text):
+        return (self.parse_text_choices(response_text) or [""])[0]
+
+    def parse_text_choices(self, response_text):
+        if response_text.status_code != 200:
+            print(f"Error generating text prompt: {response_text.status_code}, {response_text.text}")
+            return []
+        choices = response_text.json().get("choices")
+        if not choices:
+            print("No text prompt generated.")
+            return []
+        return [choice["message"]["content"] for choice in choices]
+
+    def parse_image_response(self, response_image):
+        if response_image.status_code != 200:
+            print(f"Error: {response_image.status_code}, {response_image.text}")
+            return None
+        return response_image.json()["data"][0]["url"]
+
+    def text_timeout(self):
+        return getattr(settings, 'OPENAI_TEXT_TIMEOUT', DEFAULT_OPENAI_TEXT_TIMEOUT)
+
+    def image_timeout(self):
+        return getattr(settings, 'OPENAI_IMAGE_TIMEOUT', DEFAULT_OPENAI_IMAGE_TIMEOUT)
+
+    def generate_text(self, text_prompt, max_tokens=256):
+        response_text = http_client.post(
+            f"{OPENAI_API_URL}/chat/completions",
+            headers=self.headers(),
+            json=self.text_payload(text_prompt, max_tokens),
+            timeout=self.text_timeout()
+        )
+        return self.parse_text_response(response_text)
+
+    def generate_texts(self, text_prompt, n, max_tokens=256):
+        # One request with ``n`` choices pays for the prompt tokens once.
+        response_text = http_client.post(
+            f"{OPENAI_API_URL}/chat/completions",
+            headers=self.headers(),
+            json=self.text_payload(text_prompt, max_tokens, n),
+            timeout=self.text_timeout()
+        )
+        return self.parse_text_choices(response_text)
+
+    def generate_image(self, image_prompt):
+        response_image = http_client.post(
+            f"{OPENAI_API_URL}/images/generations",
+            headers=self.headers(),
+            json=self.image_payload(image_prompt),
+            timeout=self.image_timeout()
+        )
+        return self.parse_image_response(response_image)
+
+    def stream_text(self, text_prompt, max_tokens=256):
+        payload = self.text_payload(text_prompt, max_tokens)
+        payload["stream"] = True
+        response = http_client.post(
+            f"{OPENAI_API_URL}/chat/completions",
+            headers=self.headers(),
+            json=payload,
+            timeout=self.text_timeout(),
+            stream=True
+        )
+        try:
+            if response.status_code != 200:
+                raise ProviderError(f"Error generating text: {response.status_code}, {response.text}")
+            response.encoding = "utf-8"
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or []
+                delta = choices[0].get("delta", {}).get("content") if choices else None
+                if delta:
+                    yield delta
+        finally:
+            response.close()
+
+    async def agenerate_text(self, text_prompt, max_tokens=256):
+        from .async_pipeline import request
+        response = await request(
+            'POST', f"{OPENAI_API_URL}/chat/completions",
+            headers=self.headers(), json=self.text_payload(text_prompt, max_tokens), timeout=self.text_timeout(),
+        )
+        return self.parse_text_response(response)
+
+    async def agenerate_image(self, image_prompt):
+        from .async_pipeline import request
+        response = await request(
+            'POST', f"{OPENAI_API_URL}/images/generations",
+            headers=self.headers(), json=self.image_payload(image_prompt), timeout=self.image_timeout(),
+        )
+        return self.parse_image_response(response)
+
+LOCAL_IMAGE_PATH = "/local-provider/images/"
+LOCAL_IMAGE_NAME = re.compile(r"([0-9a-f]{32})\.png")
+LOCAL_WORDS = (
+    "bright", "bold", "fresh", "simple", "smart", "daily", "quick", "calm", "vivid", "honest",
+    "ideas", "moments", "habits", "stories", "wins", "goals", "tips", "plans", "steps", "views",
+)
+
+def render_png(digest, size):
+    """A small deterministic gradient PNG derived from a hex ``digest``."""
+    seed = bytes.fromhex(digest[:12])
+    start, end = seed[:3], seed[3:6]
+    rows = []
+    for y in range(size):
+        mix = y / max(1, size - 1)
+        pixel = bytes(int(a + (b - a) * mix) for a, b in zip(start, end))
+        rows.append(b"\x00" + pixel * size)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(b"".join(rows))) + chunk(b"IEND", b"")
+
+class LocalProvider(Provider):
+    """
+    Offline stand-in for load tests and benchmarks. Responses depend only on
+    the prompt: prompt-generation requests get valid ``text_prompt`` /
+    ``image_prompt`` JSON (batched ones a keyed array), other requests a
+    short post, and images are small PNGs served by this app. Latency is
+    drawn from a normal distribution (LOCAL_PROVIDER_*_LATENCY = (mean,
+    stddev) seconds) and LOCAL_PROVIDER_ERROR_RATE of calls fail.
+    """
+    name = 'local'
+    text_model = "local-text"
+    text_temperature = 0
+    image_model = "local-image"
+    image_size = "png"
+
+    def __init__(self):
+        seed = getattr(settings, 'LOCAL_PROVIDER_SEED', None)
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+
+    def _latency(self, setting, default):
+        mean, stddev = getattr(settings, setting, default)
+        with self.random_lock:
+            return max(0.0, self.random.gauss(mean, stddev))
+
+    def _maybe_fail(self, kind):
+        with self.random_lock:
+            failed = self.random.random() < getattr(settings, 'LOCAL_PROVIDER_ERROR_RATE', 0.0)
+        if failed:
+            raise ProviderError(f"Simulated {kind} failure from the local provider.")
+
+    def _digest(self, text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _phrase(self, digest, words=8):
+        return " ".join(LOCAL_WORDS[int(digest[i:i + 2], 16) % len(LOCAL_WORDS)] for i in range(0, words * 2, 2))
+
+    def _prompt_pair(self, digest):
+        return {
+            "text_prompt": f"Write a post about {self._phrase(digest, 4)}.",
+            "image_prompt": f"An illustration of {self._phrase(digest[8:], 4)}.",
+        }
+
+    @staticmethod
+    def _batch_keys(text_prompt):
+        # The keys of the posts listed one JSON object per line by
+        # build_batch_prompt(); the response format example is skipped.
+        keys = []
+        for line in text_prompt.splitlines():
+            try:
+                item = json.loads(line.strip())
+            except ValueError:
+                continue
+            if isinstance(item, dict) and 'key' in item and 'text_prompt' not in item and item['key'] not in keys:
+                keys.append(item['key'])
+        return keys
+
+    def respond(self, text_prompt):
+        digest = self._digest(text_prompt)
+        keys = self._batch_keys(text_prompt)
+        if keys and '"text_prompt"' in text_prompt:
+            return json.dumps([
+                dict(key=key, **self._prompt_pair(self._digest(text_prompt + key))) for key in keys
+            ])
+        if '"text_prompt"' in text_prompt:
+            return json.dumps(self._prompt_pair(digest))
+        return f"{self._phrase(digest, 12).capitalize()}."
+
+    def generate_text(self, text_prompt, max_tokens=256):
+        time.sleep(self._latency('LOCAL_PROVIDER_TEXT_LATENCY', (0.5, 0.1)))
+        self._maybe_fail("text")
+        return self.respond(text_prompt)
+
+    def generate_texts(self, text_prompt, n, max_tokens=256):
+        time.sleep(self._latency('LOCAL_PROVIDER_TEXT_LATENCY', (0.5, 0.1)))
+        self._maybe_fail("text")
+        return [self.respond(text_prompt if i == 0 else f"{text_prompt}#{i}") for i in range(n)]
+
+    def generate_image(self, image_prompt):
+        time.sleep(self._latency('LOCAL_PROVIDER_IMAGE_LATENCY', (2.0, 0.5)))
+        self._maybe_fail("image")
+        return self.image_url(self._digest(image_prompt))
+
+    def stream_text(self, text_prompt, max_tokens=256):
+        latency = self._latency('LOCAL_PROVIDER_TEXT_LATENCY', (0.5, 0.1))
+        self._maybe_fail("text")
+        pieces = re.findall(r"\S+\s*", self.respond(text_prompt))
+        for piece in pieces:
+            time.sleep(latency / max(1, len(pieces)))
+            yield piece
+
+    async def agenerate_text(self, text_prompt, max_tokens=256):
+        await asyncio.sleep(self._latency('LOCAL_PROVIDER_TEXT_LATENCY', (0.5, 0.1)))
+        self._maybe_fail("text")
+        return self.respond(text_prompt)
+
+    async def agenerate_image(self, image_prompt):
+        await asyncio.sleep(self._latency('LOCAL_PROVIDER_IMAGE_LATENCY', (2.0, 0.5)))
+        self._maybe_fail("image")
+        return self.image_url(self._digest(image_prompt))
+
+    def _image_prefix(self):
+        base_url = getattr(settings, 'LOCAL_PROVIDER_BASE_URL', 'http://127.0.0.1:8000')
+        return f"{base_url.rstrip('/')}{LOCAL_IMAGE_PATH}"
+
+    def image_url(self, digest):
+        return f"{self._image_prefix()}{digest[:32]}.png"
+
+    def fetch_image(self, url):
+        match = LOCAL_IMAGE_NAME.fullmatch(url[len(self._image_prefix()):]) if url and url.startswith(self._image_prefix()) else None
+        return self.render(match.group(1)) if match else None
+
+    def render(self, digest):
+        return render_png(digest, getattr(settings, 'LOCAL_PROVIDER_IMAGE_SIZE', 64))
+
+PROVIDERS = {
+    'openai': OpenAIProvider,
+    'local': LocalProvider,
+}
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+def get_provider():
+    name = getattr(settings, 'AI_PROVIDER', 'openai')
+    with _providers_lock:
+        if name not in _providers:
+            if name not in PROVIDERS:
+                raise ProviderError(f"Unknown AI_PROVIDER: {name}")
+            _providers[name] = PROVIDERS[name]()
+        return _providers[name]
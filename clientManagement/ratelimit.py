@@ -0,0 +1,262 @@
+import asyncio
+import json
+import threading
+import time
+from functools import partial
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from .models import RateLimitBucket
+
+# Requests allowed per window for one credential, kept a little under the
+# documented platform quota.
+DEFAULT_RATE_LIMITS = {
+    'facebook': {'requests': 180, 'per': 3600, 'burst': 10},
+    'instagram': {'requests': 180, 'per': 3600, 'burst': 10},
+    'twitter': {'requests': 180, 'per': 900, 'burst': 5},
+    'reddit': {'requests': 90, 'per': 60, 'burst': 10},
+}
+DEFAULT_MAX_WAIT = 10
+SAFETY_FACTOR = 0.9
+
+class RateLimited(Exception):
+    def __init__(self, platform, retry_after):
+        self.platform = platform
+        self.retry_after = retry_after
+        super().__init__(f"{platform} rate limit reached, retry in {retry_after:.0f}s")
+
+class TokenBucket:
+    """
+    Classic token bucket. ``acquire`` queues the caller until a token is
+    free, or gives up straight away when the wait would exceed ``timeout``.
+    ``observe`` narrows the bucket to what the platform reports as left in
+    the current window; the base rate comes back once that window resets.
+    """
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self, rate, capacity):
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = self.clock()
+        self.blocked_until = 0.0
+        self.narrowed_until = 0.0
+        self.cond = threading.Condition()
+
+    def _refill(self, now):
+        if self.narrowed_until and now >= self.narrowed_until:
+            # The reported window has reset: refill at the narrowed rate up
+            # to the reset, at the base rate from there on.
+            self.tokens = min(self.capacity, self.tokens + max(0.0, self.narrowed_until - self.updated) * self.rate)
+            self.updated = max(self.updated, self.narrowed_until)
+            self.rate = self.base_rate
+            self.narrowed_until = 0.0
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _wait_time(self, now):
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            needed = 1 - self.tokens
+            narrowed_for = max(0.0, self.narrowed_until - now)
+            if narrowed_for and needed > narrowed_for * self.rate:
+                wait = max(wait, narrowed_for + (needed - narrowed_for * self.rate) / self.base_rate)
+            else:
+                wait = max(wait, needed / self.rate)
+        return wait
+
+    def _take(self, now):
+        wait = self._wait_time(now)
+        if wait <= 0:
+            self.tokens -= 1
+        return wait
+
+    def _narrow(self, remaining, reset_in, now):
+        self._refill(now)
+        if remaining is not None:
+            self.tokens = min(self.tokens, remaining)
+            if reset_in:
+                self.rate = min(self.base_rate, max(remaining, 1) * SAFETY_FACTOR / reset_in)
+                self.narrowed_until = now + reset_in
+            else:
+                self.rate = self.base_rate
+                self.narrowed_until = 0.0
+        if reset_in and (remaining is None or remaining <= 0):
+            self.blocked_until = max(self.blocked_until, now + reset_in)
+
+    def _apply(self, step):
+        # Called with self.cond held; SharedTokenBucket runs ``step`` against the database row.
+        return step(self.clock())
+
+    def wait_time(self):
+        with self.cond:
+            return self._apply(self._wait_time)
+
+    def acquire(self, timeout=None):
+        deadline = None if timeout is None else self.clock() + timeout
+        with self.cond:
+            while True:
+                wait = self._apply(self._take)
+                if wait <= 0:
+                    return 0.0
+                if deadline is not None and self.clock() + wait > deadline:
+                    raise RateLimited('bucket', wait)
+                self.cond.wait(wait)
+
+    def observe(self, remaining=None, reset_in=None):
+        with self.cond:
+            self._apply(partial(self._narrow, remaining, reset_in))
+            self.cond.notify_all()
+
+class SharedTokenBucket(TokenBucket):
+    """
+    TokenBucket whose state lives in a RateLimitBucket row, so the web
+    processes and `run_scheduler` draw from one quota per credential. Each
+    step re-reads the row and writes it back only if nobody changed it in
+    the meantime, retrying otherwise.
+    """
+    clock = staticmethod(time.time)
+
+    def __init__(self, platform, credential_key, rate, capacity):
+        super().__init__(rate, capacity)
+        self.platform = platform
+        self.credential_key = credential_key
+
+    def _apply(self, step):
+        while True:
+            row, _ = RateLimitBucket.objects.get_or_create(
+                platform=self.platform,
+                credential_key=self.credential_key,
+                defaults={'tokens': self.capacity, 'rate': self.base_rate, 'updated': self.clock()},
+            )
+            self.tokens, self.updated, self.blocked_until = row.tokens, row.updated, row.blocked_until
+            # Rows that are not narrowed follow the configured rate.
+            self.narrowed_until = row.narrowed_until
+            self.rate = row.rate if row.narrowed_until else self.base_rate
+            result = step(self.clock())
+            won = RateLimitBucket.objects.filter(id=row.id, version=row.version).update(
+                tokens=self.tokens,
+                rate=self.rate,
+                updated=self.updated,
+                blocked_until=self.blocked_until,
+                narrowed_until=self.narrowed_until,
+                version=row.version + 1,
+            )
+            if won:
+                return result
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def parse_rate_limit_headers(platform, response):
+    """
+    Return ``(remaining, reset_in_seconds)`` from a platform response; either
+    may be None when the platform did not say.
+    """
+    headers = response.headers
+    remaining = reset_in = None
+
+    if platform == 'twitter':
+        remaining = _float(headers.get('x-rate-limit-remaining'))
+        reset_at = _float(headers.get('x-rate-limit-reset'))
+        if reset_at:
+            reset_in = max(0.0, reset_at - time.time())
+    elif platform == 'reddit':
+        remaining = _float(headers.get('x-ratelimit-remaining'))
+        reset_in = _float(headers.get('x-ratelimit-reset'))
+    elif platform in ('facebook', 'instagram'):
+        # Graph API reports usage as a percentage of the hourly allowance.
+        usage = []
+        for name in ('x-app-usage', 'x-business-use-case-usage'):
+            raw = headers.get(name)
+            if not raw:
+                continue
+            try:
+                data = json.loads(raw)
+            except ValueError:
+                continue
+            entries = [data]
+            if name == 'x-business-use-case-usage':
+                entries = [entry for values in data.values() for entry in values]
+            for entry in entries:
+                usage.append(max(entry.get('call_count', 0), entry.get('total_time', 0), entry.get('total_cputime', 0)))
+                regain = entry.get('estimated_time_to_regain_access')
+                if regain:
+                    reset_in = max(reset_in or 0, regain * 60)
+        if usage:
+            limits = get_limits(platform)
+            remaining = max(0.0, (100 - max(usage)) / 100 * limits['requests'])
+            if reset_in is None and remaining <= 0:
+                reset_in = limits['per']
+
+    if response.status_code == 429:
+        remaining = 0
+        retry_after = _float(headers.get('retry-after'))
+        reset_in = retry_after or reset_in or 60
+    return remaining, reset_in
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+def get_limits(platform):
+    limits = getattr(settings, 'PLATFORM_RATE_LIMITS', DEFAULT_RATE_LIMITS)
+    return limits.get(platform) or DEFAULT_RATE_LIMITS.get(platform) or {'requests': 60, 'per': 60, 'burst': 5}
+
+def shared():
+    return getattr(settings, 'RATE_LIMIT_SHARED', True)
+
+def get_bucket(platform, credential_key):
+    """
+    One bucket per (platform, credential), shared by every caller: the
+    scheduler's publish jobs and ScheduleSubmitView alike. With
+    RATE_LIMIT_SHARED (the default) its state is kept in the database, so
+    the quota also holds across the web and `run_scheduler` processes.
+    """
+    key = (platform, credential_key)
+    with _buckets_lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            limits = get_limits(platform)
+            rate = limits['requests'] / limits['per']
+            if shared():
+                bucket = SharedTokenBucket(platform, str(credential_key), rate, limits['burst'])
+            else:
+                bucket = TokenBucket(rate, limits['burst'])
+            _buckets[key] = bucket
+        return bucket
+
+def acquire(platform, credential_key, timeout=None):
+    if timeout is None:
+        timeout = getattr(settings, 'RATE_LIMIT_MAX_WAIT', DEFAULT_MAX_WAIT)
+    try:
+        return get_bucket(platform, credential_key).acquire(timeout)
+    except RateLimited as e:
+        raise RateLimited(platform, e.retry_after)
+
+async def aacquire(platform, credential_key, timeout=None):
+    """
+    Coroutine version of acquire(): the wait for a token is an
+    asyncio.sleep, so a rate-limited publish does not hold a thread.
+    """
+    if timeout is None:
+        timeout = getattr(settings, 'RATE_LIMIT_MAX_WAIT', DEFAULT_MAX_WAIT)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return await sync_to_async(acquire)(platform, credential_key, 0)
+        except RateLimited as e:
+            if time.monotonic() + e.retry_after > deadline:
+                raise
+            await asyncio.sleep(e.retry_after)
+
+def observe(platform, credential_key, response):
+    remaining, reset_in = parse_rate_limit_headers(platform, response)
+    if remaining is None and reset_in is None:
+        return
+    get_bucket(platform, credential_key).observe(remaining, reset_in)
+    if response.status_code == 429:
+        raise RateLimited(platform, reset_in)
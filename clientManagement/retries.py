@@ -0,0 +1,76 @@
+import random
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+DEFAULT_RETRY_BASE = 30
+DEFAULT_RETRY_CAP = 3600
+DEFAULT_MAX_ATTEMPTS = 6
+
+def eligible_for_attempt(now):
+    """Rows that are not dead-lettered and not waiting out a backoff."""
+    return Q(dead_lettered=False) & (Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now))
+
+def backoff_delay(attempt):
+    """
+    Exponential backoff with jitter: 30 s, 60 s, 120 s ... capped at
+    PUBLISH_RETRY_CAP, each drawn from the upper half of its interval so
+    posts that failed together do not retry together.
+    """
+    base = getattr(settings, 'PUBLISH_RETRY_BASE', DEFAULT_RETRY_BASE)
+    cap = getattr(settings, 'PUBLISH_RETRY_CAP', DEFAULT_RETRY_CAP)
+    delay = min(cap, base * 2 ** max(0, attempt - 1))
+    return random.uniform(delay / 2, delay)
+
+def record_failure(model, row_id, error, retry_after=None):
+    """
+    Schedule the next attempt for a failed CampaignPost/ScheduledPost and
+    return True when the row has been moved to the dead-letter state.
+
+    ``retry_after`` is used for rate-limit deferrals: the row waits that long
+    but the attempt is not counted against it.
+    """
+    now = timezone.now()
+    row = model.objects.filter(id=row_id).values('attempt_count').first()
+    if row is None:
+        return False
+
+    if retry_after is not None:
+        model.objects.filter(id=row_id).update(
+            next_attempt_at=now + timedelta(seconds=retry_after),
+            last_error=str(error),
+        )
+        return False
+
+    attempts = row['attempt_count'] + 1
+    max_attempts = getattr(settings, 'PUBLISH_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+    dead = attempts >= max_attempts
+    model.objects.filter(id=row_id).update(
+        attempt_count=attempts,
+        next_attempt_at=None if dead else now + timedelta(seconds=backoff_delay(attempts)),
+        last_error=str(error),
+        dead_lettered=dead,
+    )
+    return dead
+
+def record_success(model, row_id):
+    model.objects.filter(id=row_id).exclude(attempt_count=0, next_attempt_at__isnull=True).update(
+        attempt_count=0,
+        next_attempt_at=None,
+        last_error='',
+    )
+
+def redrive(queryset):
+    """
+    Put dead-lettered rows back into the pipeline with a fresh retry budget.
+    ``redriven_at`` restarts the catch-up grace period, so rows whose slot
+    is long past are published instead of being expired again.
+    """
+    return queryset.filter(dead_lettered=True).update(
+        dead_lettered=False,
+        attempt_count=0,
+        next_attempt_at=None,
+        last_error='',
+        redriven_at=timezone.now(),
+    )
@@ -1,7 +1,377 @@
-from apscheduler.schedulers.background import BackgroundScheduler
-from .tasks import run_campaign_scheduler
+import heapq
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+from .models import CampaignPost, ChangeMarker, ScheduledPost
+from .tasks import run_campaign_scheduler, run_precompute_step, has_due_work, lateness_summary, PROMPT_LEAD, CONTENT_LEAD
+from . import async_pipeline, cloudinary_cache, dispatcher, http_client, leases, media_store, openai_cache, openai_governor, suggestions
 
-def start():
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(run_campaign_scheduler, 'interval', seconds=20)
-    scheduler.start()
+DEFAULT_LOOKAHEAD = 3600
+DEFAULT_MAX_IDLE = 300
+DEFAULT_RETRY_INTERVAL = 20
+DEFAULT_DEADLINE_LIMIT = 1000
+DEFAULT_GENERATION_RATE = 6
+DEFAULT_GENERATION_IDLE = 300
+DEFAULT_CHANGE_POLL = 1
+
+TICK = 'tick'
+REFRESH = 'refresh'
+SCHEDULE_MARKER = 'schedule'
+
+def mark_changed():
+    """Bump the schedule ChangeMarker, waking schedulers in other processes."""
+    if not ChangeMarker.objects.filter(name=SCHEDULE_MARKER).update(version=F('version') + 1):
+        ChangeMarker.objects.get_or_create(name=SCHEDULE_MARKER, defaults={'version': 1})
+
+def change_version():
+    return ChangeMarker.objects.filter(name=SCHEDULE_MARKER).values_list('version', flat=True).first() or 0
+
+def wait_for_change(wakeup, timeout, seen_version):
+    """
+    Wait up to ``timeout`` seconds for notify() in this process, or for
+    another process to bump the schedule marker past ``seen_version``
+    (checked every SCHEDULER_CHANGE_POLL seconds). True if woken early.
+    """
+    poll = getattr(settings, 'SCHEDULER_CHANGE_POLL', DEFAULT_CHANGE_POLL)
+    ends_at = time.monotonic() + timeout
+    while True:
+        remaining = ends_at - time.monotonic()
+        if remaining <= 0:
+            return False
+        if wakeup.wait(min(poll, remaining)):
+            return True
+        try:
+            if change_version() != seen_version:
+                return True
+        except Exception as e:
+            print(f"Checking for schedule changes failed: {e}")
+
+class DeadlineScheduler:
+    """
+    Sleeps until the next CampaignPost/ScheduledPost deadline instead of
+    polling on a fixed interval.
+
+    Upcoming deadlines (prompt window, content window and publish time of
+    each pending post) within SCHEDULER_LOOKAHEAD seconds are kept in a
+    min-heap. The loop wakes when the earliest one passes and runs a tick,
+    or when campaigns or schedules change, in which case it only reloads the
+    heap: saves in this process call notify(), saves in other processes bump
+    a ChangeMarker polled every SCHEDULER_CHANGE_POLL seconds. The heap is
+    also reloaded at least every SCHEDULER_MAX_IDLE seconds.
+    """
+    def __init__(self):
+        self.lookahead = timedelta(seconds=getattr(settings, 'SCHEDULER_LOOKAHEAD', DEFAULT_LOOKAHEAD))
+        self.max_idle = timedelta(seconds=getattr(settings, 'SCHEDULER_MAX_IDLE', DEFAULT_MAX_IDLE))
+        self.retry_interval = timedelta(seconds=getattr(settings, 'SCHEDULER_RETRY_INTERVAL', DEFAULT_RETRY_INTERVAL))
+        self.deadline_limit = getattr(settings, 'SCHEDULER_DEADLINE_LIMIT', DEFAULT_DEADLINE_LIMIT)
+        self.heap = []
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.last_tick = None
+        self.last_report = None
+        self.seen_version = None
+
+    def notify(self):
+        self.wakeup.set()
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run_forever, name='deadline-scheduler', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        self.stopping.set()
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def upcoming_deadlines(self, now):
+        horizon = now + self.lookahead
+        deadlines = []
+
+        posts = CampaignPost.objects.filter(
+            is_active=True,
+            campaign__is_active=True,
+            dead_lettered=False,
+            posted=False,
+            scheduled_at__gt=now,
+            scheduled_at__lte=horizon + PROMPT_LEAD,
+        ).order_by('scheduled_at').values_list(
+            'scheduled_at', 'is_prompt_generated', 'is_content_generated'
+        )[:self.deadline_limit]
+        for scheduled_at, prompt_done, content_done in posts:
+            if not prompt_done:
+                deadlines.append(scheduled_at - PROMPT_LEAD)
+            if not content_done:
+                deadlines.append(scheduled_at - CONTENT_LEAD)
+            deadlines.append(scheduled_at)
+
+        scheduled = ScheduledPost.objects.filter(
+            is_active=True,
+            dead_lettered=False,
+            posted=False,
+            scheduled_time__gt=now,
+            scheduled_time__lte=horizon,
+        ).order_by('scheduled_time').values_list('scheduled_time', flat=True)[:self.deadline_limit]
+        deadlines.extend(scheduled)
+
+        # Posts backing off after a failure become due again at next_attempt_at.
+        for model in (CampaignPost, ScheduledPost):
+            retries = model.objects.filter(
+                is_active=True,
+                posted=False,
+                dead_lettered=False,
+                next_attempt_at__gt=now,
+                next_attempt_at__lte=horizon,
+            ).order_by('next_attempt_at').values_list('next_attempt_at', flat=True)[:self.deadline_limit]
+            deadlines.extend(retries)
+
+        return [deadline for deadline in deadlines if now < deadline <= horizon]
+
+    def refresh(self, now):
+        # Read first: a change made while the deadlines load wakes us again.
+        self.seen_version = change_version()
+        self.heap = [(deadline, TICK) for deadline in self.upcoming_deadlines(now)]
+        self.heap.append((now + min(self.lookahead, self.max_idle), REFRESH))
+        heapq.heapify(self.heap)
+
+    def tick(self):
+        self.last_tick = timezone.now()
+        try:
+            self.last_report = run_campaign_scheduler()
+            # Saves made by the tick's own jobs are covered by this refresh.
+            self.wakeup.clear()
+            now = timezone.now()
+            self.refresh(now)
+            if self.last_report.get('backlog'):
+                # More was due than one claim batch: keep draining.
+                heapq.heappush(self.heap, (now, TICK))
+            elif self.last_report['carried_over']:
+                heapq.heappush(self.heap, (now + timedelta(seconds=1), TICK))
+            elif has_due_work(now):
+                # Due rows this process could not claim (leased elsewhere) or
+                # that just failed: back off instead of spinning.
+                heapq.heappush(self.heap, (now + self.retry_interval, TICK))
+        except Exception as e:
+            print(f"Scheduler tick failed: {e}")
+            self.heap = [(timezone.now() + self.retry_interval, TICK)]
+        finally:
+            close_old_connections()
+
+    def run_forever(self):
+        self.tick()
+        while not self.stopping.is_set():
+            due_at = self.heap[0][0]
+            delay = (due_at - timezone.now()).total_seconds()
+            if delay > 0 and wait_for_change(self.wakeup, delay, self.seen_version):
+                self.wakeup.clear()
+                if not self.stopping.is_set():
+                    self.reload()
+                continue
+            if self.stopping.is_set():
+                break
+            now = timezone.now()
+            due = []
+            while self.heap and self.heap[0][0] <= now:
+                due.append(heapq.heappop(self.heap)[1])
+            if TICK in due:
+                self.tick()
+            else:
+                self.reload()
+
+    def reload(self):
+        # Retry and carry-over wake-ups are not in the DB, so keep them.
+        pending = [entry for entry in self.heap if entry[1] == TICK and entry[0] <= timezone.now() + self.retry_interval]
+        try:
+            self.refresh(timezone.now())
+        except Exception as e:
+            print(f"Scheduler refresh failed: {e}")
+            self.heap = []
+            pending.append((timezone.now() + self.retry_interval, REFRESH))
+        finally:
+            close_old_connections()
+        for entry in pending:
+            heapq.heappush(self.heap, entry)
+
+class PrecomputeGenerator:
+    """
+    Generates prompts and media ahead of time at a steady
+    GENERATION_RATE_PER_MINUTE, earliest slot first, for posts inside their
+    campaign's generation horizon. This spreads OpenAI load over the day
+    instead of bunching it into the hour before popular slots; the
+    scheduler's own prompt/content windows only catch what it did not reach.
+
+    GENERATION_PRECOMPUTE_HOURS optionally restricts the work to off-peak
+    UTC hours.
+    """
+    def __init__(self, rate=None):
+        rate = rate or getattr(settings, 'GENERATION_RATE_PER_MINUTE', DEFAULT_GENERATION_RATE)
+        self.interval = 60.0 / rate
+        self.idle_wait = getattr(settings, 'GENERATION_IDLE_WAIT', DEFAULT_GENERATION_IDLE)
+        self.hours = getattr(settings, 'GENERATION_PRECOMPUTE_HOURS', None)
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def notify(self):
+        self.wakeup.set()
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run_forever, name='precompute-generator', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        self.stopping.set()
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def in_precompute_hours(self, now):
+        return self.hours is None or now.hour in self.hours
+
+    def run_forever(self):
+        seen_version = None
+        while not self.stopping.is_set():
+            started = timezone.now()
+            worked = False
+            try:
+                seen_version = change_version()
+            except Exception as e:
+                print(f"Checking for schedule changes failed: {e}")
+            if self.in_precompute_hours(started):
+                try:
+                    with openai_governor.priority(openai_governor.PRECOMPUTE):
+                        worked = run_precompute_step(started)
+                except Exception as e:
+                    print(f"Precompute step failed: {e}")
+                finally:
+                    close_old_connections()
+            if worked:
+                elapsed = (timezone.now() - started).total_seconds()
+                self.stopping.wait(max(0.0, self.interval - elapsed))
+            else:
+                wait_for_change(self.wakeup, self.idle_wait, seen_version)
+                self.wakeup.clear()
+
+_scheduler = None
+_generator = None
+_sweeper = None
+_renewer = None
+_refiller = None
+_started_at = None
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = DeadlineScheduler()
+    return _scheduler
+
+def get_generator(rate=None):
+    global _generator
+    if _generator is None:
+        _generator = PrecomputeGenerator(rate)
+    return _generator
+
+def get_sweeper():
+    global _sweeper
+    if _sweeper is None:
+        _sweeper = media_store.MediaSweeper()
+    return _sweeper
+
+def get_refiller():
+    global _refiller
+    if _refiller is None:
+        _refiller = suggestions.SuggestionRefiller()
+    return _refiller
+
+def get_renewer():
+    global _renewer
+    if _renewer is None:
+        _renewer = leases.LeaseRenewer()
+    return _renewer
+
+def notify():
+    """Wake the scheduler and generator, in this process and any other."""
+    try:
+        mark_changed()
+    except Exception as e:
+        print(f"Marking a schedule change failed: {e}")
+    if _scheduler is not None:
+        _scheduler.notify()
+    if _generator is not None:
+        _generator.notify()
+
+def start(precompute=True, generation_rate=None):
+    global _started_at
+    _started_at = _started_at or timezone.now()
+    get_renewer().start()
+    get_scheduler().start()
+    get_sweeper().start()
+    if precompute:
+        get_generator(generation_rate).start()
+    if suggestions.enabled():
+        get_refiller().start()
+
+def stop(timeout=None):
+    """
+    Stop both loops, let running jobs finish and hand this process's leases
+    back so another scheduler can take over immediately.
+    """
+    if _generator is not None:
+        _generator.stop(timeout)
+    if _scheduler is not None:
+        _scheduler.stop(timeout)
+    if _sweeper is not None:
+        _sweeper.stop(timeout)
+    if _refiller is not None:
+        _refiller.stop(timeout)
+    dispatcher.shutdown()
+    if _renewer is not None:
+        _renewer.stop(timeout)
+    async_pipeline.shutdown(timeout)
+    http_client.close_all()
+    try:
+        leases.release_all((CampaignPost, ScheduledPost))
+    finally:
+        close_old_connections()
+
+def health():
+    scheduler = _scheduler
+    report = scheduler.last_report if scheduler else None
+    next_deadline = scheduler.heap[0][0] if scheduler and scheduler.heap else None
+    return {
+        'owner': leases.OWNER_ID,
+        'execution_mode': dispatcher.execution_mode(),
+        'started_at': _started_at.isoformat() if _started_at else None,
+        'scheduler_alive': bool(scheduler and scheduler.thread and scheduler.thread.is_alive()),
+        'generator_alive': bool(_generator and _generator.thread and _generator.thread.is_alive()),
+        'sweeper_alive': bool(_sweeper and _sweeper.thread and _sweeper.thread.is_alive()),
+        'renewer_alive': bool(_renewer and _renewer.thread and _renewer.thread.is_alive()),
+        'suggestion_refiller_alive': bool(_refiller and _refiller.thread and _refiller.thread.is_alive()),
+        'last_tick': scheduler.last_tick.isoformat() if scheduler and scheduler.last_tick else None,
+        'last_tick_seconds': round(report['elapsed'], 3) if report else None,
+        'last_tick_done': len(report['done']) if report else 0,
+        'last_tick_failed': len(report['failed']) if report else 0,
+        'last_tick_carried_over': len(report['carried_over']) if report else 0,
+        'next_deadline': next_deadline.isoformat() if next_deadline else None,
+        'in_flight': dispatcher.in_flight_count(),
+        'queued': dispatcher.queued_count(),
+        'leases_held': leases.held_count(),
+        'publish_lateness': lateness_summary(),
+        'openai_cache': openai_cache.stats(),
+        'http': http_client.stats(),
+        'openai_admission': openai_governor.stats(),
+        'media': media_store.stats(),
+        'cloudinary': cloudinary_cache.stats(),
+        'suggestions': suggestions.stats(),
+    }
@@ -0,0 +1,78 @@
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from .models import Campaign, CampaignPost, Post, PostVariant, ScheduledPost
+from . import media_store, scheduler
+
+# Fields whose change moves a deadline. Pipeline flags only matter when
+# they are cleared: setting one (a job finishing its step) removes a
+# deadline, which at worst costs the scheduler one empty tick.
+SCHEDULE_FIELDS = {
+    Campaign: ('is_active', 'generation_horizon'),
+    CampaignPost: ('scheduled_at', 'is_active'),
+    ScheduledPost: ('scheduled_time', 'is_active'),
+}
+REARM_FLAGS = {
+    CampaignPost: ('is_prompt_generated', 'is_content_generated', 'posted', 'dead_lettered'),
+    ScheduledPost: ('posted', 'dead_lettered'),
+}
+
+def schedule_state(instance):
+    fields = SCHEDULE_FIELDS[type(instance)] + REARM_FLAGS.get(type(instance), ())
+    return {field: instance.__dict__[field] for field in fields if field in instance.__dict__}
+
+def schedule_changed(instance, created, update_fields=None):
+    if created:
+        return True
+    previous = getattr(instance, '_schedule_state', {})
+    current = schedule_state(instance)
+    for field, value in current.items():
+        if update_fields is not None and field not in update_fields:
+            continue
+        if field not in previous or previous[field] == value:
+            continue
+        if field in SCHEDULE_FIELDS[type(instance)] or not value:
+            return True
+    return False
+
+@receiver(post_init, sender=Campaign)
+@receiver(post_init, sender=CampaignPost)
+@receiver(post_init, sender=ScheduledPost)
+def remember_schedule(sender, instance, **kwargs):
+    instance._schedule_state = schedule_state(instance)
+
+@receiver(post_save, sender=Campaign)
+@receiver(post_save, sender=CampaignPost)
+@receiver(post_save, sender=ScheduledPost)
+def reschedule_on_save(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Wake the schedulers only when a deadline moved, so the scheduler's own
+    lease, flag and published_at saves do not make every process reload.
+    """
+    changed = schedule_changed(instance, created, update_fields)
+    instance._schedule_state = schedule_state(instance)
+    if changed:
+        scheduler.notify()
+
+@receiver(post_delete, sender=Campaign)
+@receiver(post_delete, sender=CampaignPost)
+@receiver(post_delete, sender=ScheduledPost)
+def reschedule_on_delete(sender, **kwargs):
+    scheduler.notify()
+
+@receiver(post_init, sender=Post)
+@receiver(post_init, sender=PostVariant)
+@receiver(post_init, sender=CampaignPost)
+def remember_media(sender, instance, **kwargs):
+    media_store.remember(instance)
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=PostVariant)
+@receiver(post_save, sender=CampaignPost)
+def count_media_references(sender, instance, created, update_fields=None, **kwargs):
+    media_store.track_save(instance, created, update_fields)
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=PostVariant)
+@receiver(post_delete, sender=CampaignPost)
+def release_media(sender, instance, **kwargs):
+    media_store.track_delete(instance)
@@ -0,0 +1,151 @@
+import itertools
+import json
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+from . import openai_governor
+from .models import PromptSuggestion
+from .utils import (
+    RANDOM_AUDIENCES, RANDOM_CTAS, RANDOM_KEYWORDS, RANDOM_LENGTHS, RANDOM_PLATFORMS, RANDOM_TONES,
+    build_random_prompt, generate_with_openai,
+)
+
+DEFAULT_POOL_SIZE = 50
+DEFAULT_LOW_WATER = 10
+DEFAULT_REFILL_CONCURRENCY = 2
+DEFAULT_REFILL_INTERVAL = 60
+
+ALL_CHOICES = list(itertools.product(
+    RANDOM_PLATFORMS, RANDOM_AUDIENCES, RANDOM_KEYWORDS, RANDOM_TONES, RANDOM_LENGTHS, RANDOM_CTAS,
+))
+
+def generate_suggestion(choice):
+    """One fresh ``{"text_prompt", "image_prompt"}`` pair for ``choice``, or None."""
+    text, _ = generate_with_openai(build_random_prompt(choice), cache=False)
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or not data.get("text_prompt"):
+        return None
+    return {"text_prompt": data.get("text_prompt", ""), "image_prompt": data.get("image_prompt", "")}
+
+def choice_key(choice):
+    return json.dumps(choice)
+
+def pool_size():
+    return PromptSuggestion.objects.count()
+
+def put(choice, pair, size):
+    """Store ``pair`` unless the deployment's pool already holds ``size`` suggestions."""
+    if pool_size() >= size:
+        return False
+    PromptSuggestion.objects.create(choice=choice_key(choice), text_prompt=pair["text_prompt"], image_prompt=pair["image_prompt"])
+    return True
+
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+class SuggestionRefiller:
+    """
+    Keeps the deployment-wide pool of pre-generated random prompt pairs
+    (PromptSuggestion rows) topped up. It runs in `run_scheduler` only, so
+    the pool is warmed once per deployment instead of once per web process.
+    Every SUGGESTION_REFILL_INTERVAL seconds it checks the pool. Once the
+    pool is below SUGGESTION_POOL_LOW_WATER it generates pairs until
+    SUGGESTION_POOL_SIZE are stored, drawing combinations that are not
+    already in the pool.
+    """
+    def __init__(self, size=None, low_water=None, concurrency=None, interval=None):
+        self.size = size or getattr(settings, 'SUGGESTION_POOL_SIZE', DEFAULT_POOL_SIZE)
+        self.low_water = low_water or getattr(settings, 'SUGGESTION_POOL_LOW_WATER', DEFAULT_LOW_WATER)
+        self.concurrency = concurrency or getattr(settings, 'SUGGESTION_REFILL_CONCURRENCY', DEFAULT_REFILL_CONCURRENCY)
+        self.interval = interval or getattr(settings, 'SUGGESTION_REFILL_INTERVAL', DEFAULT_REFILL_INTERVAL)
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run_forever, name='suggestion-refill', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        self.stopping.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def _pick_choices(self, count):
+        pooled = set(PromptSuggestion.objects.values_list('choice', flat=True))
+        unused = [choice for choice in ALL_CHOICES if choice_key(choice) not in pooled]
+        return random.sample(unused or ALL_CHOICES, min(count, len(unused or ALL_CHOICES)))
+
+    def run_forever(self):
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='suggestion') as executor:
+            while not self.stopping.is_set():
+                try:
+                    if pool_size() < self.low_water:
+                        self.refill(executor)
+                except Exception as e:
+                    print(f"Suggestion refill failed: {e}")
+                finally:
+                    close_old_connections()
+                self.stopping.wait(self.interval)
+
+    def refill(self, executor):
+        # Top up to the full size; stop early if a whole round fails (e.g.
+        # OpenAI is down) and try again on the next check.
+        while not self.stopping.is_set():
+            missing = self.size - pool_size()
+            if missing <= 0:
+                return
+            choices = self._pick_choices(min(missing, self.concurrency))
+            added = 0
+            for choice, pair in zip(choices, executor.map(self._safe_generate, choices)):
+                if pair and put(choice, pair, self.size):
+                    added += 1
+            if not added:
+                return
+
+    def _safe_generate(self, choice):
+        try:
+            with openai_governor.priority(openai_governor.PRECOMPUTE):
+                return generate_suggestion(choice)
+        except Exception as e:
+            print(f"Error pre-generating prompt suggestion: {e}")
+            return None
+        finally:
+            close_old_connections()
+
+def enabled():
+    return getattr(settings, 'SUGGESTION_POOL_ENABLED', True)
+
+def take():
+    """
+    Pop the oldest pre-generated suggestion, or None when pooling is off or
+    the pool is empty. Each suggestion is served once, whichever process
+    asks for it.
+    """
+    if not enabled():
+        return None
+    for _ in range(3):
+        row = PromptSuggestion.objects.order_by('created_on').values('id', 'text_prompt', 'image_prompt').first()
+        if row is None:
+            break
+        # Another process may have taken the same row meanwhile.
+        if PromptSuggestion.objects.filter(id=row['id']).delete()[0]:
+            _count('hits')
+            return {"text_prompt": row['text_prompt'], "image_prompt": row['image_prompt']}
+    _count('misses')
+    return None
+
+def stats():
+    with _stats_lock:
+        return dict(_stats, size=pool_size())
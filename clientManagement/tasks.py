@@ -1,51 +1,387 @@
+from collections import deque
+from django.conf import settings
+from django.db.models import DateTimeField, DurationField, ExpressionWrapper, F, Q, Value
+from django.db.models.functions import Coalesce
 from django.utils import timezone
-from datetime import timedelta, datetime
-from .utils import generate_prompts_task, generate_content_task, PostSocialMedia
-from .models import CampaignPost
+from datetime import timedelta
+from .utils import generate_prompts_task, generate_prompts_batch, generate_content_task, PostSocialMedia, preload_credentials, DEFAULT_PROMPT_BATCH_SIZE
+from .models import Campaign, CampaignPost, ScheduledPost
+from .dispatcher import TickDispatcher, execution_mode
+from .leases import claim_rows, release_row, writable, DEFAULT_CLAIM_BATCH
+from .retries import eligible_for_attempt, record_failure, record_success
+
+PROMPT_LEAD = timedelta(hours=1)
+CONTENT_LEAD = timedelta(minutes=30)
+DEFAULT_GENERATION_HORIZON = 24 * 3600
+DEFAULT_CATCHUP_GRACE = 6 * 3600
+DEFAULT_CATCHUP_BATCH = 20
+
+# (kind, id, scheduled, lateness in seconds) of the most recent publishes.
+PUBLISH_LATENESS = deque(maxlen=1000)
+
+def catchup_grace():
+    return timedelta(seconds=getattr(settings, 'SCHEDULER_CATCHUP_GRACE', DEFAULT_CATCHUP_GRACE))
+
+def within_grace(field, now):
+    """
+    Rows whose slot (``field``) passed at most SCHEDULER_CATCHUP_GRACE ago,
+    or that were re-driven within it: staleness runs from the later of the
+    slot and ``redriven_at``.
+    """
+    since = now - catchup_grace()
+    return Q(**{f'{field}__range': (since, now)}) | Q(**{f'{field}__lt': now, 'redriven_at__gte': since})
+
+def due_campaign_posts(now):
+    """
+    Return the (prompt, content, publish) querysets for this tick. Each is a
+    range scan on the indexed ``scheduled_at`` column, so the cost follows
+    the number of due posts rather than the size of the table. Posts that are
+    dead-lettered or backing off after a failure are left out, as are posts
+    more than SCHEDULER_CATCHUP_GRACE past their slot.
+    """
+    posts = CampaignPost.objects.filter(eligible_for_attempt(now), is_active=True, campaign__is_active=True)
+    prompt_due = posts.filter(
+        is_prompt_generated=False,
+        scheduled_at__range=(now, now + PROMPT_LEAD),
+    )
+    content_due = posts.filter(
+        is_prompt_generated=True,
+        is_content_generated=False,
+        scheduled_at__range=(now, now + CONTENT_LEAD),
+    )
+    publish_due = posts.filter(
+        within_grace('scheduled_at', now),
+        is_content_generated=True,
+        posted=False,
+    )
+    return prompt_due, content_due, publish_due
+
+def catch_up_campaign_posts(now):
+    """
+    Posts whose slot has passed within the grace period but whose prompt or
+    media was never generated, e.g. because no scheduler was running during
+    their generation windows.
+    """
+    return CampaignPost.objects.filter(
+        Q(is_prompt_generated=False) | Q(is_content_generated=False),
+        eligible_for_attempt(now),
+        within_grace('scheduled_at', now),
+        is_active=True,
+        campaign__is_active=True,
+        posted=False,
+        scheduled_at__lt=now,
+    )
+
+def catch_up_campaign_post(campaign_post_id, credentials=None):
+    generate_prompts_task(campaign_post_id)
+    generate_content_task(campaign_post_id)
+    return publish_campaign_post(campaign_post_id, credentials=credentials)
+
+def expire_stale_posts(now):
+    """
+    Apply SCHEDULER_STALE_POLICY to unpublished posts that missed their slot
+    by more than the grace period (counted from ``redriven_at`` for rows
+    re-driven since). With 'skip' (the default) they are dead-lettered so
+    they can be re-driven by hand; with 'keep' they are left alone and never
+    picked up automatically.
+    """
+    if getattr(settings, 'SCHEDULER_STALE_POLICY', 'skip') != 'skip':
+        return 0
+    cutoff = now - catchup_grace()
+    message = "Missed its slot by more than the catch-up grace period."
+    expired = 0
+    for model, field in ((CampaignPost, 'scheduled_at'), (ScheduledPost, 'scheduled_time')):
+        expired += model.objects.filter(
+            Q(redriven_at__isnull=True) | Q(redriven_at__lt=cutoff),
+            is_active=True,
+            dead_lettered=False,
+            posted=False,
+            **{f'{field}__lt': cutoff}
+        ).update(dead_lettered=True, next_attempt_at=None, last_error=message)
+    if expired:
+        print(f"Skipped {expired} post(s) too stale to publish")
+    return expired
+
+def generation_horizon():
+    return timedelta(seconds=getattr(settings, 'GENERATION_HORIZON', DEFAULT_GENERATION_HORIZON))
+
+def precompute_campaign_posts(now):
+    """
+    Posts whose prompt or media is still missing and whose slot falls within
+    their campaign's generation horizon (GENERATION_HORIZON by default).
+    The outer range on ``scheduled_at`` keeps this an index scan bounded by
+    the largest horizon in use.
+    """
+    default = generation_horizon()
+    overrides = Campaign.objects.filter(is_active=True, generation_horizon__isnull=False)
+    longest = max([default] + list(overrides.values_list('generation_horizon', flat=True).distinct()))
+    generate_from = ExpressionWrapper(
+        Value(now) + Coalesce(F('campaign__generation_horizon'), Value(default, output_field=DurationField())),
+        output_field=DateTimeField(),
+    )
+    return CampaignPost.objects.filter(
+        eligible_for_attempt(now),
+        Q(is_prompt_generated=False) | Q(is_content_generated=False),
+        is_active=True,
+        campaign__is_active=True,
+        posted=False,
+        scheduled_at__gt=now,
+        scheduled_at__lte=now + longest,
+    ).filter(scheduled_at__lte=generate_from)
+
+def run_precompute_step(now=None):
+    """
+    Do the next unit of ahead-of-time work inside the generation horizon,
+    earliest slot first: prompts for up to PROMPT_BATCH_SIZE posts in one
+    request, or else the media of one post. Returns False when there was
+    nothing to do.
+    """
+    now = now or timezone.now()
+    candidates = precompute_campaign_posts(now)
+    post_ids = claim_rows(candidates.filter(is_prompt_generated=False), 'scheduled_at', now, limit=prompt_batch_size())
+    if post_ids:
+        try:
+            attempt_prompt_batch(post_ids)
+        except Exception as e:
+            print(f"Error precomputing prompts: {e}")
+        finally:
+            for post_id in post_ids:
+                release_row(CampaignPost, post_id)
+        return True
+
+    post_ids = claim_rows(candidates.filter(is_prompt_generated=True), 'scheduled_at', now, limit=1)
+    for post_id in post_ids:
+        try:
+            attempt(CampaignPost, generate_content_task, str(post_id))
+        except Exception as e:
+            print(f"Error precomputing CampaignPost ID {post_id}: {e}")
+        finally:
+            release_row(CampaignPost, post_id)
+    return bool(post_ids)
+
+def due_scheduled_posts(now):
+    return ScheduledPost.objects.filter(
+        eligible_for_attempt(now),
+        within_grace('scheduled_time', now),
+        is_active=True,
+        posted=False,
+    )
+
+def has_due_work(now):
+    querysets = due_campaign_posts(now) + (due_scheduled_posts(now), catch_up_campaign_posts(now))
+    return any(queryset.exists() for queryset in querysets)
+
+def record_publish_lateness(kind, obj, scheduled):
+    lateness = (obj.published_at - scheduled).total_seconds()
+    PUBLISH_LATENESS.append((kind, str(obj.id), scheduled, lateness))
+    print(f"Published {kind} {obj.id} {lateness:.3f}s after its slot")
+
+def lateness_summary():
+    values = sorted(entry[3] for entry in PUBLISH_LATENESS)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'p50': values[len(values) // 2],
+        'p95': values[min(len(values) - 1, int(len(values) * 0.95))],
+        'max': values[-1],
+    }
+
+def lease_lost(model, row_id):
+    """
+    Whether another scheduler took the row over after this process's lease
+    lapsed. Checked right before a platform call, so a slow job never
+    publishes a post its new owner is publishing too.
+    """
+    return not model.objects.filter(writable(), id=row_id).exists()
+
+LEASE_LOST = {"success": False, "skipped": True, "message": "Leased by another scheduler."}
+
+def prepare_campaign_post(campaign_post_id, credentials=None):
+    """
+    Load a CampaignPost for publishing: ``(post, media, None)``, or
+    ``(post, None, result)`` when there is nothing to publish.
+    """
+    post = CampaignPost.objects.select_related('user').get(id=campaign_post_id)
+    if post.posted:
+        return post, None, {"success": True, "message": "Already posted."}
+    if lease_lost(CampaignPost, post.id):
+        return post, None, dict(LEASE_LOST)
+
+    user_credentials = credentials.get(post.user_id) if credentials is not None else None
+    media = PostSocialMedia(post, post.scheduled_at, post_immediately=True, credentials=user_credentials)
+    media.load_credentials(post.platform.lower())
+    return post, media, None
+
+def finish_campaign_post(post, result):
+    if result.get("success"):
+        # Recorded even if the lease lapsed meanwhile: the post is live, and
+        # posted=True is what stops the new owner from publishing it again.
+        post.platform = post.platform.lower()
+        post.posted = True
+        post.published_at = timezone.now()
+        post.save()
+        record_publish_lateness('CampaignPost', post, post.scheduled_at)
+        print("Post URL:", result.get("post_url"))
+    elif result.get("deferred"):
+        print(f"Post deferred for CampaignPost ID {post.id}:", result.get("message"))
+    else:
+        print(f"Post failed for CampaignPost ID {post.id}:", result.get("message"))
+    return result
+
+def publish_campaign_post(campaign_post_id, credentials=None):
+    post, media, result = prepare_campaign_post(campaign_post_id, credentials)
+    if media is None:
+        return result
+    return finish_campaign_post(post, media.publish(post.platform.lower()))
+
+def prepare_scheduled_post(scheduled_post_id, credentials=None):
+    """ScheduledPost counterpart of prepare_campaign_post()."""
+    scheduled = ScheduledPost.objects.select_related('post', 'post__user').get(id=scheduled_post_id)
+    if scheduled.posted:
+        return scheduled, None, {"success": True, "message": "Already posted."}
+    if lease_lost(ScheduledPost, scheduled.id):
+        return scheduled, None, dict(LEASE_LOST)
+
+    user_credentials = credentials.get(scheduled.post.user_id) if credentials is not None else None
+    media = PostSocialMedia(scheduled.post, scheduled.scheduled_time, post_immediately=True, credentials=user_credentials)
+    media.load_credentials(scheduled.platform)
+    return scheduled, media, None
+
+def finish_scheduled_post(scheduled, result):
+    if result.get("success"):
+        scheduled.posted = True
+        scheduled.published_at = timezone.now()
+        scheduled.save()
+        record_publish_lateness('ScheduledPost', scheduled, scheduled.scheduled_time)
+        print("Post URL:", result.get("post_url"))
+    elif result.get("deferred"):
+        print(f"Post deferred for ScheduledPost ID {scheduled.id}:", result.get("message"))
+    else:
+        print(f"Post failed for ScheduledPost ID {scheduled.id}:", result.get("message"))
+    return result
+
+def publish_scheduled_post(scheduled_post_id, credentials=None):
+    scheduled, media, result = prepare_scheduled_post(scheduled_post_id, credentials)
+    if media is None:
+        return result
+    return finish_scheduled_post(scheduled, media.publish(scheduled.platform))
+
+def attempt(model, func, row_id, **kwargs):
+    """
+    Run one pipeline step for a CampaignPost/ScheduledPost and update its
+    retry schedule: failures back off exponentially until the row is
+    dead-lettered, rate-limit deferrals wait out the platform's window.
+    """
+    try:
+        result = func(row_id, **kwargs)
+    except Exception as e:
+        record_attempt_error(model, row_id, e)
+        raise
+    record_attempt_result(model, row_id, result)
+    return result
+
+def record_attempt_error(model, row_id, error):
+    if record_failure(model, row_id, error):
+        print(f"{model.__name__} ID {row_id} moved to dead letter: {error}")
+
+def record_attempt_result(model, row_id, result):
+    if isinstance(result, dict) and result.get("skipped"):
+        # The row belongs to another scheduler now; its retry state is theirs.
+        return
+    if isinstance(result, dict) and not result.get("success"):
+        retry_after = result.get("retry_after") if result.get("deferred") else None
+        if record_failure(model, row_id, result.get("message", ""), retry_after):
+            print(f"{model.__name__} ID {row_id} moved to dead letter: {result.get('message')}")
+    else:
+        record_success(model, row_id)
+
+def prompt_batch_size():
+    return getattr(settings, 'PROMPT_BATCH_SIZE', DEFAULT_PROMPT_BATCH_SIZE)
+
+def attempt_prompt_batch(post_ids):
+    """Batched counterpart of attempt() for the prompt stage."""
+    try:
+        errors = generate_prompts_batch(post_ids)
+    except Exception as e:
+        errors = {post_id: str(e) for post_id in post_ids}
+    record_prompt_batch(post_ids, errors)
+    return errors
+
+def record_prompt_batch(post_ids, errors):
+    for post_id in post_ids:
+        if post_id in errors:
+            if record_failure(CampaignPost, post_id, errors[post_id]):
+                print(f"CampaignPost ID {post_id} moved to dead letter: {errors[post_id]}")
+        else:
+            record_success(CampaignPost, post_id)
+
+def release_job(stage, key):
+    model = ScheduledPost if stage == 'scheduled' else CampaignPost
+    # Batched prompt jobs are keyed by the tuple of their post ids.
+    for row_id in (key if isinstance(key, tuple) else (key,)):
+        release_row(model, row_id)
+
+def new_dispatcher(**kwargs):
+    """A TickDispatcher, or its asyncio counterpart in 'asyncio' execution mode."""
+    if execution_mode() == 'asyncio':
+        from .async_pipeline import AsyncTickDispatcher
+        return AsyncTickDispatcher(**kwargs)
+    return TickDispatcher(**kwargs)
 
 def run_campaign_scheduler():
     print("Sceduler running")
     now = timezone.now()
-    one_hour_from_now = now + timedelta(hours=1)
-    thirty_minutes_from_now = now + timedelta(minutes=30)
-
-    posts = CampaignPost.objects.filter(is_active=True, campaign__is_active=True)
-    print(posts)
-    for post in posts:
-        scheduled_time = datetime.combine(post.date, post.time)
-        scheduled_time = timezone.make_aware(scheduled_time)
-        print(now, scheduled_time ,one_hour_from_now, post.is_prompt_generated)
-        if not post.is_prompt_generated and now <= scheduled_time <= one_hour_from_now:
-            print("Generating prompt")
-            generate_prompts_task(str(post.id))
-
-        if post.is_prompt_generated and not post.is_content_generated and now <= scheduled_time <= thirty_minutes_from_now:
-            print("Generating Image")
-            generate_content_task(str(post.id))
-
-        if post.is_content_generated and not post.posted and now >= scheduled_time:
-            print("Posting")
-            try:
-                platform = post.platform.lower()
-                media = PostSocialMedia(post, scheduled_time, post_immediately=True)
-                if platform == "facebook":
-                    result = media.post_to_facebook()
-                    post.platform = "facebook"
-                elif platform == "instagram":
-                    result = media.post_to_instagram()
-                    post.platform = "instagram"
-                elif platform =="twitter":
-                    result = media.post_to_twitter()
-                    post.platform = "twitter"
-                elif platform == "reddit":
-                    result = media.post_to_reddit()
-                    post.platform = "reddit"
-                if result.get("success"):
-                    post_url = result.get("post_url")
-                    post.posted = True
-                    post.save()
-                    print("Post URL:", post_url)
-                else:
-                    print("Post failed:", result.get("message"))
-            except Exception as e:
-                print(f"Error posting CampaignPost ID {post.id}: {e}")
\ No newline at end of file
+    expire_stale_posts(now)
+    prompt_due, content_due, publish_due = due_campaign_posts(now)
+
+    # Only posts leased to this process are dispatched; the lease is dropped
+    # as soon as the job finishes or is carried over so another process can
+    # pick the post up on its next tick. Publish jobs are queued first so
+    # they get pool slots ahead of generation.
+    dispatcher = new_dispatcher(on_job_finished=release_job)
+    claim_batch = getattr(settings, 'SCHEDULER_CLAIM_BATCH', DEFAULT_CLAIM_BATCH)
+    publish_ids = claim_rows(publish_due, 'scheduled_at', now, limit=claim_batch)
+    scheduled_ids = claim_rows(due_scheduled_posts(now), 'scheduled_time', now, limit=claim_batch)
+    # Missed posts are caught up most-overdue first, a bounded batch per
+    # tick, so a restart does not stampede the APIs.
+    catch_up_limit = getattr(settings, 'SCHEDULER_CATCHUP_BATCH', DEFAULT_CATCHUP_BATCH)
+    catch_up_ids = claim_rows(catch_up_campaign_posts(now), 'scheduled_at', now, limit=catch_up_limit)
+
+    # One credential query for every publish job of the tick.
+    user_ids = set(CampaignPost.objects.filter(id__in=publish_ids + catch_up_ids).values_list('user_id', flat=True))
+    user_ids |= set(ScheduledPost.objects.filter(id__in=scheduled_ids).values_list('post__user_id', flat=True))
+    credentials = preload_credentials(user_ids) if user_ids else {}
+
+    for post_id in publish_ids:
+        dispatcher.submit('publish', str(post_id), attempt, CampaignPost, publish_campaign_post, str(post_id), credentials=credentials)
+    for post_id in scheduled_ids:
+        dispatcher.submit('scheduled', str(post_id), attempt, ScheduledPost, publish_scheduled_post, str(post_id), credentials=credentials)
+    for post_id in catch_up_ids:
+        dispatcher.submit('catchup', str(post_id), attempt, CampaignPost, catch_up_campaign_post, str(post_id), credentials=credentials)
+    prompt_ids = claim_rows(prompt_due, 'scheduled_at', now, limit=claim_batch)
+    batch_size = prompt_batch_size()
+    for start in range(0, len(prompt_ids), batch_size):
+        batch = prompt_ids[start:start + batch_size]
+        dispatcher.submit('prompt', tuple(str(post_id) for post_id in batch), attempt_prompt_batch, batch)
+    content_ids = claim_rows(content_due, 'scheduled_at', now, limit=claim_batch)
+    for post_id in content_ids:
+        dispatcher.submit('content', str(post_id), attempt, CampaignPost, generate_content_task, str(post_id))
+
+    report = dispatcher.run()
+    # A full claim means more rows were due than one batch: the scheduler
+    # ticks again right away instead of waiting SCHEDULER_RETRY_INTERVAL.
+    report['backlog'] = any(
+        len(ids) >= limit for ids, limit in (
+            (publish_ids, claim_batch),
+            (scheduled_ids, claim_batch),
+            (catch_up_ids, catch_up_limit),
+            (prompt_ids, claim_batch),
+            (content_ids, claim_batch),
+        )
+    )
+    for stage, post_id, error in report['failed']:
+        print(f"Error in {stage} stage for post ID {post_id}: {error}")
+    if report['carried_over']:
+        print(f"Carried over to next tick: {report['carried_over']}")
+    return report
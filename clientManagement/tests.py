@@ -1,3 +1,231 @@
-from django.test import TestCase
+import heapq
+import json
+from datetime import date, timedelta
+from unittest import mock
+from django.contrib.auth.models import User
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from . import leases, providers, ratelimit, suggestions, tasks
+from .models import Campaign, CampaignPost, Post, PromptSuggestion, ScheduledPost
+from .retries import eligible_for_attempt, record_failure
+from .scheduler import DeadlineScheduler, TICK, change_version
+from .utils import build_batch_prompt
 
-# Create your tests here.
+def make_campaign_post(user, campaign, scheduled_at, **kwargs):
+    local = timezone.localtime(scheduled_at)
+    return CampaignPost.objects.create(
+        user=user, campaign=campaign, platform='facebook',
+        date=local.date(), time=local.time(), **kwargs
+    )
+
+class SchedulerTestMixin:
+    def setUp(self):
+        self.user = User.objects.create(username='scheduler')
+        self.campaign = Campaign.objects.create(
+            user=self.user, name='Launch', start_date=date(2026, 1, 1), end_date=date(2026, 12, 31),
+        )
+
+class LeaseTests(SchedulerTestMixin, TestCase):
+    def tearDown(self):
+        leases.release_all((CampaignPost, ScheduledPost))
+
+    def test_claim_skips_rows_leased_elsewhere(self):
+        now = timezone.now()
+        mine = make_campaign_post(self.user, self.campaign, now)
+        theirs = make_campaign_post(self.user, self.campaign, now)
+        CampaignPost.objects.filter(id=theirs.id).update(
+            claimed_by='other-host:1:abc', claim_expires_at=now + timedelta(minutes=5),
+        )
+        ids = leases.claim_rows(CampaignPost.objects.all(), 'scheduled_at', now)
+        self.assertEqual(ids, [mine.id])
+        mine.refresh_from_db()
+        self.assertEqual(mine.claimed_by, leases.OWNER_ID)
+
+    def test_claim_takes_over_expired_lease(self):
+        now = timezone.now()
+        post = make_campaign_post(self.user, self.campaign, now)
+        CampaignPost.objects.filter(id=post.id).update(
+            claimed_by='other-host:1:abc', claim_expires_at=now - timedelta(seconds=1),
+        )
+        self.assertEqual(leases.claim_rows(CampaignPost.objects.all(), 'scheduled_at', now), [post.id])
+
+    def test_release_with_str_id_forgets_the_lease(self):
+        now = timezone.now()
+        post = make_campaign_post(self.user, self.campaign, now)
+        leases.claim_rows(CampaignPost.objects.all(), 'scheduled_at', now)
+        self.assertEqual(leases.held_count(), 1)
+        leases.release_row(CampaignPost, str(post.id))
+        self.assertEqual(leases.held_count(), 0)
+        post.refresh_from_db()
+        self.assertEqual(post.claimed_by, '')
+        self.assertIsNone(post.claim_expires_at)
+
+    def test_renew_extends_only_leases_still_held(self):
+        now = timezone.now()
+        kept = make_campaign_post(self.user, self.campaign, now)
+        lost = make_campaign_post(self.user, self.campaign, now)
+        leases.claim_rows(CampaignPost.objects.all(), 'scheduled_at', now)
+        CampaignPost.objects.filter(id=lost.id).update(claimed_by='other-host:1:abc')
+
+        later = now + timedelta(minutes=10)
+        self.assertEqual(leases.renew(later), 1)
+        kept.refresh_from_db()
+        lost.refresh_from_db()
+        self.assertEqual(kept.claim_expires_at, later + timedelta(seconds=leases.lease_seconds()))
+        self.assertLess(lost.claim_expires_at, later)
+
+class RunSchedulerLeaseTests(SchedulerTestMixin, TransactionTestCase):
+    # Jobs run on the worker pool, so the rows must be committed.
+    def test_tick_releases_every_lease(self):
+        now = timezone.now()
+        make_campaign_post(self.user, self.campaign, now - timedelta(seconds=30), is_prompt_generated=True, is_content_generated=True)
+        make_campaign_post(self.user, self.campaign, now + timedelta(minutes=20))
+        post = Post.objects.create(user=self.user, text_prompt='p', image_prompt='i')
+        ScheduledPost.objects.create(user=self.user, post=post, platform='facebook', scheduled_time=now - timedelta(seconds=30))
+
+        published = {"success": True, "post_url": "https://example.com/1"}
+        with mock.patch.object(tasks, 'publish_campaign_post', return_value=published), \
+                mock.patch.object(tasks, 'publish_scheduled_post', return_value=published), \
+                mock.patch.object(tasks, 'generate_prompts_batch', return_value={}):
+            report = tasks.run_campaign_scheduler()
+
+        self.assertEqual({stage for stage, key in report['done']}, {'publish', 'scheduled', 'prompt'})
+        self.assertEqual(leases._held, set())
+        self.assertFalse(CampaignPost.objects.exclude(claimed_by='').exists())
+        self.assertFalse(ScheduledPost.objects.exclude(claimed_by='').exists())
+
+@override_settings(PUBLISH_MAX_ATTEMPTS=3, PUBLISH_RETRY_BASE=30, PUBLISH_RETRY_CAP=3600)
+class RetryTests(SchedulerTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.post = make_campaign_post(self.user, self.campaign, timezone.now())
+
+    def test_failures_back_off_then_dead_letter(self):
+        for attempt in (1, 2):
+            started = timezone.now()
+            self.assertFalse(record_failure(CampaignPost, self.post.id, 'boom'))
+            self.post.refresh_from_db()
+            self.assertEqual(self.post.attempt_count, attempt)
+            delay = (self.post.next_attempt_at - started).total_seconds()
+            self.assertGreaterEqual(delay, 30 * 2 ** (attempt - 1) / 2 - 1)
+            self.assertLessEqual(delay, 30 * 2 ** (attempt - 1) + 1)
+            self.assertFalse(CampaignPost.objects.filter(eligible_for_attempt(timezone.now()), id=self.post.id).exists())
+
+        self.assertTrue(record_failure(CampaignPost, self.post.id, 'boom'))
+        self.post.refresh_from_db()
+        self.assertTrue(self.post.dead_lettered)
+        self.assertIsNone(self.post.next_attempt_at)
+        self.assertEqual(self.post.last_error, 'boom')
+        self.assertFalse(CampaignPost.objects.filter(eligible_for_attempt(timezone.now() + timedelta(days=1)), id=self.post.id).exists())
+
+    def test_rate_limit_deferral_does_not_count_an_attempt(self):
+        started = timezone.now()
+        tasks.record_attempt_result(CampaignPost, self.post.id, {
+            "success": False, "deferred": True, "retry_after": 120, "message": "Rate limited",
+        })
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.attempt_count, 0)
+        self.assertFalse(self.post.dead_lettered)
+        self.assertEqual(self.post.last_error, 'Rate limited')
+        self.assertAlmostEqual((self.post.next_attempt_at - started).total_seconds(), 120, delta=1)
+
+class DeadlineSchedulerTests(SchedulerTestMixin, TestCase):
+    def test_heap_pops_deadlines_in_order(self):
+        now = timezone.now().replace(microsecond=0)
+        later = make_campaign_post(self.user, self.campaign, now + timedelta(minutes=50))
+        sooner = make_campaign_post(self.user, self.campaign, now + timedelta(minutes=40), is_prompt_generated=True)
+        post = Post.objects.create(user=self.user, text_prompt='p', image_prompt='i')
+        scheduled = ScheduledPost.objects.create(user=self.user, post=post, platform='facebook', scheduled_time=now + timedelta(minutes=5))
+
+        scheduler = DeadlineScheduler()
+        scheduler.refresh(now)
+        ticks = []
+        while scheduler.heap:
+            deadline, kind = heapq.heappop(scheduler.heap)
+            if kind == TICK:
+                ticks.append(deadline)
+
+        self.assertEqual(ticks, [
+            scheduled.scheduled_time,
+            sooner.scheduled_at - tasks.CONTENT_LEAD,
+            later.scheduled_at - tasks.CONTENT_LEAD,
+            sooner.scheduled_at,
+            later.scheduled_at,
+        ])
+
+class ScheduleMarkerTests(SchedulerTestMixin, TestCase):
+    def test_only_deadline_changes_bump_the_marker(self):
+        post = make_campaign_post(self.user, self.campaign, timezone.now() + timedelta(hours=2))
+        version = change_version()
+
+        post.claimed_by = leases.OWNER_ID
+        post.is_prompt_generated = True
+        post.save()
+        post.published_at = timezone.now()
+        post.save(update_fields=['published_at'])
+        self.assertEqual(change_version(), version)
+
+        post = CampaignPost.objects.get(id=post.id)
+        post.time = (timezone.localtime(post.scheduled_at) + timedelta(minutes=30)).time()
+        post.save()
+        self.assertEqual(change_version(), version + 1)
+
+        post.is_prompt_generated = False
+        post.save(update_fields=['is_prompt_generated'])
+        self.assertEqual(change_version(), version + 2)
+
+class RateLimitTests(TestCase):
+    def make_bucket(self, bucket_class, *args):
+        clock = [1000.0]
+        bucket_class = type(bucket_class.__name__, (bucket_class,), {'clock': staticmethod(lambda: clock[0])})
+        return bucket_class(*args), clock
+
+    def test_narrowed_rate_lasts_until_the_window_resets(self):
+        bucket, clock = self.make_bucket(ratelimit.TokenBucket, 1.0, 5)
+        bucket.observe(remaining=1, reset_in=100)
+        self.assertLess(bucket.rate, bucket.base_rate)
+        clock[0] += 101
+        self.assertEqual(bucket.wait_time(), 0.0)
+        self.assertEqual(bucket.rate, bucket.base_rate)
+
+    def test_shared_bucket_restores_base_rate_in_the_row(self):
+        bucket, clock = self.make_bucket(ratelimit.SharedTokenBucket, 'twitter', 'cred', 1.0, 5)
+        bucket.observe(remaining=0, reset_in=60)
+        row = ratelimit.RateLimitBucket.objects.get(platform='twitter', credential_key='cred')
+        self.assertLess(row.rate, 1.0)
+        self.assertEqual(row.narrowed_until, 1060.0)
+        self.assertGreaterEqual(bucket.wait_time(), 60)
+
+        clock[0] += 61
+        self.assertEqual(bucket.acquire(timeout=0), 0.0)
+        row.refresh_from_db()
+        self.assertEqual(row.rate, 1.0)
+        self.assertEqual(row.narrowed_until, 0)
+
+class SuggestionPoolTests(TestCase):
+    def test_take_serves_each_suggestion_once(self):
+        first = PromptSuggestion.objects.create(choice='a', text_prompt='first', image_prompt='i1')
+        PromptSuggestion.objects.create(choice='b', text_prompt='second', image_prompt='i2')
+        PromptSuggestion.objects.filter(id=first.id).update(created_on=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(suggestions.take(), {"text_prompt": "first", "image_prompt": "i1"})
+        self.assertEqual(suggestions.take()["text_prompt"], "second")
+        self.assertIsNone(suggestions.take())
+
+    def test_refill_stops_at_the_deployment_cap(self):
+        pair = {"text_prompt": "t", "image_prompt": "i"}
+        PromptSuggestion.objects.create(choice='existing', text_prompt='t')
+        refiller = suggestions.SuggestionRefiller(size=5, low_water=2, concurrency=2)
+        with mock.patch.object(suggestions, 'generate_suggestion', return_value=pair):
+            refiller.refill(mock.Mock(map=map))
+        self.assertEqual(PromptSuggestion.objects.count(), 5)
+        self.assertEqual(len(set(PromptSuggestion.objects.values_list('choice', flat=True))), 5)
+
+class LocalProviderTests(TestCase):
+    def test_batch_response_covers_only_the_requested_keys(self):
+        posts = [CampaignPost(platform='reddit', keywords=f'kw{i}') for i in range(3)]
+        response = json.loads(providers.LocalProvider().respond(build_batch_prompt(posts)))
+        self.assertEqual([item['key'] for item in response], ['p1', 'p2', 'p3'])
+
+    def test_provider_is_abstract(self):
+        with self.assertRaises(TypeError):
+            providers.Provider()
@@ -1,7 +1,7 @@
 app_name = 'clientManagement'
 
-from django.urls import path
-from .views import DeleteCredentialView, SignupView, SigninView, LogoutView, DashboardView, HomeView, GeneratePromptsView, SingleImageView, EditImageView, ApplyEditView, CampaignListView, PricingView, SchedulingView, SettingsView, NewPostView,ContentLibraryView, ScheduleSubmitView, ScheduleUpdateView, proxy_image, TwitterLogin, TwitterCallback, MediaView, CreateCampaignView, VerifyAndSaveCredentialView, DeleteCampaignView, UpdateProfileView, ChangePasswordView, DeleteAccountView
+from django.urls import path, re_path
+from .views import DeleteCredentialView, SignupView, SigninView, LogoutView, DashboardView, HomeView, GeneratePromptsView, GeneratePromptsStreamView, SingleImageView, SingleImageStreamView, SelectVariantView, EditImageView, ApplyEditView, CampaignListView, PricingView, SchedulingView, SettingsView, NewPostView,ContentLibraryView, ScheduleSubmitView, ScheduleUpdateView, proxy_image, local_provider_image, image_rendition, TwitterLogin, TwitterCallback, MediaView, CreateCampaignView, VerifyAndSaveCredentialView, DeleteCampaignView, UpdateProfileView, ChangePasswordView, DeleteAccountView
 
 urlpatterns = [
     path('', HomeView.as_view(), name='home'),
@@ -10,18 +10,23 @@ urlpatterns = [
     path('logout/', LogoutView.as_view(), name='logout'),
     path('dashboard/', DashboardView.as_view(), name='dashboard'),
     path('generate_prompts/', GeneratePromptsView.as_view(), name='generate_prompts'),
+    path('generate_prompts/stream/', GeneratePromptsStreamView.as_view(), name='generate_prompts_stream'),
     path(
         "edit_image/<post_id>/",
         EditImageView.as_view(),
         name="edit_image"
     ),
     path('image-proxy/', proxy_image, name='proxy_image'),
+    path('renditions/<str:sha256>/<int:width>.<str:fmt>', image_rendition, name='image_rendition'),
+    re_path(r'^local-provider/images/(?P<digest>[0-9a-f]{32})\.png$', local_provider_image, name='local_provider_image'),
     path(
         "apply-edit/<post_id>/",
         ApplyEditView.as_view(),
         name="apply_edit"
     ),
     path('post/', SingleImageView.as_view(), name='post'),
+    path('post/stream/', SingleImageStreamView.as_view(), name='post_stream'),
+    path('post/<post_id>/variants/<variant_id>/select/', SelectVariantView.as_view(), name='select_variant'),
     path('pricing/', PricingView.as_view(), name='pricing'),
     path('schedule/', SchedulingView.as_view(), name='schedule'),
     path('settings/', SettingsView.as_view(), name='settings'),
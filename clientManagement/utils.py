@@ -1,13 +1,16 @@
+import contextvars
 import json
 import os
 import random
-from urllib.parse import urlparse
+import time
+from concurrent.futures import ThreadPoolExecutor
 import cloudinary
-import cloudinary.uploader
-from django.core.files.base import ContentFile
-import requests
+from django.conf import settings
+from django.db import transaction
 from requests_oauthlib import OAuth1
 from .models import CampaignPost, Post, UserCredential
+from . import cloudinary_cache, downloads, http_client, leases, openai_cache, openai_governor, ratelimit
+from .providers import get_provider
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -20,64 +23,127 @@ cloudinary.config(
   api_secret = os.getenv('CLOUDINARY_API_SECRET')
 )
 
-def generate_with_openai(text_prompt, image_prompt=None):
-    api_key = os.getenv('CHATGPT_API')
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}"
-    }
-
-    payload_text = {
-        "model": "gpt-3.5-turbo",
-        "messages": [
-            {"role": "user", "content": text_prompt}
-        ],
-        "max_tokens": 256,
-        "temperature": 0.7
-    }
-    
+# Image requests run here while the chat completion runs on the caller's
+# thread, so a generation costs max(text, image) instead of text + image.
+_openai_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='openai')
+
+def _generate_text(text_prompt, max_tokens=256):
     try:
-        if image_prompt!=None:
-            payload_image = {
-                "model": "dall-e-3",
-                "prompt": image_prompt,
-                "n": 1,
-                "size": "1024x1024"
-            }
-            response_image = requests.post(
-                "https://api.openai.com/v1/images/generations",
-                headers=headers,
-                data=json.dumps(payload_image)
-            )
+        with openai_governor.admit("chat"):
+            return get_provider().generate_text(text_prompt, max_tokens)
+    except Exception as e:
+        print(f"Exception occurred generating text: {e}")
+        return ""
 
-        response_text = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=headers,
-            data=json.dumps(payload_text)
-        )
+def _generate_texts(text_prompt, n, max_tokens=256):
+    try:
+        with openai_governor.admit("chat"):
+            texts = get_provider().generate_texts(text_prompt, n, max_tokens)
+    except Exception as e:
+        print(f"Exception occurred generating text: {e}")
+        texts = []
+    return (list(texts) + [""] * n)[:n]
 
-        text_generated = ""
-        if response_text.status_code == 200:
-            text_data = response_text.json()
-            if text_data.get("choices"):
-                text_generated = text_data["choices"][0]["message"]["content"]
-                if image_prompt==None:
-                    return text_generated, None
-            else:
-                print("No text prompt generated.")
-        else:
-            print(f"Error generating text prompt: {response_text.status_code}, {response_text.text}")
-            return text_generated,None
+def _generate_image(image_prompt):
+    try:
+        with openai_governor.admit("image"):
+            return get_provider().generate_image(image_prompt)
+    except Exception as e:
+        print(f"Exception occurred generating image: {e}")
+        return None
 
-        if response_image.status_code == 200:
-            data = response_image.json()
-            return text_generated, data["data"][0]["url"]
-        else:
-            print(f"Error: {response_image.status_code}, {response_image.text}")
-            return text_generated, None
+def stream_text(text_prompt, max_tokens=256):
+    """
+    Yield the chat completion for ``text_prompt`` piece by piece as the
+    provider streams it. Raises if the request is rejected.
+    """
+    # The chat slot is held until the stream is consumed or closed.
+    with openai_governor.admit("chat"):
+        yield from get_provider().stream_text(text_prompt, max_tokens)
+
+def _is_valid(validate, text):
+    if validate is None:
+        return True
+    try:
+        return bool(validate(text))
+    except Exception:
+        return False
+
+def openai_cache_key(text_prompt, image_prompt=None, max_tokens=256):
+    provider = get_provider()
+    return openai_cache.cache_key(
+        provider.text_model, text_prompt,
+        max_tokens=max_tokens,
+        temperature=provider.text_temperature,
+        image_model=provider.image_model if image_prompt is not None else None,
+        image_size=provider.image_size if image_prompt is not None else None,
+        image_prompt=image_prompt,
+    )
+
+def cache_openai_response(key, text_prompt, image_prompt, text_generated, image_url, latency, user=None, validate=None):
+    """Store a complete, valid response under ``key``."""
+    if not (text_generated and (image_prompt is None or image_url) and _is_valid(validate, text_generated)):
+        return
+    try:
+        openai_cache.store(key, text_prompt, text_generated, image_url, get_provider().text_model, latency, user=user)
     except Exception as e:
-        print(f"Exception occurred: {e}")
-        return text_generated, None
+        print(f"Error caching OpenAI response: {e}")
+
+def generate_with_openai(text_prompt, image_prompt=None, max_tokens=256, cache=True, user=None, validate=None, n=1):
+    """
+    Return ``(text, image_url)``. The text and image requests run
+    concurrently, each with its own timeout; if one of them fails the other
+    is still returned ("" for missing text, None for a missing image).
+
+    Complete responses are cached in PromptLog by a hash of the models,
+    normalized prompts and parameters; pass ``cache=False`` where a fresh
+    response is wanted. ``validate(text)`` must return true for a response
+    to be cached, so a malformed answer is not served again.
+
+    With ``n`` > 1 a list of ``n`` such pairs is returned instead, see
+    generate_variants().
+    """
+    if n > 1:
+        return generate_variants(text_prompt, image_prompt, n, max_tokens)
+
+    key = None
+    if cache and openai_cache.enabled():
+        key = openai_cache_key(text_prompt, image_prompt, max_tokens)
+        cached = openai_cache.lookup(key, with_image=image_prompt is not None)
+        if cached is not None:
+            return cached
+    else:
+        openai_cache.record_bypass()
+
+    started = time.monotonic()
+    if image_prompt is None:
+        text_generated, image_url = _generate_text(text_prompt, max_tokens), None
+    else:
+        # copy_context carries the caller's OpenAI priority class to the pool thread.
+        image_future = _openai_pool.submit(contextvars.copy_context().run, _generate_image, image_prompt)
+        text_generated = _generate_text(text_prompt, max_tokens)
+        image_url = image_future.result()
+
+    if key:
+        cache_openai_response(key, text_prompt, image_prompt, text_generated, image_url, time.monotonic() - started, user, validate)
+    return text_generated, image_url
+
+def generate_variants(text_prompt, image_prompt, n, max_tokens=256):
+    """
+    ``n`` alternative ``(text, image_url)`` pairs for the same prompts. The
+    texts come from a single chat request with ``n`` choices, so the prompt
+    is sent and billed once; the images are generated concurrently. Variants
+    are meant to differ, so they are never cached.
+    """
+    openai_cache.record_bypass()
+    image_futures = [submit_image_generation(image_prompt) for _ in range(n)] if image_prompt is not None else []
+    texts = _generate_texts(text_prompt, n, max_tokens)
+    image_urls = [future.result() for future in image_futures] or [None] * n
+    return list(zip(texts, image_urls))
+
+def submit_image_generation(image_prompt):
+    """Start generating an image in the background; returns a Future of its URL."""
+    return _openai_pool.submit(contextvars.copy_context().run, _generate_image, image_prompt)
 
 def build_prompt(post):
     return f"""You are an expert AI assistant for social media marketers.
@@ -100,20 +166,26 @@ def build_prompt(post):
         }}
         """
 
-def build_random_prompt():
-    platforms = ["Instagram", "Twitter", "LinkedIn", "Facebook", "Reddit"]
-    audiences = ["Teens", "Young Adults", "Working Professionals", "Parents", "Tech Enthusiasts"]
-    keywords = [["fitness", "motivation"], ["AI", "future"], ["travel", "adventure"], ["productivity", "focus"], ["fashion", "style"]]
-    tones = ["Inspirational", "Funny", "Professional", "Casual", "Bold"]
-    lengths = ["Short", "Medium", "Long"]
-    ctas = ["Visit our website", "Download now", "Join the movement", "Subscribe today", "Try it free"]
-
-    platform = random.choice(platforms)
-    target_audience = random.choice(audiences)
-    keyword_set = random.choice(keywords)
-    tone = random.choice(tones)
-    length = random.choice(lengths)
-    call_to_action = random.choice(ctas)
+RANDOM_PLATFORMS = ["Instagram", "Twitter", "LinkedIn", "Facebook", "Reddit"]
+RANDOM_AUDIENCES = ["Teens", "Young Adults", "Working Professionals", "Parents", "Tech Enthusiasts"]
+RANDOM_KEYWORDS = [("fitness", "motivation"), ("AI", "future"), ("travel", "adventure"), ("productivity", "focus"), ("fashion", "style")]
+RANDOM_TONES = ["Inspirational", "Funny", "Professional", "Casual", "Bold"]
+RANDOM_LENGTHS = ["Short", "Medium", "Long"]
+RANDOM_CTAS = ["Visit our website", "Download now", "Join the movement", "Subscribe today", "Try it free"]
+
+def random_prompt_choice():
+    """A random (platform, audience, keywords, tone, length, cta) combination."""
+    return (
+        random.choice(RANDOM_PLATFORMS),
+        random.choice(RANDOM_AUDIENCES),
+        random.choice(RANDOM_KEYWORDS),
+        random.choice(RANDOM_TONES),
+        random.choice(RANDOM_LENGTHS),
+        random.choice(RANDOM_CTAS),
+    )
+
+def build_random_prompt(choice=None):
+    platform, target_audience, keyword_set, tone, length, call_to_action = choice or random_prompt_choice()
 
     return f"""You are an expert AI assistant for social media marketers.
             Generate two things based on the following **random** campaign details:
@@ -137,37 +209,186 @@ def build_random_prompt():
 
 
 
+def apply_prompts(post, prompts_data):
+    """Save generated prompts; False if the post was taken over by another scheduler."""
+    post.text_prompt = prompts_data.get("text_prompt", "")
+    post.image_prompt = prompts_data.get("image_prompt", "")
+    post.is_prompt_generated = True
+    with transaction.atomic():
+        # Only one writer can flip the flag while it holds (or nobody holds) the lease.
+        won = CampaignPost.objects.filter(leases.writable(), id=post.id, is_prompt_generated=False).update(is_prompt_generated=True)
+        if not won:
+            print(f"Dropped prompts for CampaignPost ID {post.id}: already generated or leased elsewhere")
+            return False
+        post.save()
+    return True
+
 def generate_prompts_task(campaign_post_id):
     post = CampaignPost.objects.get(id=campaign_post_id)
     if not post.is_prompt_generated:
         prompts = build_prompt(post)
-        text_prompt, _ = generate_with_openai(prompts)
-        prompts_data = json.loads(text_prompt)
-        post.text_prompt = prompts_data.get("text_prompt", "")
-        post.image_prompt = prompts_data.get("image_prompt", "")
-        post.is_prompt_generated = True
-        post.save()
+        text_prompt, _ = generate_with_openai(prompts, user=post.campaign.user, validate=json.loads)
+        apply_prompts(post, json.loads(text_prompt))
+
+DEFAULT_PROMPT_BATCH_SIZE = 20
+# Output budget per post in a batched prompt request.
+PROMPT_BATCH_TOKENS_PER_POST = 200
+
+def build_batch_prompt(posts):
+    items = []
+    for index, post in enumerate(posts, start=1):
+        items.append(json.dumps({
+            "key": f"p{index}",
+            "platform": post.platform,
+            "target_audience": post.target_audience,
+            "keywords": post.keywords,
+            "tone": post.tone,
+            "post_length": post.length,
+            "call_to_action": post.call_to_action,
+        }))
+    campaign_details = "\n        ".join(items)
+    return f"""You are an expert AI assistant for social media marketers.
+        For each of the campaign posts below, generate two things:
+        1. A text prompt that can be used to generate engaging social media post content.
+        2. An image prompt that can be used to generate a visual for the post.
+
+        Campaign Posts (one JSON object per line):
+        {campaign_details}
+
+        Respond with only a JSON array containing one object per post, in this format:
+        [
+        {{"key": "p1", "text_prompt": "...", "image_prompt": "..."}}
+        ]
+        """
+
+def parse_batch_prompts(text):
+    """
+    Return ``{key: {"text_prompt", "image_prompt"}}`` for every well-formed
+    item of a batched response; malformed items are left out.
+    """
+    text = (text or "").strip()
+    if text.startswith("```"):
+        text = text.strip("`")
+        text = text[text.find("["):] if "[" in text else text
+    try:
+        data = json.loads(text)
+    except ValueError:
+        start, end = text.find("["), text.rfind("]")
+        if start == -1 or end <= start:
+            return {}
+        try:
+            data = json.loads(text[start:end + 1])
+        except ValueError:
+            return {}
+    if isinstance(data, dict):
+        data = next((value for value in data.values() if isinstance(value, list)), [])
+    parsed = {}
+    for item in data if isinstance(data, list) else []:
+        if not isinstance(item, dict):
+            continue
+        key = item.get("key")
+        text_prompt = item.get("text_prompt")
+        image_prompt = item.get("image_prompt")
+        if key and isinstance(text_prompt, str) and isinstance(image_prompt, str):
+            parsed[key] = {"text_prompt": text_prompt, "image_prompt": image_prompt}
+    return parsed
+
+def batch_max_tokens(posts):
+    return min(4096, PROMPT_BATCH_TOKENS_PER_POST * len(posts))
+
+def batch_has_results(posts, parsed):
+    return any(f"p{index}" in parsed for index in range(1, len(posts) + 1))
+
+def record_batch_error(posts, errors, message="No response to the batched prompt request."):
+    for post in posts:
+        errors[post.id] = message
+
+def _generate_prompt_batch(posts, errors):
+    if len(posts) == 1:
+        try:
+            generate_prompts_task(str(posts[0].id))
+        except Exception as e:
+            errors[posts[0].id] = str(e)
+        return
+
+    text, _ = generate_with_openai(build_batch_prompt(posts), max_tokens=batch_max_tokens(posts), validate=parse_batch_prompts)
+    if not (text or "").strip():
+        # The call itself failed (API down, rate limited): splitting would
+        # only multiply requests, so leave the whole batch to the retry backoff.
+        record_batch_error(posts, errors)
+        return
+    parsed = parse_batch_prompts(text)
+    if not batch_has_results(posts, parsed):
+        # A response came back but none of it parsed: split the batch and try each half.
+        middle = len(posts) // 2
+        _generate_prompt_batch(posts[:middle], errors)
+        _generate_prompt_batch(posts[middle:], errors)
+        return
+
+    missing = apply_batch_prompts(posts, parsed)
+    if missing:
+        _generate_prompt_batch(missing, errors)
+
+def apply_batch_prompts(posts, parsed):
+    """Save the prompts ``parsed`` has for ``posts``; return the posts it lacks."""
+    missing = []
+    for index, post in enumerate(posts, start=1):
+        prompts = parsed.get(f"p{index}")
+        if prompts is None:
+            missing.append(post)
+        else:
+            apply_prompts(post, prompts)
+    return missing
+
+def generate_prompts_batch(campaign_post_ids):
+    """
+    Generate prompts for many CampaignPosts with one chat request per
+    PROMPT_BATCH_SIZE posts instead of one per post. Items that fail to
+    parse are retried in smaller batches, down to the single-post path; a
+    request that got no response at all fails its whole batch once.
+    Returns ``{post_id: error}`` for the posts that still failed.
+    """
+    errors = {}
+    for batch in load_prompt_batches(campaign_post_ids):
+        _generate_prompt_batch(batch, errors)
+    return errors
+
+def load_prompt_batches(campaign_post_ids):
+    """Posts still missing prompts, split into PROMPT_BATCH_SIZE batches."""
+    batch_size = getattr(settings, 'PROMPT_BATCH_SIZE', DEFAULT_PROMPT_BATCH_SIZE)
+    posts = list(CampaignPost.objects.filter(id__in=campaign_post_ids, is_prompt_generated=False).order_by('scheduled_at'))
+    return [posts[start:start + batch_size] for start in range(0, len(posts), batch_size)]
 
 def generate_content_task(campaign_post_id):
     post = CampaignPost.objects.get(id=campaign_post_id)
 
     if post.is_prompt_generated and not post.is_content_generated:
-        text, image_url = generate_with_openai(post.text_prompt, post.image_prompt)
-        image_content_file = None
-
+        # Fresh content per post: identical prompts should still give varied posts.
+        text, image_url = generate_with_openai(post.text_prompt, post.image_prompt, cache=False)
+        image = downloads.download_or_none(image_url)
         try:
-            response = requests.get(image_url)
-            if response.status_code == 200:
-                image_content = response.content
-                parsed_url = urlparse(image_url)
-                filename = os.path.basename(parsed_url.path) or "generated_image.png"
-
-                image_content_file = ContentFile(image_content)
-                post.image_file.save(filename, image_content_file, save=False)
-            else:
-                print(f"Failed to download image: {response.status_code}")
-        except Exception as e:
-            print(f"Error downloading image: {e}")
+            saved = save_generated_content(post, text, image_url, image)
+        finally:
+            if image is not None:
+                image.close()
+        if saved:
+            cloudinary_cache.schedule(post.image_file, post.platform)
+
+def save_generated_content(post, text, image_url, image=None):
+    """
+    Store generated text/image on the CampaignPost and its library Post.
+    ``image`` is a downloads.DownloadedImage, or None if there is none.
+    Returns False, saving nothing, if the post was taken over by another
+    scheduler (its lease lapsed) or already has content.
+    """
+    with transaction.atomic():
+        won = CampaignPost.objects.filter(leases.writable(), id=post.id, is_content_generated=False).update(is_content_generated=True)
+        if not won:
+            print(f"Dropped content for CampaignPost ID {post.id}: already generated or leased elsewhere")
+            return False
+
+        if image is not None:
+            image.save_to(post.image_file)
 
         post.image_url = image_url
         post.text = text
@@ -183,10 +404,11 @@ def generate_content_task(campaign_post_id):
             platform=post.platform,
         )
 
-        if image_content_file:
-            post_obj.image_file.save(filename, image_content_file, save=False)
+        if image is not None:
+            image.save_to(post_obj.image_file)
 
         post_obj.save()
+    return True
 
 def get_credentials(user, platform):
     try:
@@ -194,59 +416,196 @@ def get_credentials(user, platform):
     except UserCredential.DoesNotExist:
         return None
 
+def preload_credentials(user_ids):
+    """
+    Fetch the UserCredential rows of many users in one query, as
+    ``{user_id: {platform: credential}}``. Pass a user's entry to
+    PostSocialMedia so publishing a whole tick costs a single query.
+    """
+    credentials = {user_id: {} for user_id in user_ids}
+    for cred in UserCredential.objects.filter(user_id__in=credentials.keys()):
+        credentials[cred.user_id][cred.platform] = cred
+    return credentials
+
+def step(func, *args, **kwargs):
+    """One blocking call of a platform's publish steps (see PostSocialMedia.publish_steps)."""
+    return func, args, kwargs
+
+def run_steps(steps):
+    """
+    Drive publish steps synchronously: each yielded call is made here and
+    its result (or exception) sent back into the generator.
+    """
+    value, error = None, None
+    while True:
+        try:
+            func, args, kwargs = steps.throw(error) if error else steps.send(value)
+        except StopIteration as stop:
+            return stop.value
+        value, error = None, None
+        try:
+            value = func(*args, **kwargs)
+        except Exception as e:
+            error = e
+
+class CredentialField:
+    """Reads one key of a platform's api_data the first time it is needed."""
+    def __init__(self, platform, key, default=None):
+        self.platform = platform
+        self.key = key
+        self.default = default
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return obj._api_data(self.platform).get(self.key, self.default)
+
+# Instagram publishes through the Facebook Graph API token.
+CREDENTIALS_USED = {"instagram": ("facebook", "instagram")}
+
 class PostSocialMedia():
-    def __init__(self, post, schedule_time=None, post_immediately=False):
+    # Facebook / Instagram
+    access_token = CredentialField("facebook", "access_token")
+    fb_page_id = CredentialField("facebook", "page_id")
+    instagram_user_id = CredentialField("instagram", "page_id")
+
+    # Twitter (X)
+    x_api_key = CredentialField("twitter", "api_key")
+    x_api_key_secret = CredentialField("twitter", "api_key_secret")
+    x_access_token = CredentialField("twitter", "access_token")
+    x_access_token_secret = CredentialField("twitter", "access_token_secret")
+    x_bearer_token = CredentialField("twitter", "bearer_token")
+
+    x_redirect_url = "http://127.0.0.1:8000/twitter/callback/"
+    x_scopes = "tweet.write users.read offline.access"
+    x_auth_url = "https://twitter.com/i/oauth2/authorize"
+    x_token_url = "https://api.twitter.com/2/oauth2/token"
+
+    # Reddit
+    reddit_client_id = CredentialField("reddit", "client_id")
+    reddit_client_secret = CredentialField("reddit", "client_secret")
+    reddit_username = CredentialField("reddit", "username")
+    reddit_password = CredentialField("reddit", "password")
+    subreddit = CredentialField("reddit", "subreddit", "test")
+
+    def __init__(self, post, schedule_time=None, post_immediately=False, credentials=None):
+        """
+        ``credentials`` is an optional ``{platform: UserCredential}`` map for
+        the post's user (see preload_credentials). Without it each platform's
+        credential is queried on first use, so a post only pays for the
+        platform it is published to.
+        """
         self.post = post
         self.message = self.post.text or "Check out this post!"
         self.schedule_time = int(schedule_time.timestamp()) if schedule_time else None
         self.post_immediately = post_immediately
         self.user = self.post.user
+        self._preloaded = credentials is not None
+        self._credentials = dict(credentials or {})
+        self.rate_limited = None
+
+    def _credential(self, platform):
+        if platform not in self._credentials:
+            self._credentials[platform] = None if self._preloaded else get_credentials(self.user, platform)
+        return self._credentials[platform]
+
+    def _api_data(self, platform):
+        cred = self._credential(platform)
+        return (cred.api_data if cred else None) or {}
+
+    @property
+    def fb_cred(self):
+        return self._credential("facebook")
+
+    @property
+    def insta_cred(self):
+        return self._credential("instagram")
+
+    @property
+    def tw_cred(self):
+        return self._credential("twitter")
+
+    @property
+    def reddit_cred(self):
+        return self._credential("reddit")
+
+    def _credential_key(self, platform):
+        cred = self._credential(platform)
+        return str(cred.id) if cred else f"user:{self.user.pk}"
+
+    def _request(self, platform, method, url, **kwargs):
+        # Every platform call goes through the shared per-credential bucket;
+        # a RateLimited error is remembered so publish() can defer the post.
+        key = self._credential_key(platform)
+        try:
+            ratelimit.acquire(platform, key)
+            response = http_client.request(method, url, **kwargs)
+            ratelimit.observe(platform, key, response)
+        except ratelimit.RateLimited as e:
+            self.rate_limited = e
+            raise
+        return response
 
-        # Facebook / Instagram
-        fb_cred = get_credentials(self.user, "facebook")
-        fb_data = fb_cred.api_data if fb_cred else {}
-        self.access_token = fb_data.get("access_token")
-        self.fb_page_id = fb_data.get("page_id")
-
-        insta_cred = get_credentials(self.user, "instagram")
-        fb_data = insta_cred.api_data if insta_cred else {}
-        self.instagram_user_id = fb_data.get("page_id")
-
-        # Twitter (X)
-        tw_cred = get_credentials(self.user, "twitter")
-        tw_data = tw_cred.api_data if tw_cred else {}
-        # self.x_client_id = tw_data.get("client_id")
-        self.x_api_key = tw_data.get("api_key")
-        self.x_api_key_secret = tw_data.get("api_key_secret")
-        self.x_access_token = tw_data.get("access_token")
-        self.x_access_token_secret = tw_data.get("access_token_secret")
-        self.x_bearer_token = tw_data.get("bearer_token")
-
-        self.x_redirect_url = "http://127.0.0.1:8000/twitter/callback/"
-        self.x_scopes = "tweet.write users.read offline.access"
-        self.x_auth_url = "https://twitter.com/i/oauth2/authorize"
-        self.x_token_url = "https://api.twitter.com/2/oauth2/token"
-
-        # Reddit
-        reddit_cred = get_credentials(self.user, "reddit")
-        reddit_data = reddit_cred.api_data if reddit_cred else {}
-        self.reddit_client_id = reddit_data.get("client_id")
-        self.reddit_client_secret = reddit_data.get("client_secret")
-        self.reddit_username = reddit_data.get("username")
-        self.reddit_password = reddit_data.get("password")
-        self.subreddit = reddit_data.get("subreddit", "test")
-
-        # Store credential objects if needed for updates
-        self.fb_cred = fb_cred
-        self.tw_cred = tw_cred
-        self.reddit_cred = reddit_cred
 
+    def publish(self, platform):
+        """
+        Publish to ``platform``. When the platform's rate limit is exhausted
+        the result carries ``deferred=True`` and ``retry_after`` instead of
+        counting as a failure, so callers can queue the post for later.
+        """
+        platform = (platform or "").lower()
+        handler = {
+            "facebook": self.post_to_facebook,
+            "instagram": self.post_to_instagram,
+            "twitter": self.post_to_twitter,
+            "reddit": self.post_to_reddit,
+        }.get(platform)
+        if handler is None:
+            return {"success": False, "message": f"Unsupported platform: {platform}"}
+        self.rate_limited = None
+        return self.publish_result(handler())
+
+    def publish_result(self, result):
+        if self.rate_limited and not result.get("success"):
+            return {
+                "success": False,
+                "deferred": True,
+                "retry_after": self.rate_limited.retry_after,
+                "message": str(self.rate_limited),
+            }
+        return result
+
+    def publish_steps(self, platform):
+        """
+        The publish steps of a plain-HTTP platform as a generator that
+        yields step() calls, so async_pipeline can make the requests on its
+        async client. None for platforms that need a sync client (Twitter's
+        OAuth1 signing).
+        """
+        platform = (platform or "").lower()
+        steps = {
+            "facebook": self.facebook_steps,
+            "instagram": self.instagram_steps,
+            "reddit": self.reddit_steps,
+        }.get(platform)
+        self.rate_limited = None
+        return steps() if steps else None
+
+    def load_credentials(self, platform):
+        """Fetch the credentials ``platform`` needs now, so publishing makes no queries."""
+        platform = (platform or "").lower()
+        for name in CREDENTIALS_USED.get(platform, (platform,)):
+            self._credential(name)
 
     def upload_image_and_get_url(self, image_file):
-        response = cloudinary.uploader.upload(image_file, resource_type="image")
-        return response.get('secure_url')
+        # Uploaded at most once per distinct image; usually done ahead of
+        # the slot by cloudinary_cache.schedule().
+        return cloudinary_cache.upload_url(image_file.name)
 
     def post_to_facebook(self):
+        return run_steps(self.facebook_steps())
+
+    def facebook_steps(self):
         url = f"https://graph.facebook.com/{self.fb_page_id}/photos"
         print(self.fb_page_id)
         files = None
@@ -263,11 +622,11 @@ class PostSocialMedia():
             if self.post.image_file:
                 with self.post.image_file.open("rb") as image:
                     files = {"source": image}
-                    response = requests.post(url, data=data, files=files)
+                    response = yield step(self._request, "facebook", "post", url, data=data, files=files)
             else:
                 if self.post.image_url:
                     data["url"] = self.post.image_url
-                response = requests.post(url, data=data)
+                response = yield step(self._request, "facebook", "post", url, data=data)
             if response.status_code != 200:
                 return {"success": False, "message": response.text}
             result = response.json()
@@ -280,10 +639,13 @@ class PostSocialMedia():
             return {"success": False, "message": str(e)}
 
     def post_to_instagram(self):
+        return run_steps(self.instagram_steps())
+
+    def instagram_steps(self):
         if self.post_immediately:
             image_url = None
             if self.post.image_file:
-                image_url = self.upload_image_and_get_url(self.post.image_file)
+                image_url = yield step(self.upload_image_and_get_url, self.post.image_file)
             elif self.post.image_url:
                 image_url = self.post.image_url
             if not image_url:
@@ -295,7 +657,7 @@ class PostSocialMedia():
                 "caption": self.message
             }
             try:
-                response = requests.post(url, data=data)
+                response = yield step(self._request, "instagram", "post", url, data=data)
                 if response.status_code != 200:
                     return {"success": False, "message": response.text}
                 result = response.json()
@@ -308,7 +670,7 @@ class PostSocialMedia():
                     "creation_id": creation_id,
                     "access_token": self.access_token
                 }
-                publish_res = requests.post(publish_url, data=publish_data)
+                publish_res = yield step(self._request, "instagram", "post", publish_url, data=publish_data)
                 if publish_res.status_code != 200:
                     return {"success": False, "message": publish_res.text}
                 pub_res = publish_res.json()
@@ -340,7 +702,8 @@ class PostSocialMedia():
         if self.post.image_file:
             try:
                 with open(self.post.image_file.path, "rb") as fp:
-                    upload_resp = requests.post(
+                    upload_resp = self._request(
+                        "twitter", "post",
                         "https://upload.twitter.com/1.1/media/upload.json",
                         files={"media": fp},
                         auth=auth,
@@ -364,7 +727,8 @@ class PostSocialMedia():
 
         print(payload)
         try:
-            tweet_resp = requests.post(
+            tweet_resp = self._request(
+                "twitter", "post",
                 "https://api.twitter.com/2/tweets",
                 json=payload, headers=headers
             )
@@ -373,17 +737,26 @@ class PostSocialMedia():
         except Exception as exc:
             return {"success": False, "message": f"Tweet failed: {exc}"}
         tweet_id = tweet_resp.json()["data"]["id"]
-        user_resp = requests.get("https://api.twitter.com/2/users/me", headers=headers, timeout=10).json()
-        username = user_resp["data"]["username"]
-        post_url = f"https://x.com/{username}/status/{tweet_id}"
+        # The tweet is live: a failed (or rate-limited) username lookup must
+        # not turn this into a failure, or the retry would post it twice.
+        post_url = f"https://x.com/i/web/status/{tweet_id}"
+        try:
+            user_resp = self._request("twitter", "get", "https://api.twitter.com/2/users/me", headers=headers, timeout=10).json()
+            post_url = f"https://x.com/{user_resp['data']['username']}/status/{tweet_id}"
+        except Exception as exc:
+            print(f"Could not look up the Twitter username for tweet {tweet_id}: {exc}")
 
         return {"success": True,
                 "message": "Tweet posted successfully",
                 "post_url": post_url}
 
     def post_to_reddit(self):
+        return run_steps(self.reddit_steps())
+
+    def reddit_steps(self):
         if self.post_immediately:
-            auth = requests.auth.HTTPBasicAuth(self.reddit_client_id, self.reddit_client_secret)
+            # HTTP basic auth as a tuple, which both requests and httpx accept.
+            auth = (self.reddit_client_id, self.reddit_client_secret)
             data = {
                 'grant_type': 'password',
                 'username': self.reddit_username,
@@ -392,7 +765,7 @@ class PostSocialMedia():
             headers = {'User-Agent': 'django-reddit-post-script/0.1'}
 
             try:
-                token_res = requests.post("https://www.reddit.com/api/v1/access_token", auth=auth, data=data, headers=headers)
+                token_res = yield step(self._request, "reddit", "post", "https://www.reddit.com/api/v1/access_token", auth=auth, data=data, headers=headers)
                 if token_res.status_code != 200:
                     return {"success": False, "message": token_res.text}
 
@@ -414,7 +787,7 @@ class PostSocialMedia():
                 # Handle image or text
                 image_url = None
                 if self.post.image_file:
-                    image_url = self.upload_image_and_get_url(self.post.image_file)
+                    image_url = yield step(self.upload_image_and_get_url, self.post.image_file)
                 elif self.post.image_url:
                     image_url = self.post.image_url
 
@@ -425,7 +798,7 @@ class PostSocialMedia():
                     payload["kind"] = "self"
                     payload["text"] = self.message
 
-                response = requests.post("https://oauth.reddit.com/api/submit", headers=post_headers, data=payload)
+                response = yield step(self._request, "reddit", "post", "https://oauth.reddit.com/api/submit", headers=post_headers, data=payload)
                 result = response.json()
 
                 if response.status_code != 200:
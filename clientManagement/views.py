@@ -1,7 +1,7 @@
 from collections import defaultdict
-from datetime import datetime
-import os
-import uuid
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, wait
+from django.urls import reverse
 from django.utils import timezone
 from django.utils.safestring import mark_safe
 from django.shortcuts import render, redirect, get_object_or_404
@@ -9,10 +9,14 @@ from django.contrib.auth import login, logout
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.views import View
 from django.contrib import messages
-from .utils import PostSocialMedia, generate_with_openai, get_credentials, build_random_prompt
-from .models import CampaignPost, Client, Post, ScheduledPost, UserCredential, Campaign
+from django.conf import settings
+from django.core.files.storage import default_storage
+from .utils import PostSocialMedia, generate_with_openai, get_credentials, build_random_prompt, stream_text, submit_image_generation
+from .providers import get_provider
+from .models import CampaignPost, Client, MediaBlob, Post, PostVariant, ScheduledPost, UserCredential, Campaign
+from . import cloudinary_cache, derivatives, downloads, http_client, image_proxy, media_store, openai_governor, suggestions
 from content_creator.prompt_generator import SocialMediaPromptGenerator
-from django.http import JsonResponse, HttpResponseBadRequest, HttpResponse
+from django.http import JsonResponse, HttpResponseBadRequest, HttpResponse, Http404, StreamingHttpResponse
 from django import forms
 from django.contrib.auth.models import User
 import requests
@@ -21,8 +25,7 @@ from django.utils.dateparse import parse_datetime, parse_date
 from django.utils.timezone import make_aware, is_naive
 import secrets, hashlib, base64
 from requests_oauthlib import OAuth1
-from urllib.parse import quote, urlparse
-from django.core.files.base import ContentFile
+from urllib.parse import quote
 
 class CustomUserCreationForm(UserCreationForm):
     email = forms.EmailField(required=True)
@@ -104,7 +107,7 @@ class DashboardView(View):
         scheduled = ScheduledPost.objects.filter(user=request.user)
         campaigns = Campaign.objects.filter(user=request.user)
 
-        recent_posts = posts[:3]
+        recent_posts = derivatives.annotate(posts[:3])
 
         context = {
             'admin_data': admin_data,
@@ -225,9 +228,15 @@ class GeneratePromptsView(View):
 
         if not user:
             return redirect('clientManagement:signup')
-        
+
+        # Served from the pre-generated pool when possible (see suggestions).
+        pooled = suggestions.take()
+        if pooled:
+            return JsonResponse(pooled)
+
         prompts = build_random_prompt()
-        text_prompt, _ = generate_with_openai(prompts)
+        with openai_governor.priority(openai_governor.INTERACTIVE):
+            text_prompt, _ = generate_with_openai(prompts, cache=False)
         prompts_data = json.loads(text_prompt)
         text_prompt = prompts_data.get("text_prompt", "")
         image_prompt = prompts_data.get("image_prompt", "")
@@ -237,6 +246,37 @@ class GeneratePromptsView(View):
             "image_prompt": image_prompt
         })
 
+class GeneratePromptsStreamView(View):
+    """Streaming variant of GeneratePromptsView; ends with a ``prompts`` event."""
+    def get(self, request):
+        user = Client.objects.filter(user=request.user).first()
+
+        if not user:
+            return redirect('clientManagement:signup')
+        return sse_response(self.events())
+
+    def events(self):
+        pooled = suggestions.take()
+        if pooled:
+            yield sse_event("prompts", pooled)
+            return
+
+        prompts = build_random_prompt()
+        text_parts = []
+        try:
+            with openai_governor.priority(openai_governor.INTERACTIVE):
+                for delta in stream_text(prompts):
+                    text_parts.append(delta)
+                    yield sse_event("token", {"text": delta})
+            prompts_data = json.loads("".join(text_parts))
+        except Exception as e:
+            yield sse_event("error", {"message": f"Prompt generation failed: {e}"})
+            return
+        yield sse_event("prompts", {
+            "text_prompt": prompts_data.get("text_prompt", ""),
+            "image_prompt": prompts_data.get("image_prompt", "")
+        })
+
 class EditImageView(View):
     template_name = "clientManagement/edit_image.html"
 
@@ -250,21 +290,97 @@ class EditImageView(View):
 
 def proxy_image(request):
     raw_url = request.GET.get('url')
+    if not raw_url:
+        return HttpResponseBadRequest("Missing image URL")
     if raw_url.startswith('/'):
         raw_url = request.build_absolute_uri(raw_url)
     if not raw_url.startswith(('http://', 'https://')):
         return HttpResponseBadRequest("Invalid image URL")
-    if not raw_url:
-        return HttpResponseBadRequest("Missing image URL")
     try:
-        response = requests.get(raw_url, stream=True)
-        if response.status_code == 200:
-            return HttpResponse(response.content, content_type=response.headers.get('Content-Type', 'image/png'))
-        else:
-            return HttpResponse(f"Failed to fetch image: {response.status_code}", status=502)
+        return image_proxy.respond(request, raw_url)
     except Exception as e:
         return HttpResponse(f"Error: {str(e)}", status=500)
 
+def local_provider_image(request, digest):
+    """Serve the PNGs the local AI provider hands out as image URLs."""
+    provider = get_provider()
+    if provider.name != 'local':
+        raise Http404("The local AI provider is not enabled.")
+    return HttpResponse(provider.render(digest), content_type="image/png")
+
+# Upper bound for the "variants" field of the post form.
+DEFAULT_MAX_POST_VARIANTS = 4
+
+def image_rendition(request, sha256, width, fmt):
+    """
+    Lazy fallback for a rendition the background pool has not made yet:
+    generate it now and redirect to the stored file.
+    """
+    blob = get_object_or_404(MediaBlob, sha256=sha256)
+    if width not in derivatives.widths() or fmt not in derivatives.formats():
+        raise Http404("Unknown image rendition.")
+    rendition = blob.renditions.get(fmt, {}).get(str(width))
+    if rendition is None or not default_storage.exists(rendition['name']):
+        derivatives.generate(blob)
+        rendition = blob.renditions.get(fmt, {}).get(str(width))
+    if rendition is None:
+        # Smaller than the requested width: the original is the best we have.
+        return redirect(default_storage.url(blob.name))
+    return redirect(default_storage.url(rendition['name']))
+
+def save_generated_post(user, text_prompt, image_prompt, text, image_url):
+    post = Post.objects.create(
+        user=user,
+        text_prompt=text_prompt,
+        image_prompt=image_prompt,
+        image_url=image_url,
+        text=text or "",
+        platform="manual"
+    )
+    image = downloads.download_or_none(image_url)
+    if image is not None:
+        with image:
+            image.save_to(post.image_file)
+    post.save()
+    return post
+
+def save_generated_variants(user, text_prompt, image_prompt, variants, default_url):
+    """
+    Store ``(text, image_url)`` variants as PostVariants of one new Post,
+    with the first one selected.
+    """
+    image_urls = [image_url or default_url for _, image_url in variants]
+    with ThreadPoolExecutor(max_workers=len(variants)) as executor:
+        images = list(executor.map(downloads.download_or_none, image_urls))
+
+    post = Post.objects.create(
+        user=user,
+        text_prompt=text_prompt,
+        image_prompt=image_prompt,
+        platform="manual"
+    )
+    saved = []
+    try:
+        for position, ((text, _), image_url, image) in enumerate(zip(variants, image_urls, images)):
+            variant = PostVariant(post=post, position=position, text=text or "", image_url=image_url)
+            if image is not None:
+                image.save_to(variant.image_file)
+            variant.save()
+            saved.append(variant)
+    finally:
+        for image in images:
+            if image is not None:
+                image.close()
+    post.select_variant(saved[0])
+    return post, saved
+
+def requested_variant_count(request):
+    try:
+        count = int(request.POST.get("variants", 1))
+    except ValueError:
+        count = 1
+    return max(1, min(count, getattr(settings, 'MAX_POST_VARIANTS', DEFAULT_MAX_POST_VARIANTS)))
+
 class SingleImageView(View):
     template_name = "clientManagement/gallery.html"
 
@@ -275,28 +391,28 @@ class SingleImageView(View):
         # 1) Generate remote URL from OpenAI
         default_url = "/static/404.jpg"
         image_url = default_url
+        text_generated = ""
+        variant_count = requested_variant_count(request)
+        if image_prompt and variant_count > 1:
+            with openai_governor.priority(openai_governor.INTERACTIVE):
+                variants = generate_with_openai(text_prompt, image_prompt, cache=False, n=variant_count)
+            post, saved = save_generated_variants(request.user, text_prompt, image_prompt, variants, default_url)
+            return render(request, self.template_name, {
+                "post_id": post.id,
+                "text_prompt": text_prompt,
+                "image_prompt": image_prompt,
+                "image": post.image_file.url if post.image_file else post.image_url,
+                "text": post.text,
+                "variants": saved,
+            })
+
         if image_prompt:
-            text_generated, generated_url = generate_with_openai(text_prompt,image_prompt)
+            with openai_governor.priority(openai_governor.INTERACTIVE):
+                text_generated, generated_url = generate_with_openai(text_prompt, image_prompt, cache=False)
             if generated_url:
                 image_url = generated_url
 
-        post = Post.objects.create(
-            user=request.user,
-            text_prompt=text_prompt,
-            image_prompt=image_prompt,
-            image_url=image_url,
-            text=text_generated if text_generated else "",
-            platform="manual"
-        )
-        response = requests.get(image_url)
-        if response.status_code == 200:
-            image_content = response.content
-            parsed_url = urlparse(image_url)
-            filename = os.path.basename(parsed_url.path) or "generated_image.png"
-
-            image_content_file = ContentFile(image_content)
-            post.image_file.save(filename, image_content_file, save=False)
-        post.save()
+        post = save_generated_post(request.user, text_prompt, image_prompt, text_generated, image_url)
 
         return render(request, self.template_name, {
             "post_id": post.id,
@@ -306,6 +422,66 @@ class SingleImageView(View):
             "text": text_generated if text_generated else "",
         })
 
+class SelectVariantView(View):
+    def post(self, request, post_id, variant_id):
+        post = get_object_or_404(Post, id=post_id, user=request.user)
+        variant = get_object_or_404(PostVariant, id=variant_id, post=post)
+        post.select_variant(variant)
+        messages.success(request, f"Variant {variant.position + 1} selected.")
+        return redirect('clientManagement:content_library')
+
+# Seconds between keep-alive comments while a stream waits on OpenAI.
+SSE_HEARTBEAT = 5
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def sse_response(events):
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+class SingleImageStreamView(View):
+    """
+    Streaming variant of SingleImageView. The post text is sent as
+    Server-Sent Events (``token``) while OpenAI generates it, the image is
+    generated alongside, and an ``image`` event follows once it is stored.
+    """
+    def post(self, request):
+        text_prompt = request.POST.get("text_prompt", "")
+        image_prompt = request.POST.get("image_prompt", "")
+        return sse_response(self.events(request.user, text_prompt, image_prompt))
+
+    def events(self, user, text_prompt, image_prompt):
+        yield sse_event("status", {"message": "Generating text..."})
+        with openai_governor.priority(openai_governor.INTERACTIVE):
+            image_future = submit_image_generation(image_prompt) if image_prompt else None
+
+            text_parts = []
+            if text_prompt:
+                try:
+                    for delta in stream_text(text_prompt):
+                        text_parts.append(delta)
+                        yield sse_event("token", {"text": delta})
+                except Exception as e:
+                    yield sse_event("error", {"message": f"Text generation failed: {e}"})
+
+        image_url = "/static/404.jpg"
+        if image_future is not None:
+            yield sse_event("status", {"message": "Generating image..."})
+            while not wait([image_future], timeout=SSE_HEARTBEAT).done:
+                yield ": keep-alive\n\n"
+            image_url = image_future.result() or image_url
+
+        post = save_generated_post(user, text_prompt, image_prompt, "".join(text_parts), image_url)
+        yield sse_event("image", {
+            "post_id": str(post.id),
+            "image_url": post.image_file.url if post.image_file else image_url,
+            "edit_url": reverse("clientManagement:edit_image", args=[post.id]),
+        })
+        yield sse_event("done", {"text": post.text})
+
 REDIRECT_URI = "http://127.0.0.1:8000/twitter/callback/"
 SCOPES = "tweet.read tweet.write users.read offline.access"
 AUTH_URL = "https://twitter.com/i/oauth2/authorize"
@@ -357,7 +533,7 @@ class TwitterCallback(View):
         }
 
         try:
-            response = requests.post(TOKEN_URL, data=data, headers=headers)
+            response = http_client.post(TOKEN_URL, data=data, headers=headers)
             result = response.json()
         except requests.RequestException as e:
             return JsonResponse({
@@ -400,7 +576,7 @@ class ContentLibraryView(View):
     template_name = 'clientManagement/content_library.html'
 
     def get(self, request):
-        posts = Post.objects.filter(user=request.user).order_by('-created_on')
+        posts = derivatives.annotate(Post.objects.filter(user=request.user).order_by('-created_on'))
         return render(request, self.template_name, {
             'posts': posts,
         })
@@ -408,8 +584,12 @@ class ContentLibraryView(View):
     def post(self, request):
         post_id = request.POST.get("post_id")
         post = get_object_or_404(Post, id=post_id, user=request.user)
-        if post.image_file:
-            post.image_file.delete(save=False)
+        # Stored images may be shared with other posts and variants; their
+        # blobs are released on delete and reclaimed by the media sweeper.
+        # Only files saved before the media store existed are removed here.
+        files = {f.name: f for f in [post.image_file] + [v.image_file for v in post.variants.all()] if f and not media_store.is_blob(f.name)}
+        for image_file in files.values():
+            image_file.delete(save=False)
         post.delete()
         return redirect('clientManagement:content_library')
 
@@ -419,7 +599,7 @@ class SchedulingView(View):
     def get(self, request):
         posts = Post.objects.filter(user=request.user)
         now = timezone.now()
-        ScheduledPost.objects.filter(user=request.user, scheduled_time__lt=now).delete()
+        ScheduledPost.objects.filter(user=request.user, scheduled_time__lt=now, posted=True).delete()
         scheduled_posts = ScheduledPost.objects.filter(
             user=request.user,
             scheduled_time__gte=now
@@ -454,36 +634,39 @@ class ScheduleSubmitView(View):
         else:
             schedule_time = timezone.now()
 
-        media = PostSocialMedia(post, schedule_time, post_immediately)
-        if platform == "facebook":
-            result = media.post_to_facebook()
-            post.platform = "facebook"
-        elif platform == "instagram":
-            result = media.post_to_instagram()
-            post.platform = "instagram"
-        elif platform =="twitter":
-            if not request.session.get("twitter_access_token"):
+        # Facebook schedules natively; other platforms are published by the
+        # scheduler when the slot comes up, as are posts held back by the
+        # platform's rate limit.
+        posted = False
+        if post_immediately or platform == "facebook":
+            if platform == "twitter" and not request.session.get("twitter_access_token"):
                 return redirect("/twitter/login")
-            result = media.post_to_twitter()
-            post.platform = "twitter"
-        elif platform == "reddit":
-            result = media.post_to_reddit()
-            post.platform = "reddit"
-
-        if result.get("success"):
-            post_url = result.get("post_url")
-            post.external_post = post_url
-            post.save()
-            print("Post URL:", post_url)
-        else:
-            print("Post failed:", result.get("message"))
+            media = PostSocialMedia(post, schedule_time, post_immediately)
+            result = media.publish(platform)
+
+            if result.get("success"):
+                post_url = result.get("post_url")
+                post.platform = platform
+                post.external_post = post_url
+                post.save()
+                posted = True
+                print("Post URL:", post_url)
+            elif result.get("deferred"):
+                messages.info(request, "The platform's rate limit was reached; the post has been queued.")
+                print("Post deferred:", result.get("message"))
+            else:
+                print("Post failed:", result.get("message"))
 
         ScheduledPost.objects.create(
             post=post,
             user=request.user,
             scheduled_time=schedule_time,
-            platform=platform
+            platform=platform,
+            posted=posted,
+            published_at=timezone.now() if posted and post_immediately else None,
         )
+        if not posted:
+            cloudinary_cache.schedule(post.image_file, platform)
 
         return redirect('clientManagement:schedule')
 
@@ -500,24 +683,27 @@ class ScheduleUpdateView(View):
             schedule.scheduled_time = new_time
         schedule.platform = platform
         schedule.save()
+        if not schedule.posted:
+            cloudinary_cache.schedule(schedule.post.image_file, platform)
         return redirect('clientManagement:schedule')
 
 class NewPostView(View):
     template_name = 'clientManagement/new_post.html'
 
     def get(self, request):
-        return render(request, self.template_name)
+        max_variants = getattr(settings, 'MAX_POST_VARIANTS', DEFAULT_MAX_POST_VARIANTS)
+        return render(request, self.template_name, {
+            'variant_choices': range(1, max_variants + 1),
+        })
 
 class ApplyEditView(View):
     def post(self, request, post_id):
         post = get_object_or_404(Post, id=post_id, user=request.user)
 
         if 'edited_image' in request.FILES:
-            post.image_file.save(
-                f"{uuid.uuid4().hex}.png",
-                request.FILES['edited_image'],
-                save=True
-            )
+            # The previous image's blob is released when the post is saved.
+            media_store.store_upload(post.image_file, request.FILES['edited_image'])
+            post.save()
 
         if 'text' in request.POST:
             post.text = request.POST['text']
@@ -595,6 +781,8 @@ class CreateCampaignView(View):
         start_date = parse_date(request.POST.get('start_date'))
         end_date = parse_date(request.POST.get('end_date'))
         max_posts = int(request.POST.get('max_posts_per_day', 5))
+        horizon_hours = request.POST.get('generation_horizon_hours')
+        generation_horizon = timedelta(hours=int(horizon_hours)) if horizon_hours else None
 
         campaign_id = request.POST.get('campaign_id')
         if campaign_id:
@@ -604,6 +792,7 @@ class CreateCampaignView(View):
             campaign.start_date = start_date
             campaign.end_date = end_date
             campaign.max_posts_per_day = max_posts
+            campaign.generation_horizon = generation_horizon
             campaign.save()
             campaign.posts.all().delete()
         else:
@@ -613,7 +802,8 @@ class CreateCampaignView(View):
                 description=description,
                 start_date=start_date,
                 end_date=end_date,
-                max_posts_per_day=max_posts
+                max_posts_per_day=max_posts,
+                generation_horizon=generation_horizon
             )
         for key in request.POST:
             if key.startswith('schedule_'):
@@ -669,7 +859,7 @@ class VerifyMedia():
         url = f"https://graph.facebook.com/v22.0/{page_id}?access_token={access_token}"
 
         try:
-            response = requests.get(url)
+            response = http_client.get(url)
 
             if response.status_code != 200:
                 return JsonResponse({
@@ -704,7 +894,7 @@ class VerifyMedia():
                 return JsonResponse({"success": False, "message": "Missing access token or page ID."})
 
             url = f"https://graph.facebook.com/v22.0/{page_id}?access_token={access_token}"
-            response = requests.get(url)
+            response = http_client.get(url)
 
             if response.status_code != 200:
                 return JsonResponse({"success": False, "message": response.json().get("error", {}).get("message", "Unknown error")})
@@ -722,7 +912,7 @@ class VerifyMedia():
                 self.api_data["access_token_secret"]
             )
 
-            response = requests.get("https://api.twitter.com/1.1/account/verify_credentials.json", auth=auth)
+            response = http_client.get("https://api.twitter.com/1.1/account/verify_credentials.json", auth=auth)
 
             if response.status_code != 200:
                 return {"success": False, "message": response.text}
@@ -756,7 +946,7 @@ class VerifyMedia():
 
             headers = {'User-Agent': 'django-reddit-verification/0.1'}
 
-            token_res = requests.post("https://www.reddit.com/api/v1/access_token",
+            token_res = http_client.post("https://www.reddit.com/api/v1/access_token",
                                       auth=auth, data=data, headers=headers)
 
             if token_res.status_code != 200:
@@ -773,7 +963,7 @@ class VerifyMedia():
                 "User-Agent": "django-reddit-verification/0.1"
             }
 
-            me_response = requests.get("https://oauth.reddit.com/api/v1/me", headers=user_headers)
+            me_response = http_client.get("https://oauth.reddit.com/api/v1/me", headers=user_headers)
             if me_response.status_code != 200:
                 return {"success": False, "message": "Access token is invalid."}
 
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -73,6 +74,201 @@ DATABASES = {
 #     },
 # }
 
+# Campaign scheduler
+# Run it with `python manage.py run_scheduler`. Set SCHEDULER_AUTOSTART=true
+# in the environment to also start it inside every web process instead.
+SCHEDULER_AUTOSTART = os.getenv('SCHEDULER_AUTOSTART', '').lower() in ('1', 'true', 'yes')
+SCHEDULER_HEALTH_FILE = os.getenv('SCHEDULER_HEALTH_FILE')
+# Worker pool shared by every tick, per-stage concurrency caps and the time a
+# tick waits for its jobs before reporting the rest as carried over.
+SCHEDULER_MAX_WORKERS = 16
+SCHEDULER_STAGE_LIMITS = {
+    'publish': 8,
+    'prompt': 4,
+    'content': 4,
+    'scheduled': 4,
+    'catchup': 2,
+}
+SCHEDULER_TICK_DEADLINE = 15
+
+# 'threads' runs tick jobs on the worker pool above; 'asyncio' runs them as
+# coroutines on one event loop (OpenAI calls and Facebook/Instagram/Reddit
+# publishing go through httpx), with ASYNC_STAGE_LIMITS jobs in flight per
+# stage. Twitter (OAuth1), Cloudinary uploads and image downloads run on
+# ASYNC_BLOCKING_WORKERS threads.
+SCHEDULER_EXECUTION_MODE = os.getenv('SCHEDULER_EXECUTION_MODE', 'threads')
+ASYNC_STAGE_LIMITS = {
+    'publish': 64,
+    'prompt': 16,
+    'content': 128,
+    'scheduled': 64,
+    'catchup': 16,
+}
+ASYNC_MAX_CONNECTIONS = 200
+ASYNC_BLOCKING_WORKERS = 16
+# Scheduler processes lease due CampaignPosts before working on them, so any
+# number of workers or nodes can run the scheduler side by side. Leases of
+# running jobs are renewed every third of SCHEDULER_LEASE_SECONDS, so only a
+# dead process loses its rows; results of a job whose lease was taken over
+# anyway are dropped.
+SCHEDULER_LEASE_SECONDS = 300
+SCHEDULER_CLAIM_BATCH = 50
+# The scheduler sleeps until the next known deadline. It reloads deadlines
+# within SCHEDULER_LOOKAHEAD seconds when campaigns or schedules change (the
+# web processes bump a database change marker it polls every
+# SCHEDULER_CHANGE_POLL seconds), and at least every SCHEDULER_MAX_IDLE
+# seconds.
+SCHEDULER_LOOKAHEAD = 3600
+SCHEDULER_MAX_IDLE = 30
+SCHEDULER_CHANGE_POLL = 1
+# A tick that claimed a full SCHEDULER_CLAIM_BATCH is followed by another one
+# straight away; SCHEDULER_RETRY_INTERVAL is only the back-off for due posts
+# that are leased elsewhere or failing.
+SCHEDULER_RETRY_INTERVAL = 20
+SCHEDULER_DEADLINE_LIMIT = 1000
+# Posts that missed their slot (e.g. while the scheduler was down) are
+# generated and published late if they are at most SCHEDULER_CATCHUP_GRACE
+# seconds overdue, SCHEDULER_CATCHUP_BATCH per tick. Older ones follow
+# SCHEDULER_STALE_POLICY: 'skip' dead-letters them, 'keep' leaves them be.
+SCHEDULER_CATCHUP_GRACE = 6 * 3600
+SCHEDULER_CATCHUP_BATCH = 20
+SCHEDULER_STALE_POLICY = 'skip'
+
+# Per-credential publish quotas, kept just under each platform's limit.
+# Callers queue for up to RATE_LIMIT_MAX_WAIT seconds before the post is
+# deferred to a later scheduler tick. With RATE_LIMIT_SHARED the buckets live
+# in the database, so web processes and `run_scheduler` share one quota;
+# turn it off only when everything publishes from a single process.
+PLATFORM_RATE_LIMITS = {
+    'facebook': {'requests': 180, 'per': 3600, 'burst': 10},
+    'instagram': {'requests': 180, 'per': 3600, 'burst': 10},
+    'twitter': {'requests': 180, 'per': 900, 'burst': 5},
+    'reddit': {'requests': 90, 'per': 60, 'burst': 10},
+}
+RATE_LIMIT_MAX_WAIT = 10
+RATE_LIMIT_SHARED = True
+
+# Prompts and media are precomputed up to GENERATION_HORIZON seconds before
+# each slot (overridable per campaign) at a steady GENERATION_RATE_PER_MINUTE.
+# Set GENERATION_PRECOMPUTE_HOURS to a list of UTC hours to keep that work
+# off-peak.
+GENERATION_HORIZON = 24 * 3600
+GENERATION_RATE_PER_MINUTE = 6
+GENERATION_PRECOMPUTE_HOURS = None
+
+# Outbound HTTP calls share a keep-alive pool per host (clientManagement.
+# http_client). Calls without their own timeout get these connect/read
+# timeouts in seconds; HTTP_POOL_SIZE defaults to SCHEDULER_MAX_WORKERS.
+HTTP_CONNECT_TIMEOUT = 5
+HTTP_READ_TIMEOUT = 30
+HTTP_POOL_SIZE = None
+
+# Generated images are streamed to a temporary file before they are saved;
+# downloads larger than IMAGE_DOWNLOAD_MAX_BYTES or slower than
+# IMAGE_DOWNLOAD_DEADLINE seconds in total are abandoned.
+IMAGE_DOWNLOAD_MAX_BYTES = 20 * 1024 * 1024
+IMAGE_DOWNLOAD_DEADLINE = 60
+
+# Images are stored once per distinct content under MEDIA_BLOB_DIR (named
+# by sha256) and shared by every post that uses them. The scheduler process
+# deletes blobs nothing has referenced for MEDIA_SWEEP_GRACE seconds,
+# checking every MEDIA_SWEEP_INTERVAL seconds.
+MEDIA_BLOB_DIR = 'generated_images/blobs'
+MEDIA_SWEEP_INTERVAL = 3600
+MEDIA_SWEEP_GRACE = 3600
+
+# Resized copies of stored images, made in the background when an image is
+# saved (or on first request) and offered to the content library and
+# dashboard through srcset. Formats Pillow cannot encode are skipped.
+IMAGE_RENDITION_WIDTHS = (320, 640)
+IMAGE_RENDITION_FORMATS = ('avif', 'webp')
+IMAGE_RENDITION_QUALITY = 75
+IMAGE_RENDITION_WORKERS = 2
+IMAGE_RENDITION_DIR = 'generated_images/renditions'
+
+# /image-proxy/ keeps upstream images in an on-disk LRU cache of at most
+# IMAGE_PROXY_CACHE_MAX_BYTES. Entries older than IMAGE_PROXY_FRESH_SECONDS
+# are revalidated upstream with ETag/Last-Modified; browsers may reuse a
+# response for IMAGE_PROXY_BROWSER_MAX_AGE seconds and then get a 304.
+IMAGE_PROXY_CACHE_DIR = BASE_DIR / 'cache' / 'image_proxy'
+IMAGE_PROXY_CACHE_MAX_BYTES = 200 * 1024 * 1024
+IMAGE_PROXY_FRESH_SECONDS = 3600
+IMAGE_PROXY_BROWSER_MAX_AGE = 86400
+
+# Instagram and Reddit take images by URL, so they are uploaded to
+# Cloudinary once per distinct image (public id CLOUDINARY_PUBLIC_ID_PREFIX/
+# <sha256>) and the URL is reused for every platform, retry and
+# re-schedule. With CLOUDINARY_PREUPLOAD the upload happens in the
+# background as soon as content is generated or a post is scheduled.
+CLOUDINARY_PUBLIC_ID_PREFIX = 'generated'
+CLOUDINARY_PREUPLOAD = True
+CLOUDINARY_PREUPLOAD_WORKERS = 2
+
+# Timeouts (seconds) for the OpenAI chat and image requests, which run
+# concurrently for each generation.
+OPENAI_TEXT_TIMEOUT = 30
+OPENAI_IMAGE_TIMEOUT = 120
+
+# Backend behind generate_with_openai: 'openai', or 'local' for a
+# deterministic offline stand-in (valid prompt JSON, small PNGs served from
+# /local-provider/images/) used for load tests and benchmarks. Its latency
+# is drawn from LOCAL_PROVIDER_*_LATENCY = (mean, stddev) seconds and
+# LOCAL_PROVIDER_ERROR_RATE of its calls fail; LOCAL_PROVIDER_SEED makes
+# those draws repeatable.
+AI_PROVIDER = os.getenv('AI_PROVIDER', 'openai')
+LOCAL_PROVIDER_TEXT_LATENCY = (0.5, 0.1)
+LOCAL_PROVIDER_IMAGE_LATENCY = (2.0, 0.5)
+LOCAL_PROVIDER_ERROR_RATE = 0.0
+LOCAL_PROVIDER_SEED = None
+LOCAL_PROVIDER_BASE_URL = os.getenv('LOCAL_PROVIDER_BASE_URL', 'http://127.0.0.1:8000')
+LOCAL_PROVIDER_IMAGE_SIZE = 64
+
+# Concurrent OpenAI requests per endpoint. Queued requests are admitted
+# interactive first, then due-soon scheduler work, then precompute. With
+# OPENAI_GOVERNOR_SHARED the limits hold across processes via the database
+# (slots left by a crashed process free up after OPENAI_SLOT_LEASE seconds).
+OPENAI_CONCURRENCY = {'chat': 8, 'image': 4}
+OPENAI_GOVERNOR_SHARED = False
+OPENAI_SLOT_LEASE = 300
+
+# Most caption/image variants a user can request from one post generation.
+# Their captions come from a single chat request (``n`` choices) and their
+# images are generated concurrently.
+MAX_POST_VARIANTS = 4
+
+# Campaign post prompts are generated this many per chat request; posts the
+# model answers badly are retried in smaller batches, down to one.
+PROMPT_BATCH_SIZE = 20
+
+# "Generate AI Content" suggestions are served from a pool of pre-generated
+# prompt pairs shared by every web process (PromptSuggestion rows). Only
+# `run_scheduler` refills it: every SUGGESTION_REFILL_INTERVAL seconds, once
+# it drops below SUGGESTION_POOL_LOW_WATER, up to SUGGESTION_POOL_SIZE for
+# the whole deployment.
+SUGGESTION_POOL_ENABLED = True
+SUGGESTION_POOL_SIZE = 50
+SUGGESTION_POOL_LOW_WATER = 10
+SUGGESTION_REFILL_CONCURRENCY = 2
+SUGGESTION_REFILL_INTERVAL = 60
+
+# OpenAI responses are cached in PromptLog, keyed by a hash of the model,
+# normalized prompt and parameters. Entries live OPENAI_CACHE_TTL seconds
+# (OPENAI_IMAGE_CACHE_TTL when they carry an image URL, which OpenAI
+# expires) and the least recently used are evicted past
+# OPENAI_CACHE_MAX_ENTRIES.
+OPENAI_CACHE_ENABLED = True
+OPENAI_CACHE_TTL = 7 * 24 * 3600
+OPENAI_IMAGE_CACHE_TTL = 45 * 60
+OPENAI_CACHE_MAX_ENTRIES = 5000
+
+# Failed generation/publish attempts back off exponentially (with jitter)
+# from PUBLISH_RETRY_BASE up to PUBLISH_RETRY_CAP seconds; after
+# PUBLISH_MAX_ATTEMPTS the post is dead-lettered and can be re-driven from
+# the admin.
+PUBLISH_RETRY_BASE = 30
+PUBLISH_RETRY_CAP = 3600
+PUBLISH_MAX_ATTEMPTS = 6
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 